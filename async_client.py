@@ -0,0 +1,271 @@
+#!/usr/bin/python
+#
+# async_client - an event loop based counterpart to TumblrClient
+import oauth2 as oauth
+import urlparse
+
+import connection_pool
+import tumblr_client
+
+# asyncio is only available on Python 2 through the trollius backport, which
+# is an optional dependency of tum.
+try:
+  import trollius as asyncio
+  from trollius import From, Return
+except ImportError:
+  asyncio = None
+
+# Contains the default number of requests allowed in flight at once.
+DEFAULT_MAX_CONCURRENCY = 100
+
+# Contains the maximum number of idle keep-alive connections kept per host.
+DEFAULT_MAX_IDLE_PER_HOST = 32
+
+
+def _Coroutine(func):
+  """
+  Marks a function as a coroutine, when an event loop library is available.
+  """
+  if asyncio is None:
+    return func
+  return asyncio.coroutine(func)
+
+
+class AsyncTumblrClient(object):
+  """
+  Handles interaction with the Tumblr API from within an asyncio event loop.
+
+  Requests are signed with the same oauth2 code as TumblrClient, but are sent
+  over non-blocking keep-alive connections, so that thousands of them can be
+  in flight from a single thread.  A semaphore bounds how many run at once.
+  """
+
+  def __init__(self, api_key, oauth_token, oauth_token_secret, api_server,
+      max_concurrency=DEFAULT_MAX_CONCURRENCY, loop=None):
+    """
+    Initializes the client.
+
+    Args:
+      api_key - string containing Tumblr API key
+      oauth_token - string containing public OAuth token
+      oauth_token_secret - string containing OAuth token secret
+      api_server - string containing hostname of Tumblr API server
+      max_concurrency - maximum number of requests in flight at once
+      loop - event loop to run on, defaulting to the current one
+    """
+
+    if asyncio is None:
+      raise tumblr_client.TumError(
+          "The asynchronous client requires the trollius package.")
+    self.api_key = api_key
+    self.api_server = api_server
+    self.oauth_token = oauth_token
+    self.oauth_token_secret = oauth_token_secret
+    self.consumer = oauth.Consumer(key=self.oauth_token,
+        secret=self.oauth_token_secret)
+    self.signature_method = oauth.SignatureMethod_HMAC_SHA1()
+    self.loop = loop or asyncio.get_event_loop()
+    self.semaphore = asyncio.Semaphore(max_concurrency, loop=self.loop)
+    self._idle = {}
+
+  def _sign(self, method, url, params):
+    """
+    Builds a signed oauth2.Request, returning the URL and body to send.
+    """
+    req = oauth.Request.from_consumer_and_token(self.consumer,
+        http_method=method, http_url=url, parameters=params,
+        is_form_encoded=(method == "POST"))
+    req.sign_request(self.signature_method, self.consumer, None)
+    if method == "POST":
+      return url, req.to_postdata()
+    return req.to_url(), ""
+
+  @_Coroutine
+  def _connect(self, host, port):
+    idle = self._idle.get((host, port))
+    while idle:
+      reader, writer = idle.pop()
+      if not reader.at_eof():
+        raise Return(reader, writer, True)
+      writer.close()
+    reader, writer = yield From(asyncio.open_connection(host, port,
+        loop=self.loop))
+    raise Return(reader, writer, False)
+
+  def _release(self, host, port, reader, writer):
+    idle = self._idle.setdefault((host, port), [])
+    if len(idle) < DEFAULT_MAX_IDLE_PER_HOST:
+      idle.append((reader, writer))
+    else:
+      writer.close()
+
+  @_Coroutine
+  def _read_body(self, reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+      chunks = []
+      while True:
+        size_line = yield From(reader.readline())
+        size = int(size_line.split(";", 1)[0].strip(), 16)
+        if not size:
+          # Skips any trailers, up to the terminating blank line.
+          while (yield From(reader.readline())) not in ("\r\n", "\n", ""):
+            pass
+          break
+        chunk = yield From(reader.readexactly(size))
+        chunks.append(chunk)
+        yield From(reader.readline())
+      raise Return("".join(chunks))
+    if "content-length" in headers:
+      body = yield From(reader.readexactly(int(headers["content-length"])))
+      raise Return(body)
+    body = yield From(reader.read())
+    raise Return(body)
+
+  @_Coroutine
+  def _exchange(self, method, host, port, request_uri, body):
+    """
+    Sends a single request, returning its status, headers and body.
+    """
+    reader, writer, reused = yield From(self._connect(host, port))
+    lines = [
+      "%s %s HTTP/1.1" % (method, request_uri),
+      "Host: %s" % self.api_server,
+      "Content-Length: %d" % len(body),
+    ]
+    if method == "POST":
+      lines.append("Content-Type: application/x-www-form-urlencoded")
+    sent = False
+    keep_alive = False
+    try:
+      writer.write("\r\n".join(lines) + "\r\n\r\n" + body)
+      yield From(writer.drain())
+      sent = True
+      status_line = yield From(reader.readline())
+      if not status_line:
+        raise EOFError("Connection closed by server")
+      status = status_line.split(" ", 2)[1]
+      headers = {}
+      while True:
+        line = yield From(reader.readline())
+        if line in ("\r\n", "\n", ""):
+          break
+        name, value = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+      content = yield From(self._read_body(reader, headers))
+      # A body delimited by neither its length nor chunking ends only when
+      # the server closes the connection, which cannot then be reused.
+      keep_alive = (headers.get("connection", "").lower() != "close" and
+          ("content-length" in headers or
+          headers.get("transfer-encoding", "").lower() == "chunked"))
+    except (EOFError, IOError, asyncio.IncompleteReadError):
+      # Idle connections may have been dropped by the server, so the request
+      # is retried once over a fresh connection.  Once it has been sent in
+      # full, the server may have acted on it, so only requests which are
+      # safe to repeat are sent again.
+      if not reused or (sent and
+          method not in connection_pool.IDEMPOTENT_METHODS):
+        raise
+    else:
+      raise Return(status, headers, content)
+    finally:
+      # Closes the connection on any failure, including cancellation, so
+      # that it is neither leaked nor reused part way through a response.
+      if keep_alive:
+        self._release(host, port, reader, writer)
+      else:
+        writer.close()
+    result = yield From(self._exchange(method, host, port, request_uri, body))
+    raise Return(result)
+
+  @_Coroutine
+  def _request(self, method, path, params, action):
+    url = tumblr_client.TUMBLR_API_URL % (self.api_server, path)
+    url, body = self._sign(method, url, params)
+    parts = urlparse.urlsplit(url)
+    # Signed URLs are fully percent-encoded, so they are safe to send as ASCII.
+    request_uri = str(parts.path)
+    if parts.query:
+      request_uri = "%s?%s" % (request_uri, str(parts.query))
+    with (yield From(self.semaphore)):
+      status, headers, content = yield From(self._exchange(method,
+          parts.hostname, parts.port or 80, request_uri, body))
+    raise Return(tumblr_client.ParseApiResponse(status, content, action))
+
+  @_Coroutine
+  def create_post(self, blog, params={}):
+    """
+    Creates a post at the supplied blog address.
+
+    Args:
+      blog - string containing the name of the blog to create a post against
+      params - dictionary containing parameters
+    """
+
+    result = yield From(self._request("POST", "blog/%s/post" % blog, params,
+        "Post creation"))
+    raise Return(result)
+
+  @_Coroutine
+  def _get(self, path, params, action):
+    params = dict(params, api_key=self.api_key)
+    result = yield From(self._request("GET", path, params, action))
+    raise Return(result)
+
+  @_Coroutine
+  def blog_info(self, blog):
+    """
+    Returns general information about a blog.
+    """
+    result = yield From(self._get("blog/%s/info" % blog, {}, "Blog info"))
+    raise Return(result)
+
+  @_Coroutine
+  def posts(self, blog, post_type=None, **params):
+    """
+    Returns a page of a blog's posts.
+
+    Args:
+      blog - string containing the name of the blog to read from
+      post_type - string restricting the results to a single post type
+      params - additional API parameters, such as offset, limit and tag
+    """
+
+    path = "blog/%s/posts" % blog
+    if post_type:
+      path = "%s/%s" % (path, post_type)
+    result = yield From(self._get(path, params, "Post retrieval"))
+    raise Return(result)
+
+  @_Coroutine
+  def dashboard(self, **params):
+    """
+    Returns a page of the authenticated user's dashboard.
+    """
+    result = yield From(self._get("user/dashboard", params,
+        "Dashboard retrieval"))
+    raise Return(result)
+
+  @_Coroutine
+  def likes(self, **params):
+    """
+    Returns a page of the authenticated user's liked posts.
+    """
+    result = yield From(self._get("user/likes", params, "Likes retrieval"))
+    raise Return(result)
+
+  @_Coroutine
+  def user_info(self):
+    """
+    Returns information about the authenticated user.
+    """
+    result = yield From(self._get("user/info", {}, "User info"))
+    raise Return(result)
+
+  def close(self):
+    """
+    Closes every idle connection held by the client.
+    """
+    for idle in self._idle.values():
+      for reader, writer in idle:
+        writer.close()
+    self._idle.clear()
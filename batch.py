@@ -0,0 +1,217 @@
+#!/usr/bin/python
+#
+# batch - sends many posts through a pool of worker threads
+import json
+import Queue
+import threading
+import time
+
+from collections import namedtuple
+
+import tumblr_client
+
+# Contains the default number of worker threads used for batch posting.
+DEFAULT_WORKERS = 4
+
+# Contains the number of pending items buffered per worker; this bounds how far
+# the manifest reader can run ahead of the workers.
+QUEUE_DEPTH_PER_WORKER = 2
+
+# Describes the outcome of posting a single item from a batch.
+BatchResult = namedtuple("BatchResult",
+    ["index", "blog", "ok", "error", "elapsed"])
+
+
+def _EncodeValue(value):
+  """
+  Converts a value decoded from JSON into something urllib can encode.
+  """
+  if isinstance(value, unicode):
+    return value.encode("utf-8")
+  if isinstance(value, (list, tuple)):
+    return ",".join(_EncodeValue(v) for v in value)
+  if isinstance(value, bool):
+    return value and "true" or "false"
+  return str(value)
+
+
+def _Chunks(items, size):
+  """
+  Lazily groups an iterable into lists of up to size items.
+  """
+  chunk = []
+  for item in items:
+    chunk.append(item)
+    if len(chunk) >= size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def ReadManifest(stream, default_blog=None, defaults=None):
+  """
+  Lazily reads a JSON lines manifest of posts.
+
+  Each non-blank line must hold a JSON object containing the parameters of a
+  single post.  The optional "blog" key selects the target blog; every other
+  key is sent to the API as a post parameter.
+
+  Args:
+    stream - file-like object containing the manifest
+    default_blog - blog used for items which do not specify one
+    defaults - dictionary of post parameters applied to every item
+
+  Yields:
+    (index, blog, params) tuples, where params is a TumError for lines which
+    could not be parsed
+  """
+  for index, line in enumerate(stream, 1):
+    line = line.strip()
+    if not line:
+      continue
+    try:
+      item = json.loads(line)
+      if not isinstance(item, dict):
+        raise ValueError("expected a JSON object")
+    except ValueError, e:
+      yield index, default_blog, tumblr_client.TumError(
+          "Invalid manifest line: %s" % e)
+      continue
+    blog = item.pop("blog", default_blog)
+    params = dict(defaults or {})
+    for key, value in item.iteritems():
+      params[key.encode("utf-8")] = _EncodeValue(value)
+    if not blog:
+      yield index, blog, tumblr_client.TumError(
+          "No blog specified for this post")
+    elif "type" not in params:
+      yield index, blog, tumblr_client.TumError(
+          "No post type specified for this post")
+    else:
+      yield index, _EncodeValue(blog), params
+
+
+class BatchPoster(object):
+  """
+  Posts a stream of items through a fixed pool of worker threads.
+
+  Every worker owns its own client, since neither oauth2.Client nor
+  httplib2.Http may be shared across threads.
+  """
+
+  def __init__(self, client_factory, workers=DEFAULT_WORKERS):
+    """
+    Initializes the poster.
+
+    Args:
+      client_factory - callable returning a new TumblrClient
+      workers - number of worker threads to post with
+    """
+
+    self.client_factory = client_factory
+    self.workers = max(1, workers)
+    self.succeeded = 0
+    self.failed = 0
+    self.elapsed = 0.0
+
+  def _worker(self, client, pending, results, accepted):
+    while True:
+      item = pending.get()
+      if item is None:
+        return
+      index, blog, params, files, signed = item
+      start = time.time()
+      try:
+        if isinstance(params, tumblr_client.TumError):
+          raise params
+        client.create_post(blog, params, files, signed)
+        if accepted:
+          accepted(index)
+      except Exception, e:
+        results.put(BatchResult(index, blog, False, e, time.time() - start))
+      else:
+        results.put(BatchResult(index, blog, True, None, time.time() - start))
+
+  def run(self, items, callback=None, accepted=None):
+    """
+    Posts every item, returning once all of them have been handled.
+
+    Args:
+      items - iterable of (index, blog, params) tuples, as from ReadManifest,
+          optionally followed by a list of media files to stream
+      callback - optional callable invoked with each BatchResult
+      accepted - optional callable invoked with the index of each item as
+          soon as the API accepts it, from the worker thread which posted it
+
+    Returns:
+      the number of items which failed to post
+    """
+
+    # Builds clients up front, so that the workers never race each other
+    # while setting up the on-disk cache.
+    clients = [self.client_factory() for i in range(self.workers)]
+    pending = Queue.Queue(self.workers * QUEUE_DEPTH_PER_WORKER)
+    results = Queue.Queue()
+    threads = []
+    for client in clients:
+      thread = threading.Thread(target=self._worker,
+          args=(client, pending, results, accepted))
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+
+    start = time.time()
+    for chunk in _Chunks(items, self.workers):
+      for item in self._signed(clients[0], chunk):
+        # Blocks while the queue is full, keeping memory use bounded.
+        pending.put(item)
+        self._drain(results, callback)
+    for thread in threads:
+      pending.put(None)
+    for thread in threads:
+      while thread.is_alive():
+        thread.join(0.1)
+    self._drain(results, callback)
+    self.elapsed = time.time() - start
+    return self.failed
+
+  def _signed(self, client, chunk):
+    """
+    Signs the first try of every post in a chunk of items in one go, so that
+    they share the signing work, returning (index, blog, params, files,
+    signed) tuples for the workers.
+    """
+    posts = [item[1:3] for item in chunk
+        if not isinstance(item[2], tumblr_client.TumError)]
+    signed = iter(client.sign_posts(posts))
+    items = []
+    for item in chunk:
+      index, blog, params = item[:3]
+      files = item[3:] and item[3] or None
+      req = None
+      if not isinstance(params, tumblr_client.TumError):
+        req = signed.next()
+      items.append((index, blog, params, files, req))
+    return items
+
+  def _drain(self, results, callback):
+    while True:
+      try:
+        result = results.get_nowait()
+      except Queue.Empty:
+        return
+      if result.ok:
+        self.succeeded += 1
+      else:
+        self.failed += 1
+      if callback:
+        callback(result)
+
+  def throughput(self):
+    """
+    Returns the number of items handled per second during the last run.
+    """
+    if not self.elapsed:
+      return 0.0
+    return (self.succeeded + self.failed) / self.elapsed
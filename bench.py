@@ -0,0 +1,250 @@
+#!/usr/bin/python
+#
+# bench - drives TumblrClient at a set rate or concurrency and measures it
+import binascii
+import json
+import os
+import Queue
+import subprocess
+import sys
+import threading
+import time
+
+import tumblr_client
+
+# Contains the default number of requests sent in a run.
+DEFAULT_REQUESTS = 200
+
+# Contains the default number of requests sent at once.
+DEFAULT_CONCURRENCY = 4
+
+# Contains the percentiles of latency reported.
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Contains the location of the mock API server started for a run.
+MOCK_API = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "mock_api.py")
+
+
+def _PageOffset(index):
+  # Walks through the first fifty pages, so that runs mix early and late ones.
+  return (index % 50) * tumblr_client.MAX_PAGE_SIZE
+
+
+# Contains the calls made on a client for each endpoint which can be
+# benchmarked, given the client, the blog, the request's index and any media
+# files to post.
+ENDPOINTS = {
+  "post": lambda client, blog, index, files: client.create_post(blog,
+      {"type": files and "photo" or "text",
+       "body": "Posted by tum bench, request %d." % index}, files),
+  "posts": lambda client, blog, index, files: client.posts(blog,
+      offset=_PageOffset(index)),
+  "dashboard": lambda client, blog, index, files: client.dashboard(
+      offset=_PageOffset(index)),
+  "likes": lambda client, blog, index, files: client.likes(
+      offset=_PageOffset(index)),
+  "info": lambda client, blog, index, files: client.blog_info(blog),
+  "user": lambda client, blog, index, files: client.user_info(),
+}
+
+
+def Percentile(ordered, percentile):
+  """
+  Returns a percentile of a sorted list by the nearest-rank method.
+  """
+  if not ordered:
+    return 0.0
+  rank = int(len(ordered) * percentile / 100.0 + 0.999999)
+  return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+class MockApiProcess(object):
+  """
+  Runs mock_api in a process of its own, so that serving requests does not
+  contend with the client being measured.  It accepts a consumer made up for
+  the run.
+  """
+
+  def __init__(self, args=()):
+    """
+    Starts the server, returning once it is listening.
+
+    Args:
+      args - list of further arguments to mock_api, such as --latency 50
+    """
+
+    self.consumer_key = binascii.hexlify(os.urandom(16))
+    self.consumer_secret = binascii.hexlify(os.urandom(16))
+    self.stats = None
+    self.process = subprocess.Popen([sys.executable, MOCK_API, "--port", "0",
+        "--consumer-key", self.consumer_key,
+        "--consumer-secret", self.consumer_secret] + list(args),
+        stdout=subprocess.PIPE)
+    line = self.process.stdout.readline()
+    if not line.startswith("Listening on "):
+      self.process.wait()
+      raise tumblr_client.TumError("The mock API server failed to start.")
+    self.address = line[len("Listening on "):].strip()
+
+  def stop(self):
+    """
+    Stops the server, keeping the counts of requests it answered in stats.
+    """
+    if self.process.poll() is None:
+      self.process.terminate()
+    output = self.process.communicate()[0].strip()
+    try:
+      self.stats = json.loads(output.splitlines()[-1])
+    except (ValueError, IndexError):
+      self.stats = None
+    return self.stats
+
+
+class LoadTest(object):
+  """
+  Sends requests from a pool of worker threads, either as fast as they allow
+  or at a fixed rate.
+
+  At a fixed rate, requests are scheduled up front and each one's latency
+  is counted from when it was due, so that time spent queued behind slow
+  requests counts against the client, as it would for a caller waiting on it.
+  """
+
+  def __init__(self, client_factory, call, concurrency=DEFAULT_CONCURRENCY,
+      rate=None):
+    """
+    Initializes the test.
+
+    Args:
+      client_factory - callable returning a new TumblrClient
+      call - callable sending one request, given a client and the request's
+          index
+      concurrency - number of worker threads, each with a client of its own
+      rate - requests started per second, or None to send them as fast as
+          the workers can
+    """
+
+    self.client_factory = client_factory
+    self.call = call
+    self.concurrency = max(1, concurrency)
+    self.rate = rate
+    self.latencies = []
+    self.errors = {}
+    self.elapsed = 0.0
+
+  def _worker(self, client, pending, results):
+    while True:
+      item = pending.get()
+      if item is None:
+        return
+      index, due = item
+      start = time.time()
+      try:
+        self.call(client, index)
+      except Exception, e:
+        error = getattr(e, "status", None) or type(e).__name__
+      else:
+        error = None
+      results.put((time.time() - (due or start), error))
+
+  def _schedule(self, pending, count, duration, start):
+    index = 0
+    while count is None or index < count:
+      due = None
+      if self.rate:
+        due = start + index / float(self.rate)
+        wait = due - time.time()
+        if wait > 0:
+          time.sleep(wait)
+      if duration is not None and time.time() - start >= duration:
+        break
+      pending.put((index, due))
+      index += 1
+    for i in range(self.concurrency):
+      pending.put(None)
+
+  def run(self, count=DEFAULT_REQUESTS, duration=None):
+    """
+    Sends requests until count have been sent or duration seconds have
+    passed, whichever comes first, returning once every one is answered.
+
+    Args:
+      count - number of requests to send, or None for no limit
+      duration - number of seconds to send requests for, or None for no limit
+    """
+
+    # Builds clients up front, as BatchPoster does, so that setting them up
+    # is not measured.
+    clients = [self.client_factory() for i in range(self.concurrency)]
+    # Queues requests without bound at a fixed rate, so that the schedule
+    # never waits on the workers; otherwise keeps just enough queued.
+    pending = Queue.Queue(0 if self.rate else self.concurrency * 2)
+    results = Queue.Queue()
+    threads = []
+    for client in clients:
+      thread = threading.Thread(target=self._worker,
+          args=(client, pending, results))
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+
+    start = time.time()
+    self._schedule(pending, count, duration, start)
+    for thread in threads:
+      while thread.is_alive():
+        thread.join(0.1)
+    self.elapsed = time.time() - start
+    while not results.empty():
+      latency, error = results.get()
+      self.latencies.append(latency)
+      if error is not None:
+        self.errors[str(error)] = self.errors.get(str(error), 0) + 1
+
+  def report(self):
+    """
+    Returns a dictionary of the run's throughput and latencies, in seconds.
+    """
+    ordered = sorted(self.latencies)
+    failed = sum(self.errors.itervalues())
+    latency = dict(("p%g" % percentile, Percentile(ordered, percentile))
+        for percentile in PERCENTILES)
+    latency["max"] = ordered and ordered[-1] or 0.0
+    latency["mean"] = ordered and sum(ordered) / len(ordered) or 0.0
+    return {
+      "requests": len(ordered),
+      "succeeded": len(ordered) - failed,
+      "failed": failed,
+      "errors": dict(self.errors),
+      "elapsed": self.elapsed,
+      "throughput": self.elapsed and len(ordered) / self.elapsed or 0.0,
+      "concurrency": self.concurrency,
+      "rate": self.rate,
+      "latency": latency,
+    }
+
+
+def FormatReport(report):
+  """
+  Returns a report from LoadTest, with any further counts added to it, as
+  text.
+  """
+  lines = [
+    "%d requests in %.2fs: %.1f requests/s" % (report["requests"],
+        report["elapsed"], report["throughput"]),
+    "%d succeeded, %d failed%s" % (report["succeeded"], report["failed"],
+        "".join(", %s: %d" % item
+            for item in sorted(report["errors"].iteritems()))),
+  ]
+  if "retries" in report:
+    lines.append("%d retries" % report["retries"])
+  latency = report["latency"]
+  lines.append("latency (ms): %s" % "  ".join("%s %.1f" % (name,
+      latency[name] * 1000) for name in ["p%g" % percentile
+          for percentile in PERCENTILES] + ["max", "mean"]))
+  server = report.get("server")
+  if server:
+    lines.append("server: %d verified, %d rejected; statuses %s" % (
+        server["verified"], server["rejected"], ", ".join("%s: %d" % item
+            for item in sorted(server["statuses"].iteritems()))))
+  return "\n".join(lines)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# oauth2_bench - microbenchmarks for oauth2 request construction and signing
+#
+# Every operation is timed across a grid of parameter counts, value sizes and
+# character sets.  Results are printed as a table, or written as JSON with
+# --json so that runs from before and after a change can be compared.
+import json
+import os
+import platform
+import sys
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import oauth2 as oauth
+
+# Contains the numbers of non-OAuth parameters on each benchmarked request.
+PARAM_COUNTS = (1, 10, 50)
+
+# Contains the sizes, in characters, of each parameter value.
+VALUE_SIZES = (16, 1024, 65536)
+
+# Contains the character sets parameter values are drawn from.
+CHARSETS = {
+  "ascii": u"tum benchmark text, with spaces & symbols ~ ",
+  "unicode": u"été 東京 фото & ~ ",
+}
+
+API_URL = "http://api.tumblr.com/v2/blog/example.tumblr.com/post"
+
+
+def _BuildParams(count, size, charset):
+  text = CHARSETS[charset]
+  value = (text * (size // len(text) + 1))[:size]
+  return dict((u"param%d" % i, value) for i in range(count))
+
+
+def _SignedRequest(params, consumer, token, method):
+  req = oauth.Request.from_consumer_and_token(consumer, token,
+      http_method="POST", http_url=API_URL, parameters=params,
+      is_form_encoded=True)
+  req.sign_request(method, consumer, token)
+  return req
+
+
+def BuildCases(params):
+  """
+  Returns a list of (name, callable) tuples, one for each operation
+  benchmarked against the given parameters.
+  """
+  consumer = oauth.Consumer("consumer-key", "consumer-secret")
+  token = oauth.Token("token-key", "token-secret")
+  hmac_sha1 = oauth.SignatureMethod_HMAC_SHA1()
+  plaintext = oauth.SignatureMethod_PLAINTEXT()
+  signed = _SignedRequest(params, consumer, token, hmac_sha1)
+  server = oauth.Server()
+  server.add_signature_method(hmac_sha1)
+  # Keeps the signed request's timestamp valid for the whole run.
+  server.timestamp_threshold = sys.maxint
+
+  def sign(method):
+    def run():
+      req = oauth.Request("POST", API_URL, params, is_form_encoded=True)
+      req["oauth_timestamp"] = "1300000000"
+      req["oauth_nonce"] = "12345678"
+      req.sign_request(method, consumer, token)
+    return run
+
+  return [
+    ("from_consumer_and_token", lambda: oauth.Request.from_consumer_and_token(
+        consumer, token, http_method="POST", http_url=API_URL,
+        parameters=params, is_form_encoded=True)),
+    ("get_normalized_parameters", signed.get_normalized_parameters),
+    ("sign_request_hmac_sha1", sign(hmac_sha1)),
+    ("sign_request_plaintext", sign(plaintext)),
+    ("to_postdata", signed.to_postdata),
+    ("to_url", signed.to_url),
+    ("to_header", signed.to_header),
+    ("verify_request", lambda: server.verify_request(signed, consumer,
+        token)),
+  ]
+
+
+def TimeCase(func, min_time, repeat):
+  """
+  Returns the best time, in seconds, of a single call to func.
+  """
+  # Finds a loop count which runs for at least min_time.
+  loops = 1
+  while True:
+    start = time.time()
+    for i in xrange(loops):
+      func()
+    elapsed = time.time() - start
+    if elapsed >= min_time:
+      break
+    loops *= 2
+  best = elapsed / loops
+  for i in range(repeat - 1):
+    start = time.time()
+    for j in xrange(loops):
+      func()
+    best = min(best, (time.time() - start) / loops)
+  return best
+
+
+def main(argv):
+  parser = OptionParser("usage: %prog [options]",
+      description="Benchmarks oauth2 request construction and signing.")
+  parser.add_option("-j", "--json", dest="json", metavar="FILE",
+      help="writes results as JSON to FILE, or STDOUT if FILE is -")
+  parser.add_option("-f", "--filter", dest="filter", metavar="NAME",
+      help="only runs operations whose name contains NAME")
+  parser.add_option("-t", "--min-time", dest="min_time", type="float",
+      default=0.1, metavar="SECONDS",
+      help="minimum time each measurement runs for")
+  parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+      help="number of measurements taken per case")
+  (options, args) = parser.parse_args(argv[1:])
+
+  results = []
+  for count in PARAM_COUNTS:
+    for size in VALUE_SIZES:
+      for charset in sorted(CHARSETS):
+        params = _BuildParams(count, size, charset)
+        for name, func in BuildCases(params):
+          if options.filter and options.filter not in name:
+            continue
+          seconds = TimeCase(func, options.min_time, options.repeat)
+          result = {
+            "operation": name,
+            "params": count,
+            "value_size": size,
+            "charset": charset,
+            "usec_per_op": seconds * 1e6,
+            "ops_per_sec": 1.0 / seconds,
+          }
+          results.append(result)
+          if options.json != "-":
+            print("%-26s %6d %8d %-8s %14.1f us %12.0f ops/s" % (name, count,
+                size, charset, result["usec_per_op"], result["ops_per_sec"]))
+
+  if options.json:
+    report = {
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "timestamp": int(time.time()),
+      "results": results,
+    }
+    if options.json == "-":
+      print(json.dumps(report, indent=2))
+    else:
+      with open(options.json, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+  main(sys.argv)
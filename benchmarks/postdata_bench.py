@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#
+# postdata_bench - compares encoding large post bodies via a body string with
+# passing the parameter mapping straight to oauth2.Client.request
+#
+# Each case runs in a fresh interpreter so that peak memory can be read from
+# the process's maximum resident set size.
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import oauth2 as oauth
+
+# Contains the body sizes, in megabytes, which are benchmarked.
+BODY_SIZES = (1, 4, 16)
+
+# Contains the number of posts signed and encoded for each case.
+ITERATIONS = 5
+
+API_URL = "http://api.tumblr.com/v2/blog/example/post"
+
+
+def BuildRequest(mode, params, consumer, method):
+  """
+  Performs the signing and encoding work oauth2.Client.request does for a
+  form-encoded POST, returning the encoded body.
+  """
+  if mode == "body":
+    # The old TumblrClient path: encode, then decode again for signing.
+    body = urllib.urlencode(params)
+    params = oauth.parse_qs(body)
+  req = oauth.Request.from_consumer_and_token(consumer, http_method="POST",
+      http_url=API_URL, parameters=params, is_form_encoded=True)
+  req.sign_request(method, consumer, None)
+  return req.to_postdata()
+
+
+def RunCase(mode, size_mb):
+  text = ("tum benchmark body & more ~ text\n" * (size_mb * 32768))[
+      :size_mb * 1024 * 1024]
+  params = {"type": "text", "title": "Benchmark", "body": text}
+  consumer = oauth.Consumer("key", "secret")
+  method = oauth.SignatureMethod_HMAC_SHA1()
+  baseline = resource.getrusage(resource.RUSAGE_SELF)
+  start = time.time()
+  for i in range(ITERATIONS):
+    BuildRequest(mode, params, consumer, method)
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  return {
+    "mode": mode,
+    "size_mb": size_mb,
+    "wall_ms_per_post": (time.time() - start) * 1000.0 / ITERATIONS,
+    "cpu_ms_per_post": (usage.ru_utime + usage.ru_stime - baseline.ru_utime -
+        baseline.ru_stime) * 1000.0 / ITERATIONS,
+    "peak_rss_kb": usage.ru_maxrss,
+  }
+
+
+def main(argv):
+  if len(argv) == 3:
+    print(json.dumps(RunCase(argv[1], int(argv[2]))))
+    return
+  results = []
+  for size_mb in BODY_SIZES:
+    for mode in ("body", "parameters"):
+      output = subprocess.check_output([sys.executable, __file__, mode,
+          str(size_mb)])
+      results.append(json.loads(output))
+  if "--json" in argv:
+    print(json.dumps(results, indent=2))
+    return
+  print("%-12s %8s %14s %14s %14s" % ("mode", "size_mb", "cpu_ms/post",
+      "wall_ms/post", "peak_rss_kb"))
+  for result in results:
+    print("%-12s %8d %14.1f %14.1f %14d" % (result["mode"], result["size_mb"],
+        result["cpu_ms_per_post"], result["wall_ms_per_post"],
+        result["peak_rss_kb"]))
+
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# startup_bench - measures how long common tum commands take to start
+#
+# Each command runs in a fresh interpreter, several times over, with HOME
+# pointed at an empty directory so that nothing is read from or written to
+# the real one.  Besides wall time, the time spent importing modules and the
+# number of modules loaded are reported, as measured from within the child.
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+TUM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tum.py")
+
+# Contains the commands benchmarked, as argument lists to tum.
+COMMANDS = [
+  [],
+  ["post", "--help"],
+  ["post", "text", "--help"],
+  ["dash", "--help"],
+  ["pull", "--help"],
+  ["search", "nothing"],
+]
+
+# Runs tum within the child, timing every top-level import it makes.
+CHILD = r"""
+import __builtin__, json, os, runpy, sys, time
+start = time.time()
+state = {"depth": 0, "seconds": 0.0}
+real_import = __builtin__.__import__
+def timed_import(*args, **kwargs):
+  state["depth"] += 1
+  began = time.time()
+  try:
+    return real_import(*args, **kwargs)
+  finally:
+    state["depth"] -= 1
+    if not state["depth"]:
+      state["seconds"] += time.time() - began
+__builtin__.__import__ = timed_import
+baseline = len(sys.modules)
+sys.argv = [sys.argv[1]] + sys.argv[2:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+sys.stdout = open("/dev/null", "w")
+try:
+  runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+  pass
+sys.stderr.write(json.dumps({"wall": time.time() - start,
+    "imports": state["seconds"], "modules": len(sys.modules) - baseline}))
+"""
+
+
+def RunCommand(args, home):
+  """
+  Runs tum once, returning the child's wall time, import time and module
+  count, along with the wall time seen from outside.
+  """
+  start = time.time()
+  child = subprocess.Popen([sys.executable, "-c", CHILD, TUM] + args,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+      env=dict(os.environ, HOME=home))
+  out, err = child.communicate()
+  elapsed = time.time() - start
+  result = json.loads(err.strip().splitlines()[-1])
+  result["process"] = elapsed
+  return result
+
+
+def main(argv):
+  parser = OptionParser("usage: %prog [options]",
+      description="Measures the cold-start time of common tum commands.")
+  parser.add_option("-r", "--repeat", dest="repeat", type="int", default=10,
+      help="number of runs per command")
+  parser.add_option("-j", "--json", dest="json", action="store_true",
+      default=False, help="prints results as JSON")
+  (options, args) = parser.parse_args(argv[1:])
+
+  home = tempfile.mkdtemp(prefix="tum-startup-")
+  results = []
+  try:
+    for command in COMMANDS:
+      runs = [RunCommand(command, home) for i in range(options.repeat)]
+      best = lambda key: min(run[key] for run in runs)
+      results.append({
+        "command": " ".join(["tum"] + command),
+        "process_ms": best("process") * 1000,
+        "wall_ms": best("wall") * 1000,
+        "import_ms": best("imports") * 1000,
+        "modules": runs[-1]["modules"],
+      })
+  finally:
+    shutil.rmtree(home)
+
+  if options.json:
+    print(json.dumps(results, indent=2))
+    return
+  print("%-24s %12s %10s %10s %8s" % ("command", "process_ms", "wall_ms",
+      "import_ms", "modules"))
+  for result in results:
+    print("%-24s %12.1f %10.1f %10.1f %8d" % (result["command"],
+        result["process_ms"], result["wall_ms"], result["import_ms"],
+        result["modules"]))
+
+
+if __name__ == "__main__":
+  main(sys.argv)
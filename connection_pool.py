@@ -0,0 +1,324 @@
+#!/usr/bin/python
+#
+# connection_pool - keep-alive HTTP connection pooling for the Tumblr API
+import httplib
+import select
+import socket
+import ssl
+import sys
+import threading
+import time
+
+import timings
+
+# Contains the default maximum number of connections held open to each host.
+DEFAULT_MAX_PER_HOST = 8
+
+# Contains the number of seconds an idle connection is kept before eviction.
+DEFAULT_IDLE_TIMEOUT = 60
+
+# Contains the number of seconds a resolved host address is cached for.
+DEFAULT_DNS_TTL = 300
+
+# Contains the default port used for each supported URL scheme.
+DEFAULT_PORTS = {
+  "http": 80,
+  "https": 443,
+}
+
+# Contains the HTTP methods which may be sent again once the server may have
+# acted on them, since repeating them has no further effect.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE",
+    "TRACE"])
+
+
+class NotSentError(socket.error):
+  """
+  Raised when a request fails before any of it was sent, such as when no
+  connection could be made, so that it is safe to send again whatever its
+  method.
+  """
+
+
+class _PooledHTTPConnection(httplib.HTTPConnection):
+  """
+  An HTTP connection which connects to a pre-resolved address.
+  """
+
+  def __init__(self, host, port, address, timeout=None):
+    httplib.HTTPConnection.__init__(self, host, port, timeout=timeout)
+    self.address = address
+
+  def connect(self):
+    with timings.Phase("connect"):
+      self.sock = socket.create_connection(self.address, self.timeout)
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _PooledHTTPSConnection(httplib.HTTPSConnection):
+  """
+  An HTTPS connection which connects to a pre-resolved address, while still
+  validating the certificate against the original hostname.
+  """
+
+  def __init__(self, host, port, address, timeout=None, context=None):
+    httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout)
+    self.address = address
+    self.ssl_context = context or ssl.create_default_context()
+
+  def connect(self):
+    with timings.Phase("connect"):
+      sock = socket.create_connection(self.address, self.timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    with timings.Phase("tls"):
+      self.sock = self.ssl_context.wrap_socket(sock,
+          server_hostname=self.host)
+
+
+def _Rewind(body):
+  """
+  Prepares a request body to be sent again, returning whether that is possible.
+  """
+  if not hasattr(body, "read"):
+    return True
+  try:
+    body.seek(0)
+  except (AttributeError, IOError):
+    return False
+  return True
+
+
+def _IsDropped(conn):
+  """
+  Returns whether an idle connection has been closed by the server, which
+  shows as the socket becoming readable while no response is due.
+  """
+  if conn.sock is None:
+    return True
+  try:
+    return bool(select.select([conn.sock], [], [], 0)[0])
+  except (select.error, socket.error, ValueError):
+    return True
+
+
+class ConnectionPool(object):
+  """
+  A thread-safe pool of keep-alive connections, bounded per host.
+
+  Connections are handed out most-recently-used first, so that a small
+  working set stays warm while surplus connections age out and get evicted.
+  """
+
+  def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST,
+      idle_timeout=DEFAULT_IDLE_TIMEOUT, dns_ttl=DEFAULT_DNS_TTL,
+      timeout=None):
+    """
+    Initializes the pool.
+
+    Args:
+      max_per_host - maximum number of open connections to a single host
+      idle_timeout - seconds after which an unused connection is closed
+      dns_ttl - seconds for which host addresses are cached
+      timeout - socket timeout applied to every connection
+    """
+
+    self.max_per_host = max_per_host
+    self.idle_timeout = idle_timeout
+    self.dns_ttl = dns_ttl
+    self.timeout = timeout
+    self.hits = 0
+    self.connects = 0
+    self.evictions = 0
+    self.dns_hits = 0
+    self._lock = threading.Condition()
+    self._idle = {}
+    self._open = {}
+    self._dns_cache = {}
+
+  def _resolve(self, host, port):
+    """
+    Returns a connectable (address, port) tuple for a host, caching results.
+    """
+    key = (host, port)
+    now = time.time()
+    with self._lock:
+      cached = self._dns_cache.get(key)
+      if cached and cached[0] > now:
+        self.dns_hits += 1
+        return cached[1]
+    with timings.Phase("dns"):
+      addrinfo = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    address = addrinfo[0][4][:2]
+    with self._lock:
+      self._dns_cache[key] = (now + self.dns_ttl, address)
+    return address
+
+  def _new_connection(self, key):
+    scheme, host, port = key
+    address = self._resolve(host, port)
+    if scheme == "https":
+      conn = _PooledHTTPSConnection(host, port, address, self.timeout)
+    else:
+      conn = _PooledHTTPConnection(host, port, address, self.timeout)
+    conn.connect()
+    return conn
+
+  def _evict_expired(self, key, now):
+    # Expects the lock to be held.  Idle lists are ordered oldest first.
+    idle = self._idle.get(key, [])
+    while idle and now - idle[0][0] > self.idle_timeout:
+      idle.pop(0)[1].close()
+      self._open[key] -= 1
+      self.evictions += 1
+
+  def _checkout(self, key):
+    """
+    Returns an (connection, reused) tuple, blocking while the host is at its
+    connection limit.
+    """
+    with self._lock:
+      while True:
+        self._evict_expired(key, time.time())
+        idle = self._idle.get(key)
+        while idle:
+          conn = idle.pop()[1]
+          if not _IsDropped(conn):
+            self.hits += 1
+            return conn, True
+          conn.close()
+          self._open[key] -= 1
+          self.evictions += 1
+        if self._open.get(key, 0) < self.max_per_host:
+          self._open[key] = self._open.get(key, 0) + 1
+          break
+        self._lock.wait()
+    try:
+      conn = self._new_connection(key)
+    except:
+      self._discard(key)
+      raise
+    with self._lock:
+      self.connects += 1
+    return conn, False
+
+  def _release(self, key, conn):
+    with self._lock:
+      self._idle.setdefault(key, []).append((time.time(), conn))
+      self._lock.notify()
+
+  def _discard(self, key, conn=None):
+    if conn is not None:
+      conn.close()
+    with self._lock:
+      self._open[key] -= 1
+      self._lock.notify()
+
+  def prewarm(self, scheme, host, port=None, count=1):
+    """
+    Opens connections ahead of time, so that the first requests to a host do
+    not pay for the handshake.
+
+    Args:
+      scheme - either "http" or "https"
+      host - hostname to connect to
+      port - port to connect to, defaulting to the scheme's standard port
+      count - number of connections to open, capped at max_per_host
+    """
+
+    key = (scheme, host, port or DEFAULT_PORTS[scheme])
+    conns = []
+    for i in range(min(count, self.max_per_host)):
+      conn, reused = self._checkout(key)
+      conns.append(conn)
+    for conn in conns:
+      self._release(key, conn)
+
+  def request(self, scheme, host, port, request_uri, method="GET", body=None,
+      headers=None):
+    """
+    Sends a request over a pooled connection.
+
+    Args:
+      scheme - either "http" or "https"
+      host - hostname to send the request to
+      port - port to send the request to, or None for the scheme's default
+      request_uri - path and query string of the request
+      method - HTTP method of the request
+      body - string or file-like object containing the request body
+      headers - dictionary containing the request headers
+
+    Returns:
+      response - httplib.HTTPResponse whose body has already been read
+      content - string containing the response body
+    """
+
+    key = (scheme, host, port or DEFAULT_PORTS[scheme])
+    while True:
+      try:
+        conn, reused = self._checkout(key)
+      except socket.error, e:
+        raise NotSentError(*e.args), None, sys.exc_info()[2]
+      sent = False
+      try:
+        with timings.Phase("upload"):
+          conn.request(method, request_uri, body, headers or {})
+        sent = True
+        with timings.Phase("wait"):
+          response = conn.getresponse()
+        content = ""
+        if method != "HEAD":
+          with timings.Phase("download"):
+            content = response.read()
+      except (socket.error, httplib.HTTPException):
+        self._discard(key, conn)
+        # A reused connection may have been closed by the server while it sat
+        # idle, so the request gets one more try on a fresh connection.  Once
+        # it has been sent in full, the server may have acted on it, so only
+        # requests which are safe to repeat are sent again.
+        if (reused and (not sent or method in IDEMPOTENT_METHODS) and
+            _Rewind(body)):
+          continue
+        raise
+      except:
+        self._discard(key, conn)
+        raise
+      if response.will_close:
+        self._discard(key, conn)
+      else:
+        self._release(key, conn)
+      return response, content
+
+  def evict_idle(self):
+    """
+    Closes every connection which has sat idle for longer than idle_timeout.
+    """
+    now = time.time()
+    with self._lock:
+      for key in self._idle.keys():
+        self._evict_expired(key, now)
+
+  def close(self):
+    """
+    Closes every idle connection held by the pool.
+    """
+    with self._lock:
+      for key, idle in self._idle.iteritems():
+        for last_used, conn in idle:
+          conn.close()
+          self._open[key] -= 1
+        del idle[:]
+      self._lock.notify_all()
+
+  def stats(self):
+    """
+    Returns a dictionary of counters describing the pool's behaviour.
+    """
+    with self._lock:
+      return {
+        "hits": self.hits,
+        "connects": self.connects,
+        "evictions": self.evictions,
+        "dns_hits": self.dns_hits,
+        "open": sum(self._open.values()),
+        "idle": sum(len(idle) for idle in self._idle.values()),
+      }
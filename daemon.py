@@ -0,0 +1,286 @@
+#!/usr/bin/python
+#
+# daemon - serves tum commands over a Unix socket from a long-running process
+import cStringIO
+import errno
+import json
+import os
+import socket
+import SocketServer
+import struct
+import sys
+import traceback
+
+# Describes the header of each frame sent over the socket: its kind and the
+# length of its payload.
+FRAME_HEADER = struct.Struct(">cI")
+
+# Contains the kinds of frame: a command to run, its output and errors, a
+# request for the client's standard input, that input, and the command's exit
+# status.
+FRAME_COMMAND = "C"
+FRAME_OUTPUT = "O"
+FRAME_ERROR = "E"
+FRAME_READ = "R"
+FRAME_INPUT = "I"
+FRAME_EXIT = "X"
+
+# Contains the number of bytes of output buffered before being sent.
+OUTPUT_BUFFER_SIZE = 8192
+
+
+def _SendFrame(sock, kind, payload=""):
+  sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _ReadFrame(sock_file):
+  """
+  Reads a frame, returning a (kind, payload) tuple, or None once the other
+  end has hung up.
+  """
+  header = sock_file.read(FRAME_HEADER.size)
+  if len(header) < FRAME_HEADER.size:
+    return None
+  kind, length = FRAME_HEADER.unpack(header)
+  payload = sock_file.read(length)
+  if len(payload) < length:
+    return None
+  return kind, payload
+
+
+class _RemoteOutput(object):
+  """
+  Stands in for standard output or standard error while a command runs,
+  sending what it writes to the client.
+  """
+
+  def __init__(self, sock, kind=FRAME_OUTPUT):
+    self.sock = sock
+    self.kind = kind
+    self.buffer = []
+    self.size = 0
+    self.softspace = 0
+
+  def write(self, data):
+    if isinstance(data, unicode):
+      data = data.encode("utf-8")
+    self.buffer.append(data)
+    self.size += len(data)
+    if self.size >= OUTPUT_BUFFER_SIZE:
+      self.flush()
+
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+
+  def flush(self):
+    if self.buffer:
+      data = "".join(self.buffer)
+      self.buffer = []
+      self.size = 0
+      _SendFrame(self.sock, self.kind, data)
+
+  def isatty(self):
+    return False
+
+
+class _RemoteInput(object):
+  """
+  Stands in for standard input while a command runs.  The client's input is
+  only fetched if the command reads it, so that commands which do not never
+  wait on it.
+  """
+
+  def __init__(self, sock, sock_file, output):
+    self.sock = sock
+    self.sock_file = sock_file
+    self.output = output
+    self.data = None
+
+  def _fetch(self):
+    if self.data is None:
+      self.output.flush()
+      _SendFrame(self.sock, FRAME_READ)
+      frame = _ReadFrame(self.sock_file)
+      if frame is None or frame[0] != FRAME_INPUT:
+        raise IOError(errno.EPIPE, "client hung up")
+      self.data = cStringIO.StringIO(frame[1])
+    return self.data
+
+  def read(self, size=-1):
+    return self._fetch().read(size)
+
+  def readline(self, size=-1):
+    return self._fetch().readline(size)
+
+  def readlines(self):
+    return self._fetch().readlines()
+
+  def __iter__(self):
+    return iter(self._fetch())
+
+  def isatty(self):
+    return False
+
+
+class _CommandHandler(SocketServer.StreamRequestHandler):
+  """
+  Runs one command sent by a client.
+  """
+
+  def handle(self):
+    frame = _ReadFrame(self.rfile)
+    if frame is None or frame[0] != FRAME_COMMAND:
+      return
+    command = json.loads(frame[1])
+    output = _RemoteOutput(self.connection)
+    errors = _RemoteOutput(self.connection, FRAME_ERROR)
+    status = self.server.run(command["argv"], command["cwd"], output,
+        errors, _RemoteInput(self.connection, self.rfile, output))
+    try:
+      output.flush()
+      errors.flush()
+      _SendFrame(self.connection, FRAME_EXIT, str(status))
+    except socket.error:
+      # The client hung up before the command was done, such as when the
+      # pager reading its output quits.
+      pass
+
+
+class DaemonServer(SocketServer.UnixStreamServer):
+  """
+  Listens on a Unix socket for commands forwarded by tum, running each one
+  in this process so that it reuses whatever the process keeps warm.
+
+  Commands run one at a time, each in the working directory of the client
+  which sent it, with standard input and output redirected to that client.
+  The socket is only accessible to its owner.
+  """
+
+  def __init__(self, socket_loc, handler):
+    """
+    Binds the socket, replacing one left behind by a daemon which has died.
+
+    Args:
+      socket_loc - location of the Unix socket to listen on
+      handler - callable taking a command's arguments, which runs it
+    """
+
+    self.socket_loc = socket_loc
+    self.handler = handler
+    self.served = 0
+    if os.path.exists(socket_loc):
+      try:
+        DaemonClient(socket_loc).close()
+      except socket.error:
+        os.unlink(socket_loc)
+      else:
+        raise socket.error(errno.EADDRINUSE,
+            "a daemon is already listening on %s" % socket_loc)
+    umask = os.umask(0077)
+    try:
+      SocketServer.UnixStreamServer.__init__(self, socket_loc,
+          _CommandHandler)
+    finally:
+      os.umask(umask)
+
+  def run(self, argv, cwd, stdout, stderr, stdin):
+    """
+    Runs a command with its standard streams redirected, returning its exit
+    status.
+    """
+    saved = (os.getcwd(), sys.stdout, sys.stderr, sys.stdin)
+    status = 0
+    try:
+      os.chdir(cwd)
+      sys.stdout = stdout
+      sys.stderr = stderr
+      sys.stdin = stdin
+      self.handler(argv)
+    except SystemExit, e:
+      if e.code is None:
+        status = 0
+      elif isinstance(e.code, int):
+        status = e.code
+      else:
+        print(e.code)
+        status = 1
+    except Exception, e:
+      # Logs the traceback to the daemon's own standard error.
+      traceback.print_exc(file=saved[2])
+      try:
+        print("ERROR: %s" % e)
+      except socket.error:
+        pass
+      status = 1
+    finally:
+      os.chdir(saved[0])
+      sys.stdout = saved[1]
+      sys.stderr = saved[2]
+      sys.stdin = saved[3]
+      self.served += 1
+    return status
+
+  def server_close(self):
+    SocketServer.UnixStreamServer.server_close(self)
+    if os.path.exists(self.socket_loc):
+      os.unlink(self.socket_loc)
+
+
+class DaemonClient(object):
+  """
+  Forwards a command to a running daemon, relaying its output and input.
+  """
+
+  def __init__(self, socket_loc):
+    """
+    Connects to the daemon, raising socket.error if none is listening.
+
+    Args:
+      socket_loc - location of the daemon's Unix socket
+    """
+
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self.sock.connect(socket_loc)
+    except socket.error:
+      self.sock.close()
+      raise
+    self.sock_file = self.sock.makefile("rb")
+
+  def run(self, argv):
+    """
+    Runs a command on the daemon, returning its exit status.
+
+    Args:
+      argv - list of the command's arguments, as given to tum
+    """
+
+    _SendFrame(self.sock, FRAME_COMMAND, json.dumps({"argv": argv,
+        "cwd": os.getcwd()}))
+    try:
+      while True:
+        frame = _ReadFrame(self.sock_file)
+        if frame is None:
+          raise socket.error(errno.ECONNRESET, "the daemon hung up")
+        kind, payload = frame
+        if kind == FRAME_OUTPUT:
+          sys.stdout.write(payload)
+          sys.stdout.flush()
+        elif kind == FRAME_ERROR:
+          sys.stderr.write(payload)
+        elif kind == FRAME_READ:
+          _SendFrame(self.sock, FRAME_INPUT, sys.stdin.read())
+        elif kind == FRAME_EXIT:
+          return int(payload)
+    except IOError, e:
+      # Stops quietly once the pager reading our output has quit.
+      if e.errno != errno.EPIPE:
+        raise
+      return 0
+    finally:
+      self.close()
+
+  def close(self):
+    self.sock_file.close()
+    self.sock.close()
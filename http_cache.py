@@ -0,0 +1,144 @@
+#!/usr/bin/python
+#
+# http_cache - a size-bounded, single-file HTTP cache for httplib2
+import sqlite3
+import threading
+import time
+
+import timings
+
+# Contains the default number of bytes of responses a cache may hold.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Contains the number of seconds a cache waits on another process's lock.
+LOCK_TIMEOUT = 30
+
+# Contains the number of seconds after which a cache hit refreshes an entry's
+# last access time; hits on recently used entries skip the write.
+TOUCH_INTERVAL = 60
+
+# Contains the schema of the cache, created on first use.  Triggers keep a
+# running total of the stored bytes, so that it never has to be summed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  key TEXT PRIMARY KEY,
+  value BLOB NOT NULL,
+  size INTEGER NOT NULL,
+  accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS totals (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+  UPDATE totals SET bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+  UPDATE totals SET bytes = bytes - old.size;
+END;
+"""
+
+
+class SQLiteCache(object):
+  """
+  An httplib2 cache kept in a single SQLite database, holding at most a
+  given number of bytes of responses and evicting the least recently used
+  beyond that.
+
+  The database runs in WAL mode, so several tum processes may read and write
+  one cache at once, and a cache object may be shared across threads.  Hits,
+  misses and evictions are counted for the life of the object.
+  """
+
+  def __init__(self, cache_loc, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Opens the cache, creating it if needed.
+
+    Args:
+      cache_loc - location of the cache's database file
+      max_bytes - number of bytes of responses the cache may hold
+    """
+
+    self.cache_loc = cache_loc
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(cache_loc, timeout=LOCK_TIMEOUT,
+        check_same_thread=False)
+    self._db.text_factory = str
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    with self._db:
+      self._db.executescript(SCHEMA)
+
+  def get(self, key):
+    now = time.time()
+    with timings.Phase("cache"), self._lock:
+      row = self._db.execute("SELECT value, accessed FROM entries "
+          "WHERE key = ?", (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      if now - row[1] > TOUCH_INTERVAL:
+        with self._db:
+          self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+              (now, key))
+      return str(row[0])
+
+  def set(self, key, value):
+    size = len(key) + len(value)
+    if size > self.max_bytes:
+      return
+    with timings.Phase("cache"), self._lock:
+      with self._db:
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._db.execute("INSERT INTO entries VALUES (?, ?, ?, ?)",
+            (key, sqlite3.Binary(value), size, time.time()))
+        self._evict()
+
+  def _evict(self):
+    # Expects the lock and a transaction to be held.
+    excess = self._db.execute("SELECT bytes FROM totals").fetchone()[0] - \
+        self.max_bytes
+    if excess <= 0:
+      return
+    freed = 0
+    keys = []
+    for key, size in self._db.execute("SELECT key, size FROM entries "
+        "ORDER BY accessed"):
+      keys.append((key,))
+      freed += size
+      if freed >= excess:
+        break
+    self._db.executemany("DELETE FROM entries WHERE key = ?", keys)
+    self.evictions += len(keys)
+
+  def delete(self, key):
+    with timings.Phase("cache"), self._lock:
+      with self._db:
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+  def stats(self):
+    """
+    Returns a dictionary of the cache's counters and current size.
+    """
+    with self._lock:
+      entries, size = self._db.execute(
+          "SELECT COUNT(*), (SELECT bytes FROM totals) FROM entries").fetchone()
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "entries": entries,
+        "bytes": size,
+        "max_bytes": self.max_bytes,
+      }
+
+  def close(self):
+    with self._lock:
+      self._db.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+#
+# metrics - latency histograms and counters for the requests tum makes
+import bisect
+import json
+import os
+import threading
+import time
+
+# Contains the upper bounds, in seconds, of the buckets latencies are counted
+# in, each a quarter of a power of two above the last, from a millisecond to
+# a little over two minutes.  Quantiles are estimated to within a bucket.
+BUCKETS = [0.001 * 2 ** (i / 4.0) for i in range(69)]
+
+# Contains the quantiles reported for each endpoint's latency.
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Contains the default number of seconds between exports.
+DEFAULT_EXPORT_INTERVAL = 15
+
+
+class Histogram(object):
+  """
+  Counts latencies into fixed buckets, from which quantiles are estimated.
+  """
+
+  __slots__ = ("counts", "count", "sum", "max")
+
+  def __init__(self):
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, seconds):
+    self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+    self.count += 1
+    self.sum += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def quantile(self, q):
+    """
+    Returns an estimate of a quantile, interpolating within its bucket.
+    """
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      if count and seen + count >= rank:
+        lower = BUCKETS[i - 1] if i else 0.0
+        upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+        estimate = lower + (upper - lower) * (rank - seen) / count
+        return min(estimate, self.max)
+      seen += count
+    return self.max
+
+
+class _Endpoint(object):
+  """
+  Holds the latency histogram and counters of one endpoint.
+  """
+
+  __slots__ = ("latency", "requests", "retries", "response_bytes", "errors")
+
+  def __init__(self):
+    self.latency = Histogram()
+    self.requests = 0
+    self.retries = 0
+    self.response_bytes = 0
+    self.errors = {}
+
+
+def _Label(value):
+  return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _WriteAtomically(loc, data):
+  with open(loc + ".tmp", "w") as out_file:
+    out_file.write(data)
+  os.rename(loc + ".tmp", loc)
+
+
+class Metrics(object):
+  """
+  Keeps latency histograms and counters of requests, broken down by
+  endpoint, for any number of clients sharing it across threads.
+
+  Recording a request takes a lock, a bucket search and a few additions, so
+  it costs next to nothing beside the request itself.
+  """
+
+  def __init__(self):
+    self.started = time.time()
+    self._lock = threading.Lock()
+    self._endpoints = {}
+
+  def observe(self, endpoint, seconds, attempts=1, response_bytes=0,
+      error=None):
+    """
+    Records a request.
+
+    Args:
+      endpoint - name of the endpoint the request was sent to
+      seconds - time taken by the request, including any retries
+      attempts - number of times the request was sent
+      response_bytes - number of bytes in the responses received
+      error - name of the kind of error the request failed with, if any
+    """
+
+    with self._lock:
+      stats = self._endpoints.get(endpoint)
+      if stats is None:
+        stats = self._endpoints[endpoint] = _Endpoint()
+      stats.latency.observe(seconds)
+      stats.requests += 1
+      stats.retries += max(attempts - 1, 0)
+      stats.response_bytes += response_bytes
+      if error:
+        stats.errors[error] = stats.errors.get(error, 0) + 1
+
+  def snapshot(self):
+    """
+    Returns a dictionary of every endpoint's counters and latency quantiles,
+    in seconds.
+    """
+    now = time.time()
+    with self._lock:
+      endpoints = {}
+      for endpoint, stats in self._endpoints.iteritems():
+        latency = dict(("p%d" % round(q * 100), stats.latency.quantile(q))
+            for q in QUANTILES)
+        latency["max"] = stats.latency.max
+        latency["mean"] = stats.latency.sum / stats.latency.count
+        endpoints[endpoint] = {
+          "requests": stats.requests,
+          "errors": dict(stats.errors),
+          "retries": stats.retries,
+          "response_bytes": stats.response_bytes,
+          "latency": latency,
+        }
+    return {
+      "time": now,
+      "uptime": now - self.started,
+      "endpoints": endpoints,
+    }
+
+  def prometheus(self):
+    """
+    Returns the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    def metric(name, kind, description):
+      lines.append("# HELP %s %s" % (name, description))
+      lines.append("# TYPE %s %s" % (name, kind))
+    with self._lock:
+      endpoints = sorted(self._endpoints.iteritems())
+      metric("tum_requests_total", "counter", "Requests sent to the API.")
+      for endpoint, stats in endpoints:
+        lines.append('tum_requests_total{endpoint="%s"} %d' % (
+            _Label(endpoint), stats.requests))
+      metric("tum_request_errors_total", "counter",
+          "Requests which failed, by kind of error.")
+      for endpoint, stats in endpoints:
+        for error, count in sorted(stats.errors.iteritems()):
+          lines.append('tum_request_errors_total{endpoint="%s",error="%s"} '
+              '%d' % (_Label(endpoint), _Label(error), count))
+      metric("tum_request_retries_total", "counter",
+          "Requests sent again after a failed attempt.")
+      for endpoint, stats in endpoints:
+        lines.append('tum_request_retries_total{endpoint="%s"} %d' % (
+            _Label(endpoint), stats.retries))
+      metric("tum_response_bytes_total", "counter",
+          "Bytes of response bodies received.")
+      for endpoint, stats in endpoints:
+        lines.append('tum_response_bytes_total{endpoint="%s"} %d' % (
+            _Label(endpoint), stats.response_bytes))
+      metric("tum_request_duration_seconds", "summary",
+          "Time taken by requests, including retries.")
+      for endpoint, stats in endpoints:
+        label = _Label(endpoint)
+        for q in QUANTILES:
+          lines.append('tum_request_duration_seconds{endpoint="%s",'
+              'quantile="%s"} %.6f' % (label, q, stats.latency.quantile(q)))
+        lines.append('tum_request_duration_seconds_sum{endpoint="%s"} %.6f'
+            % (label, stats.latency.sum))
+        lines.append('tum_request_duration_seconds_count{endpoint="%s"} %d'
+            % (label, stats.latency.count))
+      metric("tum_request_duration_seconds_max", "gauge",
+          "Longest time taken by a request.")
+      for endpoint, stats in endpoints:
+        lines.append('tum_request_duration_seconds_max{endpoint="%s"} %.6f'
+            % (_Label(endpoint), stats.latency.max))
+    return "\n".join(lines) + "\n"
+
+  def write_prometheus(self, loc):
+    """
+    Writes the metrics to a file in the Prometheus text format, replacing it
+    in one step so that a scraper never reads half a file.
+    """
+    _WriteAtomically(loc, self.prometheus())
+
+  def write_snapshot(self, loc):
+    """
+    Writes a JSON snapshot of the metrics to a file, replacing it in one step.
+    """
+    _WriteAtomically(loc, json.dumps(self.snapshot(), indent=2,
+        sort_keys=True) + "\n")
+
+
+class Exporter(object):
+  """
+  Periodically writes metrics to disk from a background thread, as a
+  Prometheus text file, a JSON snapshot or both.
+  """
+
+  def __init__(self, metrics, prometheus_loc=None, snapshot_loc=None,
+      interval=DEFAULT_EXPORT_INTERVAL):
+    """
+    Starts exporting.
+
+    Args:
+      metrics - Metrics to export
+      prometheus_loc - location of the Prometheus text file, if any
+      snapshot_loc - location of the JSON snapshot, if any
+      interval - number of seconds between exports
+    """
+
+    self.metrics = metrics
+    self.prometheus_loc = prometheus_loc
+    self.snapshot_loc = snapshot_loc
+    self.interval = interval
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def export(self):
+    if self.prometheus_loc:
+      self.metrics.write_prometheus(self.prometheus_loc)
+    if self.snapshot_loc:
+      self.metrics.write_snapshot(self.snapshot_loc)
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      self.export()
+
+  def stop(self):
+    """
+    Stops exporting, after writing the metrics one last time.
+    """
+    self._stop.set()
+    self._thread.join()
+    self.export()
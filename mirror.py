@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+# mirror - keeps a local copy of a blog up to date, transferring only changes
+import hashlib
+import json
+import os
+
+import pull
+import tumblr_client
+
+# Contains the name of the file holding a mirror's sync state.
+STATE_FILE = "mirror.json"
+
+# Contains the number of newest posts re-checked for edits and deletions on
+# every sync, one page's worth.
+RECENT_WINDOW = 20
+
+# Contains the post fields which change without the post being edited, and
+# so are left out of its digest.
+VOLATILE_FIELDS = ("note_count", "notes", "liked", "followed", "can_reply",
+    "can_reblog", "can_send_in_message", "can_like", "display_avatar")
+
+
+def ContentDigest(post):
+  """
+  Returns a compact digest of the parts of a post its author can edit.
+  """
+  content = dict((key, value) for key, value in post.iteritems()
+      if key not in VOLATILE_FIELDS)
+  return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()[:16]
+
+
+class Mirror(object):
+  """
+  Mirrors a blog into a directory laid out as tum pull lays it out.
+
+  The mirror records a high-water mark, the newest post ID and timestamp it
+  has seen, along with digests of the newest posts.  Each sync pages back
+  from the newest post only until it passes both the high-water mark and
+  those recent posts, so catching up takes a request or two when little
+  has changed.  New and edited posts are pulled, and recent posts which
+  have vanished are deleted from the archive and the local index.
+  """
+
+  def __init__(self, client, dest_loc, workers=pull.DEFAULT_WORKERS):
+    """
+    Initializes the mirror.
+
+    Args:
+      client - TumblrClient to read posts with
+      dest_loc - location of the directory to mirror the blog into
+      workers - number of threads downloading media at once
+    """
+
+    self.client = client
+    self.puller = pull.Puller(client, dest_loc, workers)
+    self.state_loc = os.path.join(dest_loc, STATE_FILE)
+    self.state = {}
+    if os.path.exists(self.state_loc):
+      with open(self.state_loc, "r") as state_file:
+        self.state = json.load(state_file)
+    self.requests = 0
+    self.new = []
+    self.edited = []
+    self.deleted = []
+
+  def _archived_digest(self, post_id):
+    """
+    Returns the digest of a post as the archive holds it, or None if the
+    archive does not hold it.
+    """
+    record = self.puller.archive.get(post_id)
+    if record is None:
+      return None
+    return ContentDigest(json.loads(record)["post"])
+
+  def _scan(self, blog):
+    """
+    Pages back through a blog until it reaches known territory, returning
+    the digests of every post seen and whether the blog's oldest post was
+    reached.
+
+    Without sync state, as when the directory was made by tum pull, the
+    whole blog is scanned once, and posts already archived unchanged are
+    treated as known rather than new.
+    """
+    seeding = "newest_id" not in self.state
+    newest_id = self.state.get("newest_id", 0)
+    recent = dict((int(post_id), digest) for post_id, digest
+        in self.state.get("recent", {}).iteritems())
+    floor = min(recent) if recent else newest_id
+    seen = {}
+    offset = 0
+    while True:
+      response = self.client.posts(blog, offset=offset,
+          limit=tumblr_client.MAX_PAGE_SIZE)
+      self.requests += 1
+      posts = response.get("posts") or []
+      for post in posts:
+        post_id = int(post["id"])
+        digest = ContentDigest(post)
+        seen[post_id] = digest
+        if seeding:
+          archived = self._archived_digest(post_id)
+          if archived is None:
+            self.new.append(post)
+          elif archived != digest:
+            self.edited.append(post)
+        elif post_id > newest_id:
+          self.new.append(post)
+        elif post_id >= floor and recent.get(post_id) != digest:
+          self.edited.append(post)
+      if len(posts) < tumblr_client.MAX_PAGE_SIZE:
+        return seen, True
+      offset += len(posts)
+      oldest = int(posts[-1]["id"])
+      if oldest <= newest_id and oldest <= floor:
+        return seen, False
+
+  def sync(self, blog, callback=None):
+    """
+    Brings the mirror up to date with a blog.
+
+    Args:
+      blog - string containing the name of the blog to mirror
+      callback - optional callable invoked with each post pulled, as for
+          Puller.run
+
+    Returns:
+      the number of posts whose media could not all be downloaded
+    """
+
+    seen, exhausted = self._scan(blog)
+    recent = dict((int(post_id), digest) for post_id, digest
+        in self.state.get("recent", {}).iteritems())
+    # A recent post is gone if the scan passed where it should have been.
+    if seen:
+      oldest_seen = min(seen)
+      self.deleted = sorted(post_id for post_id in recent
+          if post_id not in seen and (exhausted or post_id >= oldest_seen))
+    failed_ids = []
+
+    def record(post, media, failures):
+      if failures:
+        failed_ids.append(int(post["id"]))
+      if callback:
+        callback(post, media, failures)
+
+    failed = self.puller.process(self.new + self.edited, record,
+        skip_existing=False)
+    for post_id in self.deleted:
+      self.puller.archive.delete(post_id)
+    if self.deleted and self.client.index is not None:
+      self.client.index.remove_posts(self.deleted)
+
+    newest_id = max([self.state.get("newest_id", 0)] + seen.keys())
+    if failed_ids:
+      # Holds the high-water mark below any post which failed, so that the
+      # next sync fetches it again.
+      newest_id = min(newest_id, min(failed_ids) - 1)
+    for post_id in self.deleted + failed_ids:
+      recent.pop(post_id, None)
+      seen.pop(post_id, None)
+    recent.update(seen)
+    timestamps = dict((int(post["id"]), post.get("timestamp"))
+        for post in self.new)
+    self.state = {
+      "blog": blog,
+      "newest_id": newest_id,
+      "newest_timestamp": timestamps.get(newest_id,
+          self.state.get("newest_timestamp")),
+      "recent": dict((str(post_id), recent[post_id])
+          for post_id in sorted(recent, reverse=True)[:RECENT_WINDOW]),
+    }
+    # Saves the state only once the archive is safely flushed.
+    self.puller.archive.flush()
+    with open(self.state_loc + ".tmp", "w") as state_file:
+      json.dump(self.state, state_file)
+    os.rename(self.state_loc + ".tmp", self.state_loc)
+    return failed
+
+  def close(self):
+    self.puller.close()
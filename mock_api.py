@@ -0,0 +1,521 @@
+#!/usr/bin/python
+#
+# mock_api - a local stand-in for the parts of the Tumblr API tum uses
+#
+# Every request must bear a valid OAuth signature, checked by oauth2.Server
+# just as the real API would.  Latency, server errors and 429s can be
+# injected at random, reproducibly given a seed, and responses can be
+# replayed from recorded fixtures in place of the generated ones.  Run it
+# directly to serve it on its own; tum bench starts one for each run.
+import cgi
+import cStringIO
+import BaseHTTPServer
+import ConfigParser
+import json
+import os
+import random
+import re
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+
+from optparse import OptionParser
+from wsgiref import simple_server
+
+import oauth2 as oauth
+import oauth_wsgi
+
+# Contains the default number of posts on each blog, and on the dashboard.
+DEFAULT_POST_COUNT = 1000
+
+# Contains the largest number of posts returned in one page.
+MAX_PAGE_SIZE = 20
+
+# Contains the default number of seconds throttled clients are told to wait.
+DEFAULT_RETRY_AFTER = 1.0
+
+# Contains the number of blogs the dashboard's posts are drawn from.
+DASHBOARD_BLOGS = 10
+
+# Contains the types of post generated, in turn.
+POST_TYPES = ("text", "quote", "link", "chat")
+
+# Contains the messages sent in the envelope of each status the mock answers
+# with.
+STATUS_MESSAGES = {
+  200: "OK",
+  201: "Created",
+  400: "Bad Request",
+  404: "Not Found",
+  429: "Limit Exceeded",
+  500: "Internal Server Error",
+}
+
+# Contains the endpoints served, as (method, path pattern, name) tuples.
+ROUTES = [
+  ("POST", re.compile(r"^/v2/blog/([^/]+)/post$"), "create_post"),
+  ("GET", re.compile(r"^/v2/blog/([^/]+)/info$"), "blog_info"),
+  ("GET", re.compile(r"^/v2/blog/([^/]+)/posts(?:/(\w+))?$"), "posts"),
+  ("GET", re.compile(r"^/v2/user/dashboard$"), "dashboard"),
+  ("GET", re.compile(r"^/v2/user/likes$"), "likes"),
+  ("GET", re.compile(r"^/v2/user/info$"), "user_info"),
+]
+
+
+class Faults(object):
+  """
+  Decides which requests are delayed, failed or throttled.
+  """
+
+  def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+      throttle_rate=0.0, retry_after=DEFAULT_RETRY_AFTER, seed=None):
+    """
+    Initializes the faults.
+
+    Args:
+      latency - seconds every response is delayed by
+      jitter - most seconds added at random to each delay
+      error_rate - fraction of requests answered with 500
+      throttle_rate - fraction of requests answered with 429
+      retry_after - seconds throttled clients are told to wait
+      seed - seed for the choices made, so that runs can be repeated
+    """
+
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.throttle_rate = throttle_rate
+    self.retry_after = retry_after
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+
+  def pick(self):
+    """
+    Returns a (delay, status) tuple for the next request, where status is
+    None unless the request is to fail.
+    """
+    with self._lock:
+      delay = self.latency + self._random.uniform(0, self.jitter)
+      roll = self._random.random()
+    if roll < self.throttle_rate:
+      return delay, 429
+    if roll < self.throttle_rate + self.error_rate:
+      return delay, 500
+    return delay, None
+
+
+class StaticResolver(oauth_wsgi.Resolver):
+  """
+  Knows a single consumer, the one tum signs its requests with.
+  """
+
+  def __init__(self, key, secret):
+    self.consumer = oauth.Consumer(key, secret)
+
+  def get_consumer(self, key):
+    if key == self.consumer.key:
+      return self.consumer
+    return None
+
+  def get_token(self, key):
+    return None
+
+
+class _FormVerifierMiddleware(oauth_wsgi.OAuthVerifierMiddleware):
+  """
+  Verifies multipart posts too, whose plain form fields are signed just as
+  for form-encoded ones, as TumblrClient signs them.
+  """
+
+  def _read_form_body(self, environ):
+    content_type = environ.get("CONTENT_TYPE", "")
+    if not content_type.startswith("multipart/form-data"):
+      return oauth_wsgi.OAuthVerifierMiddleware._read_form_body(self,
+          environ)
+    body = environ["wsgi.input"].read()
+    environ["wsgi.input"] = cStringIO.StringIO(body)
+    form = cgi.FieldStorage(fp=cStringIO.StringIO(body), environ={
+      "REQUEST_METHOD": "POST",
+      "CONTENT_TYPE": content_type,
+      "CONTENT_LENGTH": str(len(body)),
+    }, keep_blank_values=True)
+    return urllib.urlencode([(field.name, field.value)
+        for field in form.list or () if field.filename is None])
+
+
+class MockApi(object):
+  """
+  A WSGI application answering the API's post creation and read endpoints.
+
+  Posts are generated from their position on a blog, so that every page is
+  the same from one run to the next.  Created posts are counted but not kept.
+  Fixtures, if given, are read from files named after the request's path
+  beneath /v2/, such as user/dashboard.json, each holding a response body as
+  recorded from the API; the status in its envelope is the one answered with.
+  """
+
+  def __init__(self, faults=None, fixtures_dir=None,
+      post_count=DEFAULT_POST_COUNT):
+    """
+    Initializes the application.
+
+    Args:
+      faults - Faults deciding which requests are delayed or fail, if any
+      fixtures_dir - directory of recorded responses to replay, if any
+      post_count - number of posts on each blog and on the dashboard
+    """
+
+    self.faults = faults or Faults()
+    self.fixtures_dir = fixtures_dir
+    self.post_count = post_count
+    self.requests = {}
+    self.statuses = {}
+    self._next_id = 1
+    self._lock = threading.Lock()
+
+  def _post(self, blog, position, post_type=None):
+    post_id = self.post_count - position
+    post_type = post_type or POST_TYPES[post_id % len(POST_TYPES)]
+    timestamp = 1300000000 + post_id * 3600
+    post = {
+      "id": post_id,
+      "type": post_type,
+      "blog_name": blog,
+      "post_url": "http://%s.tumblr.com/post/%d" % (blog, post_id),
+      "timestamp": timestamp,
+      "date": time.strftime("%Y-%m-%d %H:%M:%S GMT",
+          time.gmtime(timestamp)),
+      "state": "published",
+      "format": "html",
+      "tags": ["tum", "mock%d" % (post_id % 7)],
+      "note_count": post_id % 50,
+      "summary": "Mock %s post %d" % (post_type, post_id),
+    }
+    if post_type == "text":
+      post["title"] = "Mock post %d" % post_id
+      post["body"] = "<p>%s</p>" % ("Body of mock post %d. " % post_id * 8)
+    elif post_type == "quote":
+      post["text"] = "Quoted text of mock post %d" % post_id
+      post["source"] = "Source %d" % post_id
+    elif post_type == "link":
+      post["title"] = "Mock link %d" % post_id
+      post["url"] = "http://example.com/%d" % post_id
+      post["description"] = "<p>Link %d</p>" % post_id
+    elif post_type == "chat":
+      post["title"] = "Mock chat %d" % post_id
+      post["body"] = "a: hello\nb: post %d" % post_id
+      post["dialogue"] = [
+        {"name": "a", "label": "a:", "phrase": "hello"},
+        {"name": "b", "label": "b:", "phrase": "post %d" % post_id},
+      ]
+    return post
+
+  def _page(self, params, post):
+    """
+    Returns the page of generated posts selected by offset and limit.
+    """
+    offset = max(0, int(params.get("offset", 0)))
+    limit = min(MAX_PAGE_SIZE, max(1, int(params.get("limit", MAX_PAGE_SIZE))))
+    return [post(position)
+        for position in range(offset, min(offset + limit, self.post_count))]
+
+  def create_post(self, params, blog):
+    if "type" not in params:
+      return 400, {"errors": ["Post type is required"]}
+    with self._lock:
+      post_id = self._next_id
+      self._next_id += 1
+    return 201, {"id": post_id}
+
+  def blog_info(self, params, blog):
+    return 200, {"blog": {
+      "name": blog,
+      "title": "Mock blog %s" % blog,
+      "url": "http://%s.tumblr.com/" % blog,
+      "posts": self.post_count,
+      "updated": 1300000000 + self.post_count * 3600,
+      "description": "",
+    }}
+
+  def posts(self, params, blog, post_type=None):
+    posts = self._page(params,
+        lambda position: self._post(blog, position, post_type))
+    return 200, {"blog": {"name": blog}, "posts": posts,
+        "total_posts": self.post_count}
+
+  def dashboard(self, params):
+    posts = self._page(params, lambda position: self._post(
+        "blog%d" % (position % DASHBOARD_BLOGS), position))
+    return 200, {"posts": posts}
+
+  def likes(self, params):
+    posts = self._page(params, lambda position: self._post(
+        "blog%d" % (position % DASHBOARD_BLOGS), position))
+    return 200, {"liked_posts": posts, "liked_count": self.post_count}
+
+  def user_info(self, params):
+    return 200, {"user": {
+      "name": "tum",
+      "likes": self.post_count,
+      "following": DASHBOARD_BLOGS,
+      "default_post_format": "html",
+      "blogs": [{"name": "tum", "url": "http://tum.tumblr.com/",
+          "primary": True}],
+    }}
+
+  def _fixture(self, path):
+    """
+    Returns the recorded (status, body) for a path, or None if there is none.
+    """
+    if not self.fixtures_dir:
+      return None
+    fixture_loc = os.path.join(self.fixtures_dir,
+        path[len("/v2/"):].strip("/") + ".json")
+    if not os.path.isfile(fixture_loc):
+      return None
+    with open(fixture_loc, "rb") as fixture_file:
+      body = fixture_file.read()
+    try:
+      status = int(json.loads(body)["meta"]["status"])
+    except (ValueError, KeyError, TypeError):
+      status = 200
+    return status, body
+
+  def _count(self, name, status):
+    with self._lock:
+      self.requests[name] = self.requests.get(name, 0) + 1
+      self.statuses[status] = self.statuses.get(status, 0) + 1
+
+  def __call__(self, environ, start_response):
+    params = environ.get("oauth.parameters") or {}
+    method = environ["REQUEST_METHOD"]
+    path = environ.get("PATH_INFO", "")
+    name, handler, groups = "unknown", None, ()
+    for route_method, pattern, route_name in ROUTES:
+      match = pattern.match(path)
+      if match and route_method == method:
+        name = route_name
+        handler = getattr(self, route_name)
+        groups = [group for group in match.groups() if group is not None]
+        break
+
+    delay, status = self.faults.pick()
+    if delay:
+      time.sleep(delay)
+    headers = [("Content-Type", "application/json")]
+    body = None
+    response = []
+    if status == 429:
+      headers.append(("Retry-After", "%g" % self.faults.retry_after))
+    elif status is None and handler is None:
+      status = 404
+    elif status is None:
+      recorded = self._fixture(path)
+      if recorded:
+        status, body = recorded
+      else:
+        try:
+          status, response = handler(params, *groups)
+        except ValueError, e:
+          status, response = 400, {"errors": [str(e)]}
+    if body is None:
+      body = json.dumps({"meta": {"status": status,
+          "msg": STATUS_MESSAGES.get(status, "")}, "response": response})
+    self._count(name, status)
+    headers.append(("Content-Length", str(len(body))))
+    start_response("%d %s" % (status, STATUS_MESSAGES.get(status, "")),
+        headers)
+    return [body]
+
+  def stats(self):
+    """
+    Returns the number of requests answered for each endpoint and with each
+    status.
+    """
+    with self._lock:
+      return {
+        "requests": dict(self.requests),
+        "statuses": dict((str(status), count)
+            for status, count in self.statuses.iteritems()),
+      }
+
+
+class _ServerHandler(simple_server.ServerHandler):
+  http_version = "1.1"
+
+
+class _RequestHandler(simple_server.WSGIRequestHandler):
+  """
+  Serves WSGI requests over kept-alive connections, as the API does, so that
+  clients reuse them just as they would in use.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def setup(self):
+    simple_server.WSGIRequestHandler.setup(self)
+    # Sends the headers and body of a response, written separately, without
+    # waiting on the client to acknowledge the headers.
+    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+  def handle(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+  def _read_body(self):
+    # Reads each body whole, so that the next request on the connection is
+    # found where it should be whatever the application reads.
+    if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+      chunks = []
+      while True:
+        size = int(self.rfile.readline().split(";")[0], 16)
+        if not size:
+          while self.rfile.readline() not in ("\r\n", "\n", ""):
+            pass
+          return "".join(chunks)
+        chunks.append(self.rfile.read(size))
+        self.rfile.readline()
+    return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+  def handle_one_request(self):
+    self.raw_requestline = self.rfile.readline(65537)
+    if not self.raw_requestline or not self.parse_request():
+      self.close_connection = 1
+      return
+    body = self._read_body()
+    environ = self.get_environ()
+    environ["CONTENT_LENGTH"] = str(len(body))
+    handler = _ServerHandler(cStringIO.StringIO(body), self.wfile,
+        self.get_stderr(), environ)
+    handler.request_handler = self
+    handler.run(self.server.get_app())
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      simple_server.WSGIRequestHandler.log_message(self, format, *args)
+
+
+class MockServer(SocketServer.ThreadingMixIn, simple_server.WSGIServer):
+  """
+  Serves a MockApi behind OAuth verification, a thread per connection.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, address, consumer_key, consumer_secret, api=None,
+      verbose=False):
+    """
+    Binds the server.
+
+    Args:
+      address - (host, port) tuple to listen on; port 0 picks a free one
+      consumer_key - key of the consumer requests must be signed by
+      consumer_secret - secret of that consumer
+      api - MockApi to serve, if not a default one
+      verbose - whether to log each request to STDERR
+    """
+
+    simple_server.WSGIServer.__init__(self, address, _RequestHandler)
+    self.api = api or MockApi()
+    self.verifier = _FormVerifierMiddleware(self.api,
+        StaticResolver(consumer_key, consumer_secret))
+    self.verbose = verbose
+    self.set_app(self.verifier)
+
+  def stats(self):
+    """
+    Returns the API's counts along with those of verified and rejected
+    signatures.
+    """
+    stats = self.api.stats()
+    stats["verified"] = self.verifier.verified
+    stats["rejected"] = self.verifier.rejected
+    return stats
+
+
+def _ReadCredentials(credfile_loc):
+  """
+  Returns the consumer key and secret tum signs with, from its credentials
+  file.
+  """
+  creds = ConfigParser.RawConfigParser()
+  creds.read(credfile_loc)
+  return (creds.get("Credentials", "oauth_token"),
+      creds.get("Credentials", "oauth_token_secret"))
+
+
+def main(argv):
+  parser = OptionParser("usage: %prog [options]",
+      description="Serves a mock of the Tumblr API endpoints tum uses, "
+      "printing the address it listens on, and the requests it answered as "
+      "JSON once stopped.")
+  parser.add_option("-H", "--host", dest="host", default="127.0.0.1",
+      help="address to listen on")
+  parser.add_option("-p", "--port", dest="port", type="int", default=0,
+      help="port to listen on, or 0 for any free port")
+  parser.add_option("-x", "--credentials", dest="credentials",
+      metavar="CREDFILE", help="accepts requests signed with the credentials "
+      "in a tum credentials file")
+  parser.add_option("-k", "--consumer-key", dest="consumer_key",
+      help="accepts requests signed by this consumer key")
+  parser.add_option("-K", "--consumer-secret", dest="consumer_secret",
+      help="secret of the consumer key")
+  parser.add_option("--latency", dest="latency", type="float", default=0.0,
+      metavar="MS", help="milliseconds every response is delayed by")
+  parser.add_option("--jitter", dest="jitter", type="float", default=0.0,
+      metavar="MS", help="most milliseconds added at random to each delay")
+  parser.add_option("--error-rate", dest="error_rate", type="float",
+      default=0.0, metavar="FRACTION",
+      help="fraction of requests answered with 500")
+  parser.add_option("--throttle-rate", dest="throttle_rate", type="float",
+      default=0.0, metavar="FRACTION",
+      help="fraction of requests answered with 429")
+  parser.add_option("--retry-after", dest="retry_after", type="float",
+      default=DEFAULT_RETRY_AFTER, metavar="SECONDS",
+      help="seconds throttled clients are told to wait")
+  parser.add_option("--fixtures", dest="fixtures", metavar="DIR",
+      help="replays recorded responses from DIR, such as "
+      "DIR/user/dashboard.json")
+  parser.add_option("--posts", dest="posts", type="int",
+      default=DEFAULT_POST_COUNT, help="number of posts on each blog")
+  parser.add_option("--seed", dest="seed", type="int",
+      help="seed for the injected faults")
+  parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+      default=False, help="logs each request to STDERR")
+  (options, args) = parser.parse_args(argv[1:])
+
+  if options.credentials:
+    consumer_key, consumer_secret = _ReadCredentials(options.credentials)
+  elif options.consumer_key and options.consumer_secret:
+    consumer_key, consumer_secret = (options.consumer_key,
+        options.consumer_secret)
+  else:
+    parser.error("either --credentials or both --consumer-key and "
+        "--consumer-secret are required")
+  faults = Faults(options.latency / 1000.0, options.jitter / 1000.0,
+      options.error_rate, options.throttle_rate, options.retry_after,
+      options.seed)
+  server = MockServer((options.host, options.port), consumer_key,
+      consumer_secret, MockApi(faults, options.fixtures, options.posts),
+      options.verbose)
+
+  # Stops cleanly when terminated, as tum bench does once it is done.
+  def terminate(signum, frame):
+    raise KeyboardInterrupt()
+  signal.signal(signal.SIGTERM, terminate)
+  print("Listening on %s:%d" % server.server_address)
+  sys.stdout.flush()
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+  print(json.dumps(server.stats(), sort_keys=True))
+
+
+if __name__ == "__main__":
+  main(sys.argv)
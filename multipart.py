@@ -0,0 +1,238 @@
+#!/usr/bin/python
+#
+# multipart - streams multipart/form-data request bodies from files and URLs
+import cStringIO
+import mimetypes
+import os
+import random
+import tempfile
+import urllib2
+
+# Contains the number of bytes read from a source at a time while streaming.
+BLOCK_SIZE = 64 * 1024
+
+# Contains the URL schemes which are fetched rather than opened from disk.
+URL_SCHEMES = ("http://", "https://", "ftp://")
+
+# Contains the size, in bytes, above which a prepared body is kept in a
+# temporary file rather than in memory.
+PREPARED_MEMORY_LIMIT = 1024 * 1024
+
+
+def IsUrl(location):
+  """
+  Returns whether a file location refers to a URL rather than a local path.
+  """
+  return location.lower().startswith(URL_SCHEMES)
+
+
+def _EncodeHeaderValue(value):
+  return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MultipartBody(object):
+  """
+  A file-like multipart/form-data body whose file parts are streamed.
+
+  Only a single block of any file is held in memory at a time, so the size
+  of the files being uploaded has no bearing on memory use.  When the size
+  of every part is known up front, the body carries a Content-Length;
+  otherwise, as with URLs served without one, it is sent chunked.
+  """
+
+  def __init__(self, fields, files, boundary=None):
+    """
+    Initializes the body, opening every file it will stream.
+
+    Args:
+      fields - list of (name, value) tuples containing plain form fields
+      files - list of (name, location) tuples, where each location is either
+          a local path or a URL
+      boundary - string separating the parts, generated if not supplied
+    """
+
+    self.boundary = boundary or "----tum%030d" % random.randint(0, 10 ** 30)
+    self.length = 0
+    self._parts = []
+    self._index = 0
+    self._finished = False
+    for name, value in fields:
+      self._add_string("--%s\r\nContent-Disposition: form-data; "
+          "name=\"%s\"\r\n\r\n%s\r\n" % (self.boundary,
+              _EncodeHeaderValue(name), value))
+    for name, location in files:
+      self._add_file(name, location)
+    self._add_string("--%s--\r\n" % self.boundary)
+
+  def _add_string(self, data):
+    self._parts.append((cStringIO.StringIO(data), True))
+    if self.length is not None:
+      self.length += len(data)
+
+  def _add_file(self, name, location):
+    if IsUrl(location):
+      source = urllib2.urlopen(location)
+      size = source.info().getheader("Content-Length")
+      content_type = source.info().gettype()
+      filename = os.path.basename(source.geturl().split("?", 1)[0])
+      rewindable = False
+    else:
+      source = open(location, "rb")
+      size = os.fstat(source.fileno()).st_size
+      content_type = mimetypes.guess_type(location)[0]
+      filename = os.path.basename(location)
+      rewindable = True
+    self._add_string("--%s\r\nContent-Disposition: form-data; name=\"%s\"; "
+        "filename=\"%s\"\r\nContent-Type: %s\r\n\r\n" % (self.boundary,
+            _EncodeHeaderValue(name), _EncodeHeaderValue(filename or name),
+            content_type or "application/octet-stream"))
+    self._parts.append((source, rewindable))
+    if size is None or self.length is None:
+      self.length = None
+    else:
+      self.length += int(size)
+    self._add_string("\r\n")
+
+  def headers(self):
+    """
+    Returns a dictionary of the HTTP headers describing this body.
+    """
+    headers = {
+      "Content-Type": "multipart/form-data; boundary=%s" % self.boundary,
+    }
+    if self.length is None:
+      headers["Transfer-Encoding"] = "chunked"
+    else:
+      headers["Content-Length"] = str(self.length)
+    return headers
+
+  def _read_raw(self, size):
+    while self._index < len(self._parts):
+      data = self._parts[self._index][0].read(size)
+      if data:
+        return data
+      self._index += 1
+    return ""
+
+  def read(self, size=BLOCK_SIZE):
+    """
+    Returns the next block of the body, or an empty string once it is done.
+    """
+    if size is None or size < 0:
+      size = BLOCK_SIZE
+    data = self._read_raw(size)
+    if self.length is not None or self._finished:
+      return data
+    # Frames the data for chunked transfer encoding.
+    if not data:
+      self._finished = True
+      return "0\r\n\r\n"
+    return "%x\r\n%s\r\n" % (len(data), data)
+
+  def seek(self, offset):
+    """
+    Rewinds the body to its start, so that it may be sent again.
+    """
+    if offset != 0:
+      raise IOError("Multipart bodies can only be rewound to their start.")
+    for source, rewindable in self._parts:
+      if not rewindable:
+        raise IOError("Bodies streamed from a URL cannot be rewound.")
+    for source, rewindable in self._parts:
+      source.seek(0)
+    self._index = 0
+    self._finished = False
+
+  def close(self):
+    """
+    Closes every file and URL this body streams from.
+    """
+    for source, rewindable in self._parts:
+      source.close()
+
+
+class PreparedBody(object):
+  """
+  A multipart/form-data body encoded once, up front, so that it can be sent
+  in any number of requests, at the same time if need be, without reading
+  its files or fetching its URLs again.
+
+  Small bodies are held in memory; larger ones are written to a temporary
+  file, which every request streams from with a handle of its own.
+  """
+
+  def __init__(self, fields, files, boundary=None,
+      memory_limit=PREPARED_MEMORY_LIMIT):
+    """
+    Encodes the body.
+
+    Args:
+      fields - list of (name, value) tuples containing plain form fields
+      files - list of (name, location) tuples, where each location is either
+          a local path or a URL
+      boundary - string separating the parts, generated if not supplied
+      memory_limit - most bytes held in memory before spilling to disk
+    """
+
+    self._data = None
+    self._temp_loc = None
+    body = MultipartBody(fields, files, boundary)
+    self.boundary = body.boundary
+    blocks = []
+    self.length = 0
+    out_file = None
+    try:
+      while True:
+        # Reads past the chunked framing, since the length is known once the
+        # body is encoded.
+        data = body._read_raw(BLOCK_SIZE)
+        if not data:
+          break
+        self.length += len(data)
+        if out_file is None and self.length > memory_limit:
+          fd, self._temp_loc = tempfile.mkstemp(prefix="tum-body-")
+          out_file = os.fdopen(fd, "wb")
+          out_file.writelines(blocks)
+          blocks = []
+        if out_file is None:
+          blocks.append(data)
+        else:
+          out_file.write(data)
+    except:
+      self.close()
+      raise
+    finally:
+      body.close()
+      if out_file is not None:
+        out_file.close()
+    if self._temp_loc is None:
+      self._data = "".join(blocks)
+
+  def headers(self):
+    """
+    Returns a dictionary of the HTTP headers describing this body.
+    """
+    return {
+      "Content-Type": "multipart/form-data; boundary=%s" % self.boundary,
+      "Content-Length": str(self.length),
+    }
+
+  def open(self):
+    """
+    Returns a new file-like object reading the body from its start.
+    """
+    if self._temp_loc is None:
+      return cStringIO.StringIO(self._data)
+    return open(self._temp_loc, "rb")
+
+  def close(self):
+    """
+    Discards the body, removing any temporary file holding it.
+    """
+    self._data = None
+    if self._temp_loc is not None:
+      try:
+        os.unlink(self._temp_loc)
+      except OSError:
+        pass
+      self._temp_loc = None
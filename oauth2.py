@@ -30,6 +30,7 @@ import urlparse
 import hmac
 import binascii
 import httplib2
+import threading
 
 try:
     from urlparse import parse_qs
@@ -150,6 +151,60 @@ def to_utf8_optional_iterator(x):
     else:
         return [ to_utf8_if_string(e) for e in l ]
 
+def sign_many(requests, signature_method, consumer, token=None):
+    """Sign a batch of requests made with a single consumer and token.
+
+    Signature methods which prepare their key, as HMAC-SHA1 does, do so once
+    for the whole batch, and build the base string prefix of each endpoint
+    once, so each request only pays for its own parameters.
+    """
+    if hasattr(signature_method, 'sign_many'):
+        signature_method.sign_many(requests, consumer, token)
+    else:
+        for request in requests:
+            request.sign_request(signature_method, consumer, token)
+    return requests
+
+# Percent-encoding tables for parameter normalization, mapping every byte to
+# its encoded form.  Only ALPHA, DIGIT and "-._~" are left unencoded, exactly
+# as urllib.quote(s, safe='~') does.  The "twice" table gives the result of
+# encoding the already encoded form again, as the signature base string does.
+_UNRESERVED = ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+    '0123456789-._~')
+_ESCAPE_TABLE = dict((chr(i), chr(i) in _UNRESERVED and chr(i) or '%%%02X' % i)
+    for i in range(256))
+_ESCAPE_TWICE_TABLE = dict((c, e.replace('%', '%25'))
+    for c, e in _ESCAPE_TABLE.iteritems())
+
+# Signature items parsed from recently seen URL query strings.
+_url_items_cache = {}
+_URL_ITEMS_CACHE_SIZE = 128
+
+
+def _encode(s, table):
+    """Percent-encode a normalization key or value using one of the tables."""
+    if not isinstance(s, str):
+        s = str(s)
+    # Most keys and values need no encoding at all, which str.translate can
+    # tell without leaving C.
+    if not s.translate(None, _UNRESERVED):
+        return s
+    return ''.join(map(table.__getitem__, s))
+
+
+def _url_signature_items(query):
+    """Return the signature items for a URL query string, caching them."""
+    items = _url_items_cache.get(query)
+    if items is None:
+        items = [(to_utf8(k), to_utf8(v))
+            for k, v in Request._split_url_string(query).items()
+            if k != 'oauth_signature']
+        if len(_url_items_cache) >= _URL_ITEMS_CACHE_SIZE:
+            _url_items_cache.clear()
+        _url_items_cache[query] = items
+    return items
+
+
 def escape(s):
     """Escape a URL including any /."""
     return urllib.quote(s.encode('utf-8'), safe='~')
@@ -366,8 +421,10 @@ class Request(dict):
 
             # Normalized URL excludes params, query, and fragment.
             self.normalized_url = urlparse.urlunparse((scheme, netloc, path, None, None, None))
+            self._url_query = query
         else:
             self.normalized_url = None
+            self._url_query = None
             self.__dict__['url'] = None
  
     @setter
@@ -398,14 +455,27 @@ class Request(dict):
  
     def to_postdata(self):
         """Serialize as post data for a POST request."""
-        d = {}
+        # Quoting with no safe characters gives the same output as
+        # urlencode() followed by replacing '+' with '%20', in a single pass
+        # over each value.
+        pairs = []
         for k, v in self.iteritems():
-            d[k.encode('utf-8')] = to_utf8_optional_iterator(v)
-
-        # tell urlencode to deal with sequence values and map them correctly
-        # to resulting querystring. for example self["k"] = ["v1", "v2"] will
-        # result in 'k=v1&k=v2' and not k=%5B%27v1%27%2C+%27v2%27%5D
-        return urllib.urlencode(d, True).replace('+', '%20')
+            k = urllib.quote(k.encode('utf-8'), safe='')
+            if isinstance(v, basestring):
+                pairs.append('%s=%s' % (k, urllib.quote(to_utf8(v), safe='')))
+                continue
+            # Sequence values map to one pair per item, so that
+            # self["k"] = ["v1", "v2"] results in 'k=v1&k=v2'.
+            try:
+                items = list(v)
+            except TypeError:
+                items = [v]
+            for item in items:
+                item = to_utf8_if_string(item)
+                if not isinstance(item, str):
+                    item = str(item)
+                pairs.append('%s=%s' % (k, urllib.quote(item, safe='')))
+        return '&'.join(pairs)
  
     def to_url(self):
         """Serialize as a URL for a GET request."""
@@ -417,7 +487,7 @@ class Request(dict):
             query = base_url[4]
         query = parse_qs(query)
         for k, v in self.items():
-            query.setdefault(k, []).append(v)
+            query.setdefault(to_utf8(k), []).append(to_utf8_if_string(v))
         
         try:
             scheme = base_url.scheme
@@ -444,43 +514,68 @@ class Request(dict):
 
         return ret
 
-    def get_normalized_parameters(self):
-        """Return a string that contains the parameters that must be signed."""
+    def _signature_items(self):
+        """Return the sorted (key, value) pairs covered by the signature."""
         items = []
+        append = items.append
         for key, value in self.iteritems():
             if key == 'oauth_signature':
                 continue
+            if isinstance(key, unicode):
+                key = key.encode('utf-8')
+            elif isinstance(key, str):
+                key = to_utf8(key)
             # 1.0a/9.1.1 states that kvp must be sorted by key, then by value,
             # so we unpack sequence values into multiple items for sorting.
-            if isinstance(value, basestring):
-                items.append((to_utf8_if_string(key), to_utf8(value)))
+            if isinstance(value, unicode):
+                append((key, value.encode('utf-8')))
+            elif isinstance(value, str):
+                append((key, to_utf8(value)))
             else:
                 try:
                     value = list(value)
                 except TypeError, e:
                     assert 'is not iterable' in str(e)
-                    items.append((to_utf8_if_string(key), to_utf8_if_string(value)))
+                    append((key, value))
                 else:
-                    items.extend((to_utf8_if_string(key), to_utf8_if_string(item)) for item in value)
+                    items.extend((key, to_utf8_if_string(item)) for item in value)
 
         # Include any query string parameters from the provided URL
-        query = urlparse.urlparse(self.url)[4]
-
-        url_items = self._split_url_string(query).items()
-        url_items = [(to_utf8(k), to_utf8(v)) for k, v in url_items if k != 'oauth_signature' ]
-        items.extend(url_items)
+        try:
+            query = self._url_query
+        except AttributeError:
+            query = urlparse.urlparse(self.url)[4]
+        if query:
+            items.extend(_url_signature_items(query))
 
         items.sort()
-        encoded_str = urllib.urlencode(items)
+        return items
+
+    def get_normalized_parameters(self, escaped=False):
+        """Return a string that contains the parameters that must be signed.
+
+        With `escaped`, the string comes back percent-encoded once more, as
+        it appears in the signature base string, without a second pass.
+        """
         # Encode signature parameters per Oauth Core 1.0 protocol
         # spec draft 7, section 3.6
         # (http://tools.ietf.org/html/draft-hammer-oauth-07#section-3.6)
         # Spaces must be encoded with "%20" instead of "+"
-        return encoded_str.replace('+', '%20').replace('%7E', '~')
+        if escaped:
+            table, equals, ampersand = _ESCAPE_TWICE_TABLE, '%3D', '%26'
+        else:
+            table, equals, ampersand = _ESCAPE_TABLE, '=', '&'
+        return ampersand.join([
+            _encode(key, table) + equals + _encode(value, table)
+            for key, value in self._signature_items()])
 
     def sign_request(self, signature_method, consumer, token):
         """Set the signature parameter to the result of sign."""
+        self._set_signing_parameters(signature_method, consumer, token)
+        self['oauth_signature'] = signature_method.sign(self, consumer, token)
 
+    def _set_signing_parameters(self, signature_method, consumer, token):
+        """Set every parameter the signature covers, ready to be signed."""
         if not self.is_form_encoded:
             # according to
             # http://oauth.googlecode.com/svn/spec/ext/body_hash/1.0/oauth-bodyhash.html
@@ -496,7 +591,6 @@ class Request(dict):
             self['oauth_token'] = token.key
 
         self['oauth_signature_method'] = signature_method.name
-        self['oauth_signature'] = signature_method.sign(self, consumer, token)
  
     @classmethod
     def make_timestamp(cls):
@@ -634,7 +728,14 @@ class Client(httplib2.Http):
         self.method = method
 
     def request(self, uri, method="GET", body='', headers=None, 
-        redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None,
+        parameters=None):
+        """Sign and send a request.
+
+        Form-encoded bodies may be given either as an encoded `body` or as a
+        `parameters` mapping.  The latter skips decoding the body back into
+        parameters for signing, so the body is encoded just once.
+        """
         DEFAULT_POST_CONTENT_TYPE = 'application/x-www-form-urlencoded'
 
         if not isinstance(headers, dict):
@@ -644,13 +745,25 @@ class Client(httplib2.Http):
             headers['Content-Type'] = headers.get('Content-Type', 
                 DEFAULT_POST_CONTENT_TYPE)
 
+        uri, body, headers = self._sign(uri, method, body, headers,
+            parameters)
+
+        return httplib2.Http.request(self, uri, method=method, body=body,
+            headers=headers, redirections=redirections,
+            connection_type=connection_type)
+
+    def _sign(self, uri, method, body, headers, parameters):
+        """Sign a request, returning its URI, body and headers as sent.
+
+        Subclasses may wrap this, such as to time signing apart from sending.
+        """
         is_form_encoded = \
             headers.get('Content-Type') == 'application/x-www-form-urlencoded'
 
-        if is_form_encoded and body:
-            parameters = parse_qs(body)
-        else:
+        if not is_form_encoded:
             parameters = None
+        elif parameters is None and body:
+            parameters = parse_qs(body)
 
         req = Request.from_consumer_and_token(self.consumer, 
             token=self.token, http_method=method, http_url=uri, 
@@ -674,9 +787,125 @@ class Client(httplib2.Http):
         else:
             headers.update(req.to_header(realm=realm))
 
-        return httplib2.Http.request(self, uri, method=method, body=body,
-            headers=headers, redirections=redirections,
-            connection_type=connection_type)
+        return uri, body, headers
+
+
+class NonceStore(object):
+    """Remembers the nonces of verified requests, so replays can be refused.
+
+    OAuth requires a nonce to be unique for each combination of consumer,
+    token and timestamp.  Since the server refuses timestamps older than its
+    `timestamp_threshold`, a store need only remember nonces for that long:
+    unless given a `window` of its own, a store is set to remember them for
+    the threshold of the server it is first used by.  Subclass it and
+    implement `add()` to keep nonces somewhere else.
+    """
+
+    window = None
+    buckets_per_window = 10
+
+    @property
+    def bucket_width(self):
+        """Seconds of timestamps covered by each bucket of nonces."""
+        return max(1, int(self.window) // self.buckets_per_window)
+
+    def add(self, consumer_key, token_key, timestamp, nonce):
+        """Record a nonce, returning False if it had already been recorded."""
+        raise NotImplementedError
+
+
+class MemoryNonceStore(NonceStore):
+    """An in-process nonce store, bounded both in time and in size.
+
+    Nonces are grouped into buckets by timestamp, each a fraction of the
+    `window` wide, so that a whole bucket is dropped at once when its
+    timestamps fall out of the window, rather than each nonce being
+    expired on its own.  When more than `max_entries` nonces are held, the
+    oldest bucket is dropped early.
+    """
+
+    def __init__(self, window=None, max_entries=100000, buckets_per_window=10):
+        self.window = window
+        self.max_entries = max_entries
+        self.buckets_per_window = buckets_per_window
+        self._buckets = {}
+        self._size = 0
+        self._swept = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _sweep(self, now, bucket_width):
+        # Drops every bucket whose newest timestamp is older than the window.
+        oldest = (now - self.window) // bucket_width
+        for index in [i for i in self._buckets if i < oldest]:
+            self._size -= len(self._buckets.pop(index))
+
+    def add(self, consumer_key, token_key, timestamp, nonce):
+        timestamp = int(timestamp)
+        key = (consumer_key, token_key, timestamp, nonce)
+        bucket_width = self.bucket_width
+        index = timestamp // bucket_width
+        with self._lock:
+            now = int(time.time())
+            if now // bucket_width != self._swept:
+                self._sweep(now, bucket_width)
+                self._swept = now // bucket_width
+            bucket = self._buckets.get(index)
+            if bucket is None:
+                bucket = self._buckets[index] = set()
+            elif key in bucket:
+                return False
+            bucket.add(key)
+            self._size += 1
+            while self._size > self.max_entries:
+                oldest = min(self._buckets)
+                self._size -= len(self._buckets.pop(oldest))
+        return True
+
+
+class SQLiteNonceStore(NonceStore):
+    """A nonce store kept in an SQLite database.
+
+    Several verifier processes may share a single database file, so that a
+    request replayed against another process is still refused.  Expired
+    nonces are deleted a bucket at a time, as in `MemoryNonceStore`.
+    """
+
+    def __init__(self, path, window=None, buckets_per_window=10, timeout=5.0):
+        import sqlite3
+        self.window = window
+        self.buckets_per_window = buckets_per_window
+        self._swept = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout,
+            isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS oauth_nonces '
+            '(nonce TEXT PRIMARY KEY, bucket INTEGER NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS oauth_nonces_bucket '
+            'ON oauth_nonces (bucket)')
+
+    def add(self, consumer_key, token_key, timestamp, nonce):
+        timestamp = int(timestamp)
+        key = '%s&%s&%d&%s' % (escape(consumer_key or ''),
+            escape(token_key or ''), timestamp, escape(nonce))
+        bucket_width = self.bucket_width
+        with self._lock:
+            now = int(time.time())
+            if now // bucket_width != self._swept:
+                self._db.execute('DELETE FROM oauth_nonces WHERE bucket < ?',
+                    ((now - self.window) // bucket_width,))
+                self._swept = now // bucket_width
+            cursor = self._db.execute('INSERT OR IGNORE INTO oauth_nonces '
+                '(nonce, bucket) VALUES (?, ?)',
+                (key, timestamp // bucket_width))
+            return cursor.rowcount == 1
+
+    def close(self):
+        self._db.close()
 
 
 class Server(object):
@@ -691,9 +920,11 @@ class Server(object):
     timestamp_threshold = 300 # In seconds, five minutes.
     version = OAUTH_VERSION
     signature_methods = None
+    nonce_store = None
 
-    def __init__(self, signature_methods=None):
+    def __init__(self, signature_methods=None, nonce_store=None):
         self.signature_methods = signature_methods or {}
+        self.nonce_store = nonce_store
 
     def add_signature_method(self, signature_method):
         self.signature_methods[signature_method.name] = signature_method
@@ -719,28 +950,25 @@ class Server(object):
 
     def _get_version(self, request):
         """Return the version of the request for this server."""
-        try:
-            version = request.get_parameter('oauth_version')
-        except:
+        version = request.get('oauth_version')
+        if version is None:
             version = OAUTH_VERSION
 
         return version
 
     def _get_signature_method(self, request):
         """Figure out the signature with some defaults."""
-        try:
-            signature_method = request.get_parameter('oauth_signature_method')
-        except:
+        signature_method = request.get('oauth_signature_method')
+        if signature_method is None:
             signature_method = SIGNATURE_METHOD
 
-        try:
-            # Get the signature method object.
-            signature_method = self.signature_methods[signature_method]
-        except:
+        # Get the signature method object.
+        method = self.signature_methods.get(signature_method)
+        if method is None:
             signature_method_names = ', '.join(self.signature_methods.keys())
             raise Error('Signature method %s not supported try one of the following: %s' % (signature_method, signature_method_names))
 
-        return signature_method
+        return method
 
     def _get_verifier(self, request):
         return request.get_parameter('oauth_verifier')
@@ -750,9 +978,8 @@ class Server(object):
         self._check_timestamp(timestamp)
         signature_method = self._get_signature_method(request)
 
-        try:
-            signature = request.get_parameter('oauth_signature')
-        except:
+        signature = request.get('oauth_signature')
+        if signature is None:
             raise MissingSignature('Missing oauth_signature.')
 
         # Validate the signature.
@@ -764,6 +991,21 @@ class Server(object):
             raise Error('Invalid signature. Expected signature base ' 
                 'string: %s' % base)
 
+        # Only nonces of correctly signed requests are recorded, so that
+        # forged requests cannot fill the store.
+        if self.nonce_store is not None:
+            self._check_nonce(request, timestamp, nonce)
+
+    def _check_nonce(self, request, timestamp, nonce):
+        """Verify that the nonce has not been seen before."""
+        if self.nonce_store.window is None:
+            # Remembers nonces for as long as their timestamps are accepted.
+            self.nonce_store.window = self.timestamp_threshold
+        token_key = request.get('oauth_token')
+        if not self.nonce_store.add(request.get('oauth_consumer_key'),
+                token_key, timestamp, nonce):
+            raise Error('Nonce already used: %s' % nonce)
+
     def _check_timestamp(self, timestamp):
         """Verify that timestamp is recentish."""
         timestamp = int(timestamp)
@@ -804,6 +1046,14 @@ class SignatureMethod(object):
         """
         raise NotImplementedError
 
+    def sign_many(self, requests, consumer, token):
+        """Signs several requests made with the same consumer and token.
+
+        Subclasses may override it to share work between the requests.
+        """
+        for request in requests:
+            request.sign_request(self, consumer, token)
+
     def check(self, request, consumer, token, signature):
         """Returns whether the given signature is the correct signature for
         the given consumer and token signing the given request."""
@@ -814,31 +1064,97 @@ class SignatureMethod(object):
 class SignatureMethod_HMAC_SHA1(SignatureMethod):
     name = 'HMAC-SHA1'
 
-    def signing_base(self, request, consumer, token):
-        if not hasattr(request, 'normalized_url') or request.normalized_url is None:
-            raise ValueError("Base URL for request is not set.")
+    # The most keys and base string prefixes kept prepared at once.
+    max_cached = 128
 
-        sig = (
-            escape(request.method),
-            escape(request.normalized_url),
-            escape(request.get_normalized_parameters()),
-        )
+    def _cache(self, name):
+        """Return one of the method's caches, creating it on first use.
+
+        The caches are not made in `__init__`, so that subclasses whose own
+        `__init__` does not call this class's still get them.
+        """
+        cache = getattr(self, name, None)
+        if cache is None:
+            cache = {}
+            setattr(self, name, cache)
+        return cache
 
+    def _signing_key(self, consumer, token):
         key = '%s&' % escape(consumer.secret)
         if token:
             key += escape(token.secret)
-        raw = '&'.join(sig)
+        return key
+
+    def _prepared_hmac(self, consumer, token):
+        """Return an HMAC primed with the key for this consumer and token.
+
+        Every request signed for the same secrets shares the key, so the
+        keyed state is built once and copied for each signature.
+        """
+        secrets = (consumer.secret, token and token.secret)
+        prepared_keys = self._cache('_prepared_keys')
+        prepared = prepared_keys.get(secrets)
+        if prepared is None:
+            if len(prepared_keys) >= self.max_cached:
+                prepared_keys.clear()
+            prepared = hmac.new(self._signing_key(consumer, token),
+                digestmod=sha)
+            prepared_keys[secrets] = prepared
+        return prepared
+
+    def _signing_message(self, request):
+        if not hasattr(request, 'normalized_url') or request.normalized_url is None:
+            raise ValueError("Base URL for request is not set.")
+
+        endpoint = (request.method, request.normalized_url)
+        base_prefixes = self._cache('_base_prefixes')
+        prefix = base_prefixes.get(endpoint)
+        if prefix is None:
+            if len(base_prefixes) >= self.max_cached:
+                base_prefixes.clear()
+            prefix = '%s&%s&' % (escape(request.method),
+                escape(request.normalized_url))
+            base_prefixes[endpoint] = prefix
+        return prefix + request.get_normalized_parameters(escaped=True)
+
+    def signing_base(self, request, consumer, token):
+        raw = self._signing_message(request)
+        key = self._signing_key(consumer, token)
         return key, raw
 
+    def _has_own_signing_base(self):
+        # Honours a subclass's own signing_base(), which the prepared key and
+        # cached base string prefix would otherwise bypass.
+        signing_base = getattr(self.signing_base, 'im_func', None)
+        return (signing_base is not
+            SignatureMethod_HMAC_SHA1.signing_base.im_func)
+
     def sign(self, request, consumer, token):
         """Builds the base signature string."""
-        key, raw = self.signing_base(request, consumer, token)
-
-        hashed = hmac.new(key, raw, sha)
+        if self._has_own_signing_base():
+            key, raw = self.signing_base(request, consumer, token)
+            hashed = hmac.new(key, raw, sha)
+        else:
+            hashed = self._prepared_hmac(consumer, token).copy()
+            hashed.update(self._signing_message(request))
 
         # Calculate the digest base 64.
         return binascii.b2a_base64(hashed.digest())[:-1]
 
+    def sign_many(self, requests, consumer, token):
+        """Signs several requests, looking up the prepared key just once and
+        building each endpoint's base string prefix once for all of them.
+        """
+        if self._has_own_signing_base():
+            return SignatureMethod.sign_many(self, requests, consumer, token)
+        prepared = self._prepared_hmac(consumer, token)
+        for request in requests:
+            request._set_signing_parameters(self, consumer, token)
+            hashed = prepared.copy()
+            hashed.update(self._signing_message(request))
+            request['oauth_signature'] = binascii.b2a_base64(
+                hashed.digest())[:-1]
+
 
 class SignatureMethod_PLAINTEXT(SignatureMethod):
 
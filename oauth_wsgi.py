@@ -0,0 +1,302 @@
+#!/usr/bin/python
+#
+# oauth_wsgi - WSGI middleware which verifies OAuth-signed requests
+import cStringIO
+import threading
+import time
+import urllib
+
+from collections import OrderedDict
+
+import oauth2 as oauth
+
+# Contains the default number of consumers and tokens kept in the cache.
+DEFAULT_CACHE_SIZE = 10000
+
+# Contains the number of seconds a resolved consumer or token is cached for.
+DEFAULT_CACHE_TTL = 300
+
+# Contains the number of seconds an unknown key is remembered as unknown.
+DEFAULT_NEGATIVE_TTL = 30
+
+# Contains the stages of verification which are timed, in order.
+STAGES = ("parse", "lookup", "verify")
+
+# Contains the body of every 401 response.  Why a request was refused is only
+# logged, since the reason can include the expected signature base string.
+UNAUTHORIZED_BODY = "Invalid or missing OAuth credentials.\n"
+
+
+class LRUCache(object):
+  """
+  A thread-safe, size-bounded cache whose entries also expire after a time.
+  """
+
+  def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """
+    Returns a (found, value) tuple for the given key.
+    """
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None or entry[0] < time.time():
+        self.misses += 1
+        return False, None
+      # Re-inserting moves the entry to the most recently used end.
+      self._entries[key] = entry
+      self.hits += 1
+      return True, entry[1]
+
+  def set(self, key, value, ttl=None):
+    if ttl is None:
+      ttl = self.ttl
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (time.time() + ttl, value)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def __len__(self):
+    return len(self._entries)
+
+
+class Resolver(object):
+  """
+  Looks up the consumers and tokens which requests are signed with.
+  Subclass it to read credentials from wherever they are kept.
+  """
+
+  def get_consumer(self, key):
+    """
+    Returns the oauth2.Consumer with the given key, or None if unknown.
+    """
+    raise NotImplementedError
+
+  def get_token(self, key):
+    """
+    Returns the oauth2.Token with the given key, or None if unknown.
+    """
+    raise NotImplementedError
+
+
+class CachingResolver(Resolver):
+  """
+  Fronts another Resolver with an LRU cache.  Keys which turn out to be
+  unknown are cached too, for a shorter time, so that requests bearing bogus
+  keys do not reach the backing store each time.
+  """
+
+  def __init__(self, resolver, max_entries=DEFAULT_CACHE_SIZE,
+      ttl=DEFAULT_CACHE_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """
+    Initializes the resolver.
+
+    Args:
+      resolver - Resolver to look up uncached keys with
+      max_entries - maximum number of consumers and tokens cached
+      ttl - seconds for which a known key is cached
+      negative_ttl - seconds for which an unknown key is cached
+    """
+
+    self.resolver = resolver
+    self.negative_ttl = negative_ttl
+    self.cache = LRUCache(max_entries, ttl)
+
+  def _lookup(self, kind, key, lookup):
+    found, value = self.cache.get((kind, key))
+    if found:
+      return value
+    value = lookup(key)
+    if value is None:
+      self.cache.set((kind, key), None, self.negative_ttl)
+    else:
+      self.cache.set((kind, key), value)
+    return value
+
+  def get_consumer(self, key):
+    return self._lookup("consumer", key, self.resolver.get_consumer)
+
+  def get_token(self, key):
+    return self._lookup("token", key, self.resolver.get_token)
+
+
+def RequestUrl(environ, query=True):
+  """
+  Reconstructs the URL of a request from its WSGI environment.
+
+  Args:
+    environ - dictionary containing the WSGI environment
+    query - whether to include the query string
+  """
+  scheme = environ["wsgi.url_scheme"]
+  host = environ.get("HTTP_HOST")
+  if not host:
+    host = environ["SERVER_NAME"]
+    port = environ.get("SERVER_PORT")
+    if port and (scheme, port) not in (("http", "80"), ("https", "443")):
+      host = "%s:%s" % (host, port)
+  path = urllib.quote(environ.get("SCRIPT_NAME", "") +
+      environ.get("PATH_INFO", ""))
+  url = "%s://%s%s" % (scheme, host, path)
+  if query and environ.get("QUERY_STRING"):
+    url = "%s?%s" % (url, environ["QUERY_STRING"])
+  return url
+
+
+class OAuthVerifierMiddleware(object):
+  """
+  WSGI middleware which passes on only requests bearing a valid OAuth
+  signature, answering any others with 401 Unauthorized.
+
+  Verified requests reach the wrapped application with the consumer, token
+  and non-OAuth parameters in the environment under "oauth.consumer",
+  "oauth.token" and "oauth.parameters".  The time spent in each stage of
+  verification is placed under "oauth.timings", sent in a Server-Timing
+  header and accumulated in stage_totals.  Refused requests all get the same
+  body, while the reason for each is written to wsgi.errors.
+  """
+
+  def __init__(self, app, resolver, server=None, realm=""):
+    """
+    Initializes the middleware.
+
+    Args:
+      app - WSGI application to protect
+      resolver - Resolver used to look up consumers and tokens
+      server - oauth2.Server to verify with, accepting HMAC-SHA1 by default
+      realm - realm named in WWW-Authenticate challenges
+    """
+
+    self.app = app
+    self.resolver = resolver
+    if server is None:
+      server = oauth.Server()
+      server.add_signature_method(oauth.SignatureMethod_HMAC_SHA1())
+    self.server = server
+    self.realm = realm
+    self.verified = 0
+    self.rejected = 0
+    self.stage_totals = dict((stage, 0.0) for stage in STAGES)
+    self._lock = threading.Lock()
+
+  def _read_form_body(self, environ):
+    """
+    Returns the body of a form-encoded request, leaving it in place for the
+    wrapped application to read again.
+    """
+    content_type = environ.get("CONTENT_TYPE", "")
+    if not content_type.startswith("application/x-www-form-urlencoded"):
+      return None
+    try:
+      length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+      return None
+    body = environ["wsgi.input"].read(length)
+    environ["wsgi.input"] = cStringIO.StringIO(body)
+    return body
+
+  def _verify(self, environ, timings):
+    start = time.time()
+    headers = {}
+    if "HTTP_AUTHORIZATION" in environ:
+      headers["Authorization"] = environ["HTTP_AUTHORIZATION"]
+    # Gathers the query string and form parameters here, rather than leaving
+    # them to Request.from_request, which unquotes values a second time and
+    # counts query parameters twice when signing.
+    parameters = {}
+    for source in (environ.get("QUERY_STRING"), self._read_form_body(environ)):
+      if source:
+        for key, values in oauth.parse_qs(source,
+            keep_blank_values=True).iteritems():
+          parameters.setdefault(key, []).extend(values)
+    for key, values in parameters.items():
+      if len(values) == 1:
+        parameters[key] = values[0]
+    request = oauth.Request.from_request(environ["REQUEST_METHOD"],
+        RequestUrl(environ, query=False), headers=headers,
+        parameters=parameters)
+    now = time.time()
+    timings["parse"] = now - start
+    if request is None:
+      raise oauth.Error("Request is not signed.")
+
+    start = now
+    consumer_key = request.get("oauth_consumer_key")
+    consumer = consumer_key and self.resolver.get_consumer(consumer_key)
+    if not consumer:
+      raise oauth.Error("Unknown consumer: %s" % consumer_key)
+    token = None
+    token_key = request.get("oauth_token")
+    if token_key:
+      token = self.resolver.get_token(token_key)
+      if not token:
+        raise oauth.Error("Unknown token: %s" % token_key)
+    now = time.time()
+    timings["lookup"] = now - start
+
+    start = now
+    parameters = self.server.verify_request(request, consumer, token)
+    timings["verify"] = time.time() - start
+    return consumer, token, parameters
+
+  def _record(self, timings, verified):
+    with self._lock:
+      if verified:
+        self.verified += 1
+      else:
+        self.rejected += 1
+      for stage, elapsed in timings.iteritems():
+        self.stage_totals[stage] += elapsed
+
+  def _server_timing(self, timings):
+    return ", ".join("%s;dur=%.3f" % (stage, timings[stage] * 1000)
+        for stage in STAGES if stage in timings)
+
+  def __call__(self, environ, start_response):
+    timings = {}
+    try:
+      consumer, token, parameters = self._verify(environ, timings)
+    except (oauth.Error, KeyError, TypeError, ValueError), e:
+      self._record(timings, False)
+      # Logs only the path, since the URL itself may be what is malformed.
+      environ["wsgi.errors"].write("Refused OAuth request for %s %s: %s\n" % (
+          environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"), e))
+      headers = [
+        ("Content-Type", "text/plain"),
+        ("Content-Length", str(len(UNAUTHORIZED_BODY))),
+        ("Server-Timing", self._server_timing(timings)),
+      ]
+      headers.extend(self.server.build_authenticate_header(self.realm).items())
+      start_response("401 Unauthorized", headers)
+      return [UNAUTHORIZED_BODY]
+    self._record(timings, True)
+    environ["oauth.consumer"] = consumer
+    environ["oauth.token"] = token
+    environ["oauth.parameters"] = parameters
+    environ["oauth.timings"] = timings
+
+    def timed_start_response(status, headers, exc_info=None):
+      headers = list(headers)
+      headers.append(("Server-Timing", self._server_timing(timings)))
+      return start_response(status, headers, exc_info)
+
+    return self.app(environ, timed_start_response)
+
+  def stats(self):
+    """
+    Returns counts of verified and rejected requests along with the average
+    seconds spent in each stage of verification.
+    """
+    with self._lock:
+      total = self.verified + self.rejected
+      stats = {"verified": self.verified, "rejected": self.rejected}
+      for stage in STAGES:
+        stats["%s_avg" % stage] = total and self.stage_totals[stage] / total
+      return stats
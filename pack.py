@@ -0,0 +1,323 @@
+#!/usr/bin/python
+#
+# pack - an append-only, indexed archive of post records
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+# Contains the names of the files making up an archive.
+PACK_FILE = "posts.pack"
+INDEX_FILE = "posts.idx"
+
+# Contains the magic numbers which open pack and index files.
+PACK_MAGIC = "TUMPACK1"
+INDEX_MAGIC = "TUMIDX01"
+
+# Describes the header of a pack file: its magic number and a random ID,
+# which its index records so that a stale index is never trusted.
+PACK_HEADER = struct.Struct(">8s8s")
+
+# Describes the header of each record: post ID, payload length, flags and
+# the CRC-32 of the payload.
+RECORD_HEADER = struct.Struct(">QIBI")
+
+# Describes the header of an index file: its magic number, the ID of its
+# pack, the number of entries and the length of the pack it covers.
+INDEX_HEADER = struct.Struct(">8s8sQQ")
+
+# Describes an index entry: post ID and record offset, sorted by post ID.
+INDEX_ENTRY = struct.Struct(">QQ")
+
+# Marks records whose payload is zlib-compressed.
+FLAG_ZLIB = 1
+
+# Marks records recording that a post was deleted.
+FLAG_DELETED = 2
+
+# Contains the size in bytes below which records are not worth compressing.
+COMPRESS_THRESHOLD = 128
+
+
+class PackArchive(object):
+  """
+  Stores records keyed by post ID in a single append-only pack file.
+
+  Writing a record again appends a new copy, which supersedes the old one.
+  A sorted index of post IDs and offsets is read through mmap, so finding any
+  record takes a binary search rather than loading the archive.  Deleting a
+  post appends a tombstone record, which hides any earlier copy.  Records
+  added since the index was last written are held in memory and merged into
+  it on flush; should tum die before then, they are recovered on open by
+  scanning the end of the pack.  Only one process may write at a time.
+  """
+
+  def __init__(self, archive_loc, compress=True):
+    """
+    Opens the archive, creating it if needed.
+
+    Args:
+      archive_loc - location of the directory holding the archive
+      compress - whether new records are zlib-compressed
+    """
+
+    self.archive_loc = archive_loc
+    self.compress = compress
+    if not os.path.exists(archive_loc):
+      os.makedirs(archive_loc)
+    self.pack_loc = os.path.join(archive_loc, PACK_FILE)
+    self.index_loc = os.path.join(archive_loc, INDEX_FILE)
+    self._lock = threading.RLock()
+    self._pending = {}
+    self._open()
+
+  def _open(self):
+    if not os.path.exists(self.pack_loc):
+      with open(self.pack_loc, "wb") as pack_file:
+        pack_file.write(PACK_HEADER.pack(PACK_MAGIC, os.urandom(8)))
+    self._pack = open(self.pack_loc, "r+b")
+    magic, self._pack_id = PACK_HEADER.unpack(
+        self._pack.read(PACK_HEADER.size))
+    if magic != PACK_MAGIC:
+      raise IOError("%s is not a tum pack" % self.pack_loc)
+    self._index_file = None
+    self._index = None
+    self._count = 0
+    indexed_size = PACK_HEADER.size
+    if os.path.exists(self.index_loc):
+      try:
+        magic, pack_id, count, size = self._open_index()
+      except (ValueError, struct.error, mmap.error):
+        magic = None
+      if magic == INDEX_MAGIC and pack_id == self._pack_id:
+        indexed_size = size
+      else:
+        # Rebuilds an index which is damaged or belongs to another pack.
+        self._close_index()
+    self._recover(indexed_size)
+
+  def _open_index(self):
+    """
+    Maps the index into memory, returning its header fields.
+    """
+    self._index_file = open(self.index_loc, "rb")
+    self._index = mmap.mmap(self._index_file.fileno(), 0,
+        access=mmap.ACCESS_READ)
+    header = INDEX_HEADER.unpack_from(self._index)
+    self._count = header[2]
+    return header
+
+  def _close_index(self):
+    if self._index is not None:
+      self._index.close()
+    if self._index_file is not None:
+      self._index_file.close()
+    self._index = None
+    self._index_file = None
+    self._count = 0
+
+  def _recover(self, offset):
+    """
+    Scans the pack from an offset for records missing from the index,
+    truncating any record left incomplete by a crash.
+    """
+    self._pack.seek(0, os.SEEK_END)
+    end = self._pack.tell()
+    while offset < end:
+      self._pack.seek(offset)
+      header = self._pack.read(RECORD_HEADER.size)
+      if len(header) < RECORD_HEADER.size:
+        break
+      post_id, length, flags, crc = RECORD_HEADER.unpack(header)
+      payload = self._pack.read(length)
+      if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+        break
+      if flags & FLAG_DELETED:
+        self._pending[post_id] = None
+      else:
+        self._pending[post_id] = offset
+      offset += RECORD_HEADER.size + length
+    if offset < end:
+      self._pack.truncate(offset)
+    self._pack.seek(0, os.SEEK_END)
+
+  def _find(self, post_id):
+    """
+    Returns the offset of a post's newest record, or None.
+    """
+    if post_id in self._pending or self._index is None:
+      return self._pending.get(post_id)
+    low, high = 0, self._count
+    while low < high:
+      middle = (low + high) // 2
+      entry_id, offset = INDEX_ENTRY.unpack_from(self._index,
+          INDEX_HEADER.size + middle * INDEX_ENTRY.size)
+      if entry_id < post_id:
+        low = middle + 1
+      elif entry_id > post_id:
+        high = middle
+      else:
+        return offset
+    return None
+
+  def _read(self, offset):
+    self._pack.seek(offset)
+    post_id, length, flags, crc = RECORD_HEADER.unpack(
+        self._pack.read(RECORD_HEADER.size))
+    payload = self._pack.read(length)
+    if flags & FLAG_ZLIB:
+      payload = zlib.decompress(payload)
+    return payload
+
+  def get(self, post_id):
+    """
+    Returns the newest record for a post, or None if there is none.
+    """
+    with self._lock:
+      offset = self._find(int(post_id))
+      if offset is None:
+        return None
+      return self._read(offset)
+
+  def __contains__(self, post_id):
+    with self._lock:
+      return self._find(int(post_id)) is not None
+
+  def put(self, post_id, data):
+    """
+    Appends a record for a post, superseding any earlier one.
+
+    Args:
+      post_id - integer ID of the post
+      data - string containing the record
+    """
+
+    flags = 0
+    if self.compress and len(data) >= COMPRESS_THRESHOLD:
+      compressed = zlib.compress(data)
+      if len(compressed) < len(data):
+        data = compressed
+        flags |= FLAG_ZLIB
+    self._append(int(post_id), data, flags)
+
+  def delete(self, post_id):
+    """
+    Appends a tombstone for a post, hiding every earlier record of it.
+    """
+    self._append(int(post_id), "", FLAG_DELETED)
+
+  def _append(self, post_id, data, flags):
+    with self._lock:
+      self._pack.seek(0, os.SEEK_END)
+      offset = self._pack.tell()
+      self._pack.write(RECORD_HEADER.pack(post_id, len(data), flags,
+          zlib.crc32(data) & 0xffffffff) + data)
+      if flags & FLAG_DELETED:
+        self._pending[post_id] = None
+      else:
+        self._pending[post_id] = offset
+
+  def _entries(self):
+    """
+    Yields (post ID, offset) tuples for the newest record of every post, in
+    order of post ID.
+    """
+    pending = sorted(self._pending.iteritems())
+    position = 0
+    for i in xrange(self._count):
+      entry_id, offset = INDEX_ENTRY.unpack_from(self._index,
+          INDEX_HEADER.size + i * INDEX_ENTRY.size)
+      while position < len(pending) and pending[position][0] < entry_id:
+        if pending[position][1] is not None:
+          yield pending[position]
+        position += 1
+      if position < len(pending) and pending[position][0] == entry_id:
+        continue
+      yield entry_id, offset
+    for entry in pending[position:]:
+      if entry[1] is not None:
+        yield entry
+
+  def ids(self):
+    """
+    Returns a list of the IDs of every post in the archive, in order.
+    """
+    with self._lock:
+      return [post_id for post_id, offset in self._entries()]
+
+  def __len__(self):
+    with self._lock:
+      return sum(1 for entry in self._entries())
+
+  def _write_index(self, index_loc, pack_id, entries, pack_size):
+    count = 0
+    with open(index_loc + ".tmp", "wb") as index_file:
+      index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, pack_id, 0, 0))
+      for post_id, offset in entries:
+        index_file.write(INDEX_ENTRY.pack(post_id, offset))
+        count += 1
+      index_file.seek(0)
+      index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, pack_id, count,
+          pack_size))
+      index_file.flush()
+      os.fsync(index_file.fileno())
+    os.rename(index_loc + ".tmp", index_loc)
+
+  def flush(self):
+    """
+    Makes every record durable and merges new ones into the index.
+    """
+    with self._lock:
+      self._pack.flush()
+      os.fsync(self._pack.fileno())
+      if not self._pending:
+        return
+      self._pack.seek(0, os.SEEK_END)
+      self._write_index(self.index_loc, self._pack_id, self._entries(),
+          self._pack.tell())
+      self._close_index()
+      self._pending = {}
+      self._open_index()
+
+  def repack(self):
+    """
+    Rewrites the archive without superseded records or tombstones.
+
+    Returns:
+      a (size before, size after) tuple, in bytes
+    """
+    with self._lock:
+      self.flush()
+      before = os.path.getsize(self.pack_loc)
+      pack_id = os.urandom(8)
+      new_pack_loc = self.pack_loc + ".tmp"
+      entries = []
+      with open(new_pack_loc, "wb") as new_pack:
+        new_pack.write(PACK_HEADER.pack(PACK_MAGIC, pack_id))
+        for post_id, offset in self._entries():
+          self._pack.seek(offset)
+          header = self._pack.read(RECORD_HEADER.size)
+          length = RECORD_HEADER.unpack(header)[1]
+          entries.append((post_id, new_pack.tell()))
+          new_pack.write(header + self._pack.read(length))
+        new_pack.flush()
+        os.fsync(new_pack.fileno())
+        after = new_pack.tell()
+      # The new index names the new pack's ID, so whichever of the two
+      # renames a crash interrupts, a mismatched index is rebuilt on open.
+      self._write_index(self.index_loc + ".new", pack_id, entries, after)
+      self.close()
+      os.rename(new_pack_loc, self.pack_loc)
+      os.rename(self.index_loc + ".new", self.index_loc)
+      self._pending = {}
+      self._open()
+      return before, after
+
+  def close(self):
+    with self._lock:
+      if self._pack.closed:
+        return
+      self.flush()
+      self._close_index()
+      self._pack.close()
@@ -0,0 +1,418 @@
+#!/usr/bin/python
+#
+# post_decoder - decodes pages of posts into compact, lazily decoded objects
+import json
+import re
+
+from json.decoder import scanstring
+
+# Matches the whitespace JSON allows between tokens.
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Matches a JSON string.
+STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+# Matches a run of JSON holding no brackets outside of its strings, so that
+# skipping over a nested value only stops at its brackets.
+FILLER = re.compile(r'[^"\[\]{}]*(?:%s[^"\[\]{}]*)*' % STRING)
+
+# Contains the depth of nesting which NESTED matches in one go.
+NESTED_DEPTH = 8
+
+
+def _NestedPattern(depth):
+  """
+  Builds a pattern matching an array or object nested no more than depth
+  levels deep.  Each alternative starts with a character the others cannot,
+  so the pattern never backtracks far, even when it fails.
+  """
+  text = r'[^"\[\]{}]*'
+  pattern = r'[\[{]%s(?:%s%s)*[\]}]' % (text, STRING, text)
+  for i in range(depth - 1):
+    pattern = r'[\[{]%s(?:(?:%s|%s)%s)*[\]}]' % (text, STRING, pattern, text)
+  return pattern
+
+# Matches most arrays and objects whole, so that only the most deeply nested
+# are skipped a bracket at a time.
+NESTED = re.compile(_NestedPattern(NESTED_DEPTH))
+
+# Matches a number, true, false or null.
+SCALAR = re.compile(r"[^,:}\] \t\n\r]+")
+
+# Decodes single values in place, using the C scanner where available.
+_DECODER = json.JSONDecoder()
+
+# Marks fields a post does not have.
+_MISSING = object()
+
+
+def _SkipWhitespace(source, pos):
+  return WHITESPACE.match(source, pos).end()
+
+
+def _SkipValue(source, pos):
+  """
+  Returns the offset just past the JSON value starting at an offset, without
+  decoding it.
+  """
+  char = source[pos:pos + 1]
+  if char == '"':
+    return scanstring(source, pos + 1)[1]
+  if char not in ("{", "["):
+    match = SCALAR.match(source, pos)
+    if match is None:
+      raise ValueError("Expecting a value at offset %d" % pos)
+    return match.end()
+  match = NESTED.match(source, pos)
+  if match is not None:
+    return match.end()
+  depth = 0
+  while True:
+    char = source[pos:pos + 1]
+    if char in ("{", "["):
+      depth += 1
+    elif char in ("}", "]"):
+      depth -= 1
+    else:
+      raise ValueError("Unterminated value at offset %d" % pos)
+    pos += 1
+    if not depth:
+      return pos
+    pos = FILLER.match(source, pos).end()
+
+
+def _ScanObject(source, pos, readers=None):
+  """
+  Finds the members of the JSON object starting at an offset.
+
+  Args:
+    source - string containing the JSON
+    pos - offset at which the object starts
+    readers - dictionary mapping the names of members to callables which
+        read their values, given the source and the offset of the value, and
+        return the value read and the offset just past it; the values of
+        any other members are skipped
+
+  Returns:
+    a list of (name, start) tuples locating the value of each member skipped,
+    a dictionary of the values read, and the offset just past the object
+  """
+
+  if source[pos:pos + 1] != "{":
+    raise ValueError("Expecting an object at offset %d" % pos)
+  members = []
+  values = {}
+  pos = _SkipWhitespace(source, pos + 1)
+  if source[pos:pos + 1] == "}":
+    return members, values, pos + 1
+  while True:
+    if source[pos:pos + 1] != '"':
+      raise ValueError("Expecting a member name at offset %d" % pos)
+    name, pos = scanstring(source, pos + 1)
+    pos = _SkipWhitespace(source, pos)
+    if source[pos:pos + 1] != ":":
+      raise ValueError("Expecting ':' at offset %d" % pos)
+    start = _SkipWhitespace(source, pos + 1)
+    if readers and name in readers:
+      values[name], end = readers[name](source, start)
+    else:
+      members.append((name, start))
+      end = _SkipValue(source, start)
+    pos = _SkipWhitespace(source, end)
+    char = source[pos:pos + 1]
+    if char == "}":
+      return members, values, pos + 1
+    if char != ",":
+      raise ValueError("Expecting ',' at offset %d" % pos)
+    pos = _SkipWhitespace(source, pos + 1)
+
+
+def _ReadArray(source, pos, reader):
+  """
+  Reads each element of the JSON array starting at an offset.
+
+  Args:
+    source - string containing the JSON
+    pos - offset at which the array starts
+    reader - callable reading an element, as for the readers of _ScanObject
+
+  Returns:
+    a list of the elements read, and the offset just past the array
+  """
+
+  elements = []
+  pos = _SkipWhitespace(source, pos + 1)
+  if source[pos:pos + 1] == "]":
+    return elements, pos + 1
+  while True:
+    element, end = reader(source, pos)
+    elements.append(element)
+    pos = _SkipWhitespace(source, end)
+    char = source[pos:pos + 1]
+    if char == "]":
+      return elements, pos + 1
+    if char != ",":
+      raise ValueError("Expecting ',' at offset %d" % pos)
+    pos = _SkipWhitespace(source, pos + 1)
+
+
+def _Decode(source, start):
+  return _DECODER.raw_decode(source, start)[0]
+
+
+def _Read(source, start):
+  return _DECODER.raw_decode(source, start)
+
+
+class Post(object):
+  """
+  A post read from the API, holding the fields listings use and leaving the
+  rest of its JSON undecoded until first used.
+
+  Fields may be read as attributes or as with a dictionary, so that posts
+  can be used wherever the API's decoded JSON was.  Each post type has a
+  subclass with slots for its own fields; any others are kept aside.
+  """
+
+  # Contains the fields decoded as soon as a post is read.
+  EAGER_FIELDS = ("id", "type", "blog_name", "timestamp", "date", "state",
+      "post_url", "summary", "tags")
+
+  # Contains the fields specific to the post type, decoded on first use.
+  FIELDS = ()
+
+  __slots__ = EAGER_FIELDS + ("_source", "_raw", "_extra")
+
+  def __init__(self, source, start, end, members):
+    """
+    Initializes the post, keeping a copy of its own JSON rather than the
+    page it was read from, so that a post kept alive does not keep the page.
+
+    Args:
+      source - string containing the page the post was read from
+      start - offset at which the post's JSON starts
+      end - offset just past the post's JSON
+      members - list of (name, start) tuples locating each field
+    """
+
+    self._source = source[start:end]
+    self._raw = {}
+    self._extra = None
+    for name, value_start in members:
+      if name in self.EAGER_FIELDS:
+        setattr(self, name, _Decode(source, value_start))
+      else:
+        self._raw[name] = value_start - start
+
+  def _slot(self, name):
+    # Reads a slot without falling back on __getattr__.
+    try:
+      return object.__getattribute__(self, name)
+    except AttributeError:
+      return _MISSING
+
+  def _lookup(self, name):
+    value_start = self._raw.pop(name, None)
+    if value_start is not None:
+      value = _Decode(self._source, value_start)
+      if name in self.SLOTTED:
+        setattr(self, name, value)
+      else:
+        if self._extra is None:
+          self._extra = {}
+        self._extra[name] = value
+      return value
+    if name in self.SLOTTED:
+      return self._slot(name)
+    if self._extra:
+      return self._extra.get(name, _MISSING)
+    return _MISSING
+
+  def __getattr__(self, name):
+    # Only called for fields which are not decoded yet or are missing.
+    if name.startswith("_"):
+      raise AttributeError(name)
+    value = self._lookup(name)
+    if value is _MISSING:
+      raise AttributeError(name)
+    return value
+
+  def __getitem__(self, name):
+    value = self._lookup(name)
+    if value is _MISSING:
+      raise KeyError(name)
+    return value
+
+  def get(self, name, default=None):
+    value = self._lookup(name)
+    if value is _MISSING:
+      return default
+    return value
+
+  def __contains__(self, name):
+    return name in self._raw or self._lookup(name) is not _MISSING
+
+  def keys(self):
+    names = [name for name in self.SLOTTED
+        if self._slot(name) is not _MISSING]
+    names.extend(self._raw)
+    names.extend(self._extra or ())
+    return names
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def iteritems(self):
+    for name in self.keys():
+      yield name, self[name]
+
+  def items(self):
+    return list(self.iteritems())
+
+  def to_dict(self):
+    """
+    Returns the post as a dictionary, decoding every field.
+    """
+    return dict(self.iteritems())
+
+  def to_json(self):
+    """
+    Returns the post's JSON exactly as the API sent it.
+    """
+    return self._source
+
+  def __repr__(self):
+    return "<%s %s>" % (type(self).__name__, self.get("id"))
+
+
+class TextPost(Post):
+  FIELDS = ("title", "body")
+  __slots__ = FIELDS
+
+
+class PhotoPost(Post):
+  FIELDS = ("photos", "caption", "link_url", "image_permalink",
+      "photoset_layout")
+  __slots__ = FIELDS
+
+
+class QuotePost(Post):
+  FIELDS = ("text", "source")
+  __slots__ = FIELDS
+
+
+class LinkPost(Post):
+  FIELDS = ("title", "url", "description", "excerpt", "author", "publisher",
+      "photos")
+  __slots__ = FIELDS
+
+
+class ChatPost(Post):
+  FIELDS = ("title", "body", "dialogue")
+  __slots__ = FIELDS
+
+
+class AudioPost(Post):
+  FIELDS = ("caption", "player", "audio_url", "audio_source_url", "plays",
+      "album_art", "artist", "album", "track_name", "track_number", "year")
+  __slots__ = FIELDS
+
+
+class VideoPost(Post):
+  FIELDS = ("caption", "player", "video_url", "permalink_url",
+      "thumbnail_url")
+  __slots__ = FIELDS
+
+
+# Contains the class used for each type of post; posts of any other type are
+# read as plain Posts.
+POST_CLASSES = {
+  "audio": AudioPost,
+  "chat": ChatPost,
+  "link": LinkPost,
+  "photo": PhotoPost,
+  "quote": QuotePost,
+  "text": TextPost,
+  "video": VideoPost,
+}
+
+for _cls in [Post] + POST_CLASSES.values():
+  _cls.SLOTTED = frozenset(Post.EAGER_FIELDS + _cls.FIELDS)
+
+
+def _ReadPost(source, start):
+  """
+  Reads the JSON object starting at an offset into a post of its type,
+  returning the post and the offset just past it.
+  """
+  if source[start:start + 1] != "{":
+    return _Read(source, start)
+  members, values, end = _ScanObject(source, start)
+  post_class = Post
+  for name, value_start in members:
+    if name == "type":
+      post_class = POST_CLASSES.get(_Decode(source, value_start), Post)
+      break
+  return post_class(source, start, end, members), end
+
+
+def _ReadPosts(source, start):
+  if source[start:start + 1] != "[":
+    return _Read(source, start)
+  return _ReadArray(source, start, _ReadPost)
+
+
+def DecodePost(source, start=0):
+  """
+  Reads the JSON object starting at an offset into a post of its type.
+  """
+  return _ReadPost(source, _SkipWhitespace(source, start))[0]
+
+
+def DecodeResponse(content, posts_key):
+  """
+  Decodes the "response" member of an API response listing posts, reading
+  the posts into Post objects rather than decoding them in full.  The body
+  is scanned once, and nothing nested in a post is decoded until used.
+
+  Args:
+    content - string containing the response body
+    posts_key - name of the member of the response listing the posts
+
+  Returns:
+    the decoded "response" member, or None if it is missing
+  """
+
+  def read_response(source, start):
+    if source[start:start + 1] != "{":
+      return _Read(source, start)
+    members, response, end = _ScanObject(source, start,
+        {posts_key: _ReadPosts})
+    for name, value_start in members:
+      response[name] = _Decode(source, value_start)
+    return response, end
+
+  values = _ScanObject(content, _SkipWhitespace(content, 0),
+      {"response": read_response})[1]
+  return values.get("response")
+
+
+def AsDict(post):
+  """
+  Returns a post as a dictionary, whether or not it is a Post.
+  """
+  if isinstance(post, Post):
+    return post.to_dict()
+  return post
+
+
+def AsJson(post):
+  """
+  Returns the JSON of a post, as sent by the API where it is known.
+  """
+  if isinstance(post, Post):
+    return post.to_json()
+  return json.dumps(post, sort_keys=True)
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+#
+# post_index - a local SQLite index of fetched posts, with full-text search
+import hashlib
+import HTMLParser
+import re
+import sqlite3
+import threading
+import time
+
+import post_decoder
+
+# Contains the default number of results returned by a search.
+DEFAULT_SEARCH_LIMIT = 20
+
+# Contains the post fields whose text is indexed for full-text search.
+TEXT_FIELDS = ("body", "caption", "text", "source", "description", "question",
+    "answer", "summary")
+
+# Matches the HTML tags stripped from text before it is indexed.
+HTML_TAG = re.compile(r"<[^>]*>")
+
+# Contains the schema of the index, created on first use.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+  id INTEGER PRIMARY KEY,
+  blog TEXT NOT NULL,
+  type TEXT,
+  state TEXT,
+  timestamp INTEGER,
+  tags TEXT,
+  url TEXT,
+  summary TEXT,
+  digest TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_blog_timestamp ON posts (blog, timestamp);
+CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
+CREATE TABLE IF NOT EXISTS post_tags (
+  tag TEXT NOT NULL,
+  post_id INTEGER NOT NULL,
+  PRIMARY KEY (tag, post_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_text USING fts4 (title, body, tags);
+"""
+
+
+def _PlainText(html):
+  return HTMLParser.HTMLParser().unescape(HTML_TAG.sub(" ", html))
+
+
+def PostDigest(post):
+  """
+  Returns a compact digest of a post's contents, which changes whenever the
+  post is edited.
+  """
+  return hashlib.sha1(post_decoder.AsJson(post)).hexdigest()[:16]
+
+
+class PostIndex(object):
+  """
+  Indexes posts by blog, id, type, tags, state and timestamp, with a
+  full-text index over their titles, bodies, captions and tags.
+
+  Posts are added a page at a time as they are fetched; posts already
+  indexed are only rewritten if their contents have changed, so the index
+  is kept up to date incrementally rather than rebuilt.  The index may be
+  shared across threads.
+  """
+
+  def __init__(self, index_loc):
+    """
+    Opens the index, creating it if needed.
+
+    Args:
+      index_loc - location of the SQLite database file
+    """
+
+    self.index_loc = index_loc
+    self._db = sqlite3.connect(index_loc, check_same_thread=False)
+    self._db.row_factory = sqlite3.Row
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.executescript(SCHEMA)
+    self._lock = threading.Lock()
+
+  def _index_post(self, post, digest):
+    post_id = int(post["id"])
+    tags = post.get("tags") or []
+    text = " ".join(_PlainText(post[field]) for field in TEXT_FIELDS
+        if isinstance(post.get(field), basestring))
+    self._db.execute("INSERT OR REPLACE INTO posts VALUES "
+        "(?, ?, ?, ?, ?, ?, ?, ?, ?)", (post_id, post.get("blog_name", ""),
+        post.get("type"), post.get("state", "published"),
+        post.get("timestamp"), ",".join(tags), post.get("post_url"),
+        post.get("summary") or post.get("title") or "", digest))
+    self._db.execute("DELETE FROM post_tags WHERE post_id = ?", (post_id,))
+    self._db.executemany("INSERT OR IGNORE INTO post_tags VALUES (?, ?)",
+        [(tag.lower(), post_id) for tag in tags])
+    self._db.execute("DELETE FROM posts_text WHERE docid = ?", (post_id,))
+    self._db.execute("INSERT INTO posts_text (docid, title, body, tags) "
+        "VALUES (?, ?, ?, ?)", (post_id, post.get("title") or "", text,
+        " ".join(tags)))
+
+  def add_posts(self, posts):
+    """
+    Adds or updates a batch of posts, in a single transaction.
+
+    Returns:
+      the number of posts which were new or had changed
+    """
+    posts = [post for post in posts or [] if "id" in post]
+    if not posts:
+      return 0
+    changed = 0
+    with self._lock:
+      with self._db:
+        for post in posts:
+          digest = PostDigest(post)
+          known = self._db.execute("SELECT digest FROM posts WHERE id = ?",
+              (int(post["id"]),)).fetchone()
+          if known is None or known[0] != digest:
+            self._index_post(post, digest)
+            changed += 1
+    return changed
+
+  def remove_posts(self, post_ids):
+    """
+    Removes posts from the index, such as those deleted from their blog.
+    """
+    with self._lock:
+      with self._db:
+        for post_id in post_ids:
+          self._db.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+          self._db.execute("DELETE FROM post_tags WHERE post_id = ?",
+              (post_id,))
+          self._db.execute("DELETE FROM posts_text WHERE docid = ?",
+              (post_id,))
+
+  def search(self, query=None, blog=None, post_type=None, tag=None,
+      state=None, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Finds indexed posts, newest first.
+
+    Args:
+      query - full-text query in SQLite FTS syntax, if any
+      blog - name of the blog to restrict results to, if any
+      post_type - type of post to restrict results to, if any
+      tag - tag to restrict results to, if any
+      state - state of post to restrict results to, if any
+      limit - maximum number of results
+
+    Returns:
+      a list of dictionaries with the same keys as the API's posts, holding
+      id, blog_name, type, state, timestamp, date, tags, post_url and summary
+    """
+
+    sql = ["SELECT posts.* FROM posts"]
+    where = []
+    args = []
+    if query:
+      sql.append("JOIN posts_text ON posts_text.docid = posts.id")
+      where.append("posts_text MATCH ?")
+      args.append(query)
+    if tag:
+      sql.append("JOIN post_tags ON post_tags.post_id = posts.id")
+      where.append("post_tags.tag = ?")
+      args.append(tag.lower())
+    for column, value in (("blog", blog), ("type", post_type),
+        ("state", state)):
+      if value:
+        where.append("posts.%s = ?" % column)
+        args.append(value)
+    if where:
+      sql.append("WHERE " + " AND ".join(where))
+    sql.append("ORDER BY posts.timestamp DESC LIMIT ?")
+    args.append(limit)
+    with self._lock:
+      try:
+        rows = self._db.execute(" ".join(sql), args).fetchall()
+      except sqlite3.OperationalError, e:
+        # Imports the client only here, so that searching never loads it.
+        import tumblr_client
+        raise tumblr_client.TumError("Invalid search: %s" % e)
+    return [{
+      "id": row["id"],
+      "blog_name": row["blog"],
+      "type": row["type"],
+      "state": row["state"],
+      "timestamp": row["timestamp"],
+      "date": row["timestamp"] and time.strftime("%Y-%m-%d %H:%M:%S GMT",
+          time.gmtime(row["timestamp"])),
+      "tags": row["tags"] and row["tags"].split(",") or [],
+      "post_url": row["url"],
+      "summary": row["summary"],
+    } for row in rows]
+
+  def count(self):
+    with self._lock:
+      return self._db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+  def close(self):
+    with self._lock:
+      self._db.close()
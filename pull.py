@@ -0,0 +1,386 @@
+#!/usr/bin/python
+#
+# pull - downloads a blog's posts and media through a staged pipeline
+import hashlib
+import httplib
+import json
+import os
+import Queue
+import re
+import socket
+import threading
+import time
+import urllib2
+
+import pack
+import post_decoder
+import tumblr_client
+
+# Contains the default number of threads downloading media at once.
+DEFAULT_WORKERS = 4
+
+# Contains the number of items buffered between each stage of the pipeline.
+STAGE_QUEUE_DEPTH = 16
+
+# Contains the number of bytes read from a download at a time.
+BLOCK_SIZE = 64 * 1024
+
+# Contains the number of times an interrupted download is resumed in one run.
+MAX_ATTEMPTS = 3
+
+# Contains the socket timeout, in seconds, applied to media downloads.
+DOWNLOAD_TIMEOUT = 60
+
+# Contains the suffix of the file holding the validator of a partial download.
+VALIDATOR_SUFFIX = ".validator"
+
+# Matches the images embedded in the HTML of text posts and captions.
+IMG_SRC = re.compile(r"""<img[^>]+src=["'](https?://[^"']+)["']""", re.I)
+
+# Contains the post fields whose HTML may embed images.
+HTML_FIELDS = ("body", "caption", "answer", "description")
+
+
+def MediaUrls(post):
+  """
+  Returns the URLs of every piece of media in a post, without duplicates.
+  """
+  urls = []
+  for photo in post.get("photos") or []:
+    url = (photo.get("original_size") or {}).get("url")
+    if url:
+      urls.append(url)
+  for field in ("video_url", "audio_url"):
+    if post.get(field):
+      urls.append(post[field])
+  for field in HTML_FIELDS:
+    if post.get(field):
+      urls.extend(IMG_SRC.findall(post[field]))
+  seen = set()
+  return [url for url in urls if not (url in seen or seen.add(url))]
+
+
+class MediaStore(object):
+  """
+  A content-addressed store of downloaded media.
+
+  Each file is kept once, under the SHA-256 digest of its contents, and an
+  append-only index maps every URL fetched to the digest it produced, so
+  media reblogged across many posts is only downloaded once.  Partial
+  downloads are kept beside the store, along with the validator the server
+  sent for them, and resumed with a Range request conditional on that
+  validator, so that a file which has changed since is fetched afresh
+  rather than stitched onto the old part.
+  """
+
+  def __init__(self, store_loc):
+    """
+    Initializes the store, creating its directories if needed.
+
+    Args:
+      store_loc - location of the store directory
+    """
+
+    self.store_loc = store_loc
+    self.partial_loc = os.path.join(store_loc, "partial")
+    if not os.path.exists(self.partial_loc):
+      os.makedirs(self.partial_loc)
+    self.index_loc = os.path.join(store_loc, "index")
+    self.downloaded = 0
+    self.bytes = 0
+    self.reused = 0
+    self.resumed = 0
+    self._urls = {}
+    self._in_flight = {}
+    self._lock = threading.Lock()
+    if os.path.exists(self.index_loc):
+      with open(self.index_loc, "r") as index_file:
+        for line in index_file:
+          fields = line.rstrip("\n").split(" ", 1)
+          if len(fields) == 2:
+            self._urls[fields[1]] = fields[0]
+    self._index = open(self.index_loc, "a")
+
+  def path(self, digest):
+    """
+    Returns the location of a stored file, relative to the store.
+    """
+    return os.path.join(digest[:2], digest[2:])
+
+  def fetch(self, url):
+    """
+    Returns the digest of the media at a URL, downloading it unless it has
+    been fetched before.  Concurrent fetches of one URL download it once.
+    """
+    if isinstance(url, unicode):
+      url = url.encode("utf-8")
+    with self._lock:
+      digest = self._urls.get(url)
+      if digest is None:
+        event = self._in_flight.get(url)
+        if event is None:
+          event = self._in_flight[url] = threading.Event()
+          owner = True
+        else:
+          owner = False
+      else:
+        self.reused += 1
+        return digest
+    if not owner:
+      event.wait()
+      with self._lock:
+        digest = self._urls.get(url)
+        if digest is None:
+          raise tumblr_client.TumError("Download of %s failed" % url)
+        self.reused += 1
+        return digest
+    try:
+      digest = self._download(url)
+      with self._lock:
+        self._urls[url] = digest
+        self._index.write("%s %s\n" % (digest, url))
+        self._index.flush()
+      return digest
+    finally:
+      with self._lock:
+        del self._in_flight[url]
+      event.set()
+
+  def _download(self, url):
+    partial = os.path.join(self.partial_loc,
+        hashlib.sha1(url).hexdigest())
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+      try:
+        self._download_partial(url, partial)
+        break
+      except (IOError, socket.error, httplib.HTTPException), e:
+        # Gives up on 4xx responses, which trying again will not fix.
+        if (attempt == MAX_ATTEMPTS or isinstance(e, urllib2.HTTPError)
+            and e.code < 500):
+          raise tumblr_client.TumError("Download of %s failed: %s" % (url, e))
+    sha256 = hashlib.sha256()
+    with open(partial, "rb") as partial_file:
+      for block in iter(lambda: partial_file.read(BLOCK_SIZE), ""):
+        sha256.update(block)
+    digest = sha256.hexdigest()
+    stored = os.path.join(self.store_loc, self.path(digest))
+    if os.path.exists(partial + VALIDATOR_SUFFIX):
+      os.remove(partial + VALIDATOR_SUFFIX)
+    if os.path.exists(stored):
+      os.remove(partial)
+    else:
+      if not os.path.exists(os.path.dirname(stored)):
+        try:
+          os.makedirs(os.path.dirname(stored))
+        except OSError:
+          pass
+      os.rename(partial, stored)
+    with self._lock:
+      self.downloaded += 1
+    return digest
+
+  def _download_partial(self, url, partial):
+    """
+    Downloads a URL into a partial file, resuming from wherever an earlier
+    attempt left off.
+    """
+    offset = 0
+    validator = None
+    if os.path.exists(partial) and os.path.exists(partial + VALIDATOR_SUFFIX):
+      offset = os.path.getsize(partial)
+      with open(partial + VALIDATOR_SUFFIX, "r") as validator_file:
+        validator = validator_file.read()
+    request = urllib2.Request(url)
+    if offset and validator:
+      request.add_header("Range", "bytes=%d-" % offset)
+      request.add_header("If-Range", validator)
+    try:
+      response = urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+    except urllib2.HTTPError, e:
+      # The partial file already holds the whole resource.
+      if e.code == 416 and offset:
+        return
+      raise
+    try:
+      if offset and response.getcode() == 206:
+        mode = "ab"
+        with self._lock:
+          self.resumed += 1
+      else:
+        # The file changed or the server ignored the Range header, so starts
+        # over, noting what to resume this download against.
+        mode = "wb"
+        self._save_validator(partial, response)
+      expected = response.info().getheader("Content-Length")
+      received = 0
+      with open(partial, mode) as partial_file:
+        for block in iter(lambda: response.read(BLOCK_SIZE), ""):
+          partial_file.write(block)
+          received += len(block)
+          with self._lock:
+            self.bytes += len(block)
+      # Reading stops quietly when the connection drops mid-body, so checks
+      # that everything promised arrived.
+      if expected and received < int(expected):
+        raise IOError("connection closed after %d of %s bytes" % (received,
+            expected))
+    finally:
+      response.close()
+
+  def _save_validator(self, partial, response):
+    """
+    Records the strong ETag or, failing that, the Last-Modified date of a
+    download beside its partial file, or forgets any earlier one if the
+    response has neither, since the download could not then be resumed.
+    """
+    headers = response.info()
+    validator = headers.getheader("ETag")
+    if not validator or validator.startswith("W/"):
+      validator = headers.getheader("Last-Modified")
+    if validator:
+      with open(partial + VALIDATOR_SUFFIX, "w") as validator_file:
+        validator_file.write(validator)
+    elif os.path.exists(partial + VALIDATOR_SUFFIX):
+      os.remove(partial + VALIDATOR_SUFFIX)
+
+  def close(self):
+    self._index.close()
+
+
+class Puller(object):
+  """
+  Backs up a blog through a pipeline of stages joined by bounded queues:
+  pages are fetched in the background by the client, parsed for media,
+  downloaded by a pool of workers and written out one post at a time.  The
+  queues keep memory bounded however large the blog is.
+
+  Every post is written as a JSON record to a PackArchive in the destination,
+  with a "media" member mapping each of its URLs to a file in the media
+  store.
+  Posts already pulled are skipped, while posts whose media could not all be
+  downloaded are left unwritten, so that the next pull resumes them.
+  """
+
+  def __init__(self, client, dest_loc, workers=DEFAULT_WORKERS):
+    """
+    Initializes the puller.
+
+    Args:
+      client - TumblrClient to read posts with
+      dest_loc - location of the directory to back the blog up into
+      workers - number of threads downloading media at once
+    """
+
+    self.client = client
+    self.archive = pack.PackArchive(dest_loc)
+    self.store = MediaStore(os.path.join(dest_loc, "media"))
+    self.workers = max(1, workers)
+    self.pulled = 0
+    self.skipped = 0
+    self.failed = 0
+    self.elapsed = 0.0
+
+  def _parse(self, posts, downloads, errors, skip_existing):
+    try:
+      for post in posts:
+        if skip_existing and post["id"] in self.archive:
+          self.skipped += 1
+          continue
+        downloads.put((post, MediaUrls(post)))
+    except Exception, e:
+      errors.append(e)
+    finally:
+      for i in range(self.workers):
+        downloads.put(None)
+
+  def _download(self, downloads, writes):
+    while True:
+      job = downloads.get()
+      if job is None:
+        writes.put(None)
+        return
+      post, urls = job
+      media = {}
+      failures = []
+      for url in urls:
+        try:
+          media[url] = "media/%s" % self.store.path(self.store.fetch(url))
+        except (tumblr_client.TumError, EnvironmentError), e:
+          media[url] = None
+          failures.append(e)
+      writes.put((post, media, failures))
+
+  def _write(self, writes, callback):
+    finished = 0
+    while finished < self.workers:
+      # Waits with a timeout, since an untimed wait cannot be interrupted.
+      try:
+        job = writes.get(timeout=1)
+      except Queue.Empty:
+        continue
+      if job is None:
+        finished += 1
+        continue
+      post, media, failures = job
+      if failures:
+        self.failed += 1
+      else:
+        self.archive.put(post["id"], json.dumps({
+            "post": post_decoder.AsDict(post), "media": media}))
+        self.pulled += 1
+      if callback:
+        callback(post, media, failures)
+
+  def run(self, blog, callback=None, **params):
+    """
+    Pulls every post on a blog, returning once all of them are written.
+
+    Args:
+      blog - string containing the name of the blog to pull
+      callback - optional callable invoked with each post handled, its
+          media mapping and a list of errors from failed downloads
+      params - retrieval parameters, such as post_type or tag
+
+    Returns:
+      the number of posts whose media could not all be downloaded
+    """
+    return self.process(self.client.iter_posts(blog, **params), callback)
+
+  def process(self, posts, callback=None, skip_existing=True):
+    """
+    Runs posts from any source through the parse, download and write stages.
+
+    Args:
+      posts - iterable of posts, as returned by the API
+      callback - optional callable invoked as for run
+      skip_existing - whether posts already in the archive are skipped,
+          rather than written again
+
+    Returns:
+      the number of posts whose media could not all be downloaded
+    """
+
+    start = time.time()
+    downloads = Queue.Queue(STAGE_QUEUE_DEPTH)
+    writes = Queue.Queue(STAGE_QUEUE_DEPTH)
+    errors = []
+    threads = [threading.Thread(target=self._parse,
+        args=(posts, downloads, errors, skip_existing))]
+    for i in range(self.workers):
+      threads.append(threading.Thread(target=self._download,
+          args=(downloads, writes)))
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    self._write(writes, callback)
+    self.elapsed += time.time() - start
+    if errors:
+      raise errors[0]
+    return self.failed
+
+  def close(self):
+    """
+    Flushes the archive and closes the puller's files.
+    """
+    self.store.close()
+    self.archive.close()
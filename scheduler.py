@@ -0,0 +1,342 @@
+#!/usr/bin/python
+#
+# scheduler - paces Tumblr API requests to stay just under its rate limits
+import httplib
+import random
+import re
+import socket
+import threading
+import time
+
+import connection_pool
+import timings
+
+# Contains the default number of requests allowed in flight at once, along
+# with the bounds the adaptive limit moves between.
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 32
+
+# Contains the latency, in seconds, above which concurrency is backed off.
+DEFAULT_LATENCY_TARGET = 2.0
+
+# Contains the default number of times a throttled or failed request is
+# retried, and the base and cap of the exponential backoff between tries.
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_CAP = 60.0
+
+# Contains the slowest rate, in requests per second, a bucket is throttled to.
+MIN_RATE = 0.001
+
+# Contains the number of successful requests over which a throttled bucket
+# climbs back to its full rate, a fixed share of it for each one.
+RECOVERY_STEPS = 10
+
+# Matches the rate limit headers sent by the API, such as
+# X-Ratelimit-Perhour-Remaining and X-Ratelimit-Perday-Reset.
+RATE_LIMIT_HEADER = re.compile(r"^x-ratelimit-(\w+)-(limit|remaining|reset)$")
+
+
+class TokenBucket(object):
+  """
+  A thread-safe token bucket, refilled continuously at a given rate.
+  """
+
+  def __init__(self, rate, capacity=None):
+    """
+    Initializes the bucket.
+
+    Args:
+      rate - tokens added per second
+      capacity - maximum number of tokens held, defaulting to one second's
+          worth of tokens
+    """
+
+    self.rate = float(rate)
+    self.full_rate = self.rate
+    self.capacity = capacity or max(1.0, self.rate)
+    self.tokens = self.capacity
+    self._updated = time.time()
+    self._throttled = 0.0
+    self._lock = threading.Lock()
+
+  def _refill(self, now):
+    self.tokens = min(self.capacity,
+        self.tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  def acquire(self):
+    """
+    Takes a token from the bucket, sleeping until one is available.
+    """
+    while True:
+      with self._lock:
+        self._refill(time.time())
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+  def update(self, remaining, reset):
+    """
+    Re-paces the bucket so that the remaining allowance is spread evenly
+    over the time left until the server resets it.
+
+    Args:
+      remaining - number of requests the server will still accept
+      reset - seconds until the server's allowance is reset
+    """
+
+    reset = max(1.0, float(reset))
+    with self._lock:
+      self._refill(time.time())
+      self.rate = max(remaining, 1) / reset
+      self.full_rate = self.rate
+      self.capacity = max(1.0, min(self.rate, remaining))
+      self.tokens = min(self.tokens, remaining)
+
+  def throttle(self):
+    """
+    Halves the rate of the bucket, after the server refused a request.
+    """
+    now = time.time()
+    with self._lock:
+      self._refill(now)
+      # Halves at most once per token at the current rate, so that refusals
+      # of requests sent together, before the last halving, count only once.
+      if now - self._throttled >= 1 / self.rate:
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self._throttled = now
+      self.tokens = 0
+
+  def recover(self):
+    """
+    Raises the rate of a throttled bucket by a share of its full rate, after
+    the server accepted a request, returning whether it is back to full.
+    """
+    with self._lock:
+      self._refill(time.time())
+      self.rate = min(self.full_rate,
+          self.rate + self.full_rate / RECOVERY_STEPS)
+      return self.rate >= self.full_rate
+
+
+class AdaptiveLimiter(object):
+  """
+  Bounds the number of requests in flight, adjusting the bound by additive
+  increase and multiplicative decrease: each success grows the limit by one
+  per limit's worth of requests, while throttling or slow responses halve it.
+  """
+
+  def __init__(self, initial=DEFAULT_CONCURRENCY,
+      minimum=DEFAULT_MIN_CONCURRENCY, maximum=DEFAULT_MAX_CONCURRENCY,
+      latency_target=DEFAULT_LATENCY_TARGET):
+    self.limit = float(initial)
+    self.minimum = minimum
+    self.maximum = maximum
+    self.latency_target = latency_target
+    self.in_flight = 0
+    self._last_decrease = 0.0
+    self._cond = threading.Condition()
+
+  def acquire(self):
+    with self._cond:
+      while self.in_flight >= int(self.limit):
+        self._cond.wait()
+      self.in_flight += 1
+
+  def release(self, latency, congested):
+    """
+    Returns a slot to the limiter, adjusting the limit.
+
+    Args:
+      latency - seconds the request took
+      congested - whether the request was throttled or failed on the server
+    """
+
+    now = time.time()
+    with self._cond:
+      self.in_flight -= 1
+      if congested or latency > self.latency_target:
+        # Decreases at most once per target latency, so that a burst of
+        # failures from requests sent together counts only once.
+        if now - self._last_decrease > self.latency_target:
+          self.limit = max(self.minimum, self.limit / 2)
+          self._last_decrease = now
+      else:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+      self._cond.notify_all()
+
+
+def _RateLimitWindows(headers):
+  """
+  Returns a list of (remaining, reset) tuples, one per rate limit window
+  advertised in a response's headers.
+  """
+  windows = {}
+  for name, value in headers.items():
+    match = RATE_LIMIT_HEADER.match(name.lower())
+    if match:
+      try:
+        windows.setdefault(match.group(1), {})[match.group(2)] = int(value)
+      except ValueError:
+        pass
+  return [(w["remaining"], w["reset"]) for w in windows.values()
+      if "remaining" in w and "reset" in w]
+
+
+class RequestScheduler(object):
+  """
+  Runs API requests under a per-account token bucket, optional per-blog
+  token buckets and an adaptive concurrency limit, retrying throttled and
+  failed requests with jittered exponential backoff.
+
+  The account bucket is paced from the rate limit headers of each response,
+  so that sustained throughput sits just under the API's limits.
+  """
+
+  def __init__(self, account_rate=None, blog_rate=None,
+      concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+      backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP):
+    """
+    Initializes the scheduler.
+
+    Args:
+      account_rate - initial requests per second allowed for the account,
+          or None to wait for the server's rate limit headers
+      blog_rate - requests per second allowed to each blog, if limited
+      concurrency - initial number of requests allowed in flight
+      max_retries - number of times a throttled or failed request is retried
+      backoff_base - seconds waited before the first retry
+      backoff_cap - most seconds waited before any retry
+    """
+
+    self.account_bucket = account_rate and TokenBucket(account_rate)
+    self.blog_rate = blog_rate
+    self.limiter = AdaptiveLimiter(concurrency)
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_cap = backoff_cap
+    self.retries = 0
+    self.throttled = 0
+    self._blog_buckets = {}
+    self._lock = threading.Lock()
+
+  def _blog_bucket(self, blog):
+    if blog is None:
+      return None
+    with self._lock:
+      bucket = self._blog_buckets.get(blog)
+      if bucket is None and self.blog_rate:
+        bucket = self._blog_buckets[blog] = TokenBucket(self.blog_rate)
+      return bucket
+
+  def _observe(self, blog, headers, status):
+    windows = _RateLimitWindows(headers)
+    if windows:
+      # Paces the account by its tightest window.
+      remaining, reset = min(windows,
+          key=lambda w: float(w[0]) / max(w[1], 1))
+      with self._lock:
+        if self.account_bucket is None:
+          self.account_bucket = TokenBucket(max(remaining, 1) / max(reset, 1.0))
+      self.account_bucket.update(remaining, reset)
+    if status == 429:
+      with self._lock:
+        self.throttled += 1
+        if blog is not None and blog not in self._blog_buckets:
+          # Starts pacing a blog once it has been throttled, at a rate the
+          # account bucket would allow.
+          rate = self.blog_rate or (self.account_bucket and
+              self.account_bucket.rate) or 1.0
+          self._blog_buckets[blog] = TokenBucket(rate)
+      bucket = self._blog_bucket(blog)
+      if bucket:
+        bucket.throttle()
+    elif status < 400:
+      bucket = self._blog_bucket(blog)
+      if bucket and bucket.rate < bucket.full_rate and bucket.recover() and \
+          not self.blog_rate:
+        # Stops pacing a blog which was only paced after being throttled,
+        # once it is back to full rate.
+        with self._lock:
+          self._blog_buckets.pop(blog, None)
+
+  def _backoff(self, attempt, headers):
+    delay = random.uniform(0, min(self.backoff_cap,
+        self.backoff_base * 2 ** attempt))
+    try:
+      delay = max(delay, float(headers.get("retry-after", 0)))
+    except ValueError:
+      pass
+    return delay
+
+  def run(self, blog, send, parse, idempotent=True):
+    """
+    Sends a request under the scheduler's limits, retrying as needed.
+
+    A request which is not idempotent, such as one creating a post, is only
+    retried when the server refused it as throttled or when it failed before
+    any of it was sent, since otherwise the server may have acted on it.
+
+    Args:
+      blog - name of the blog the request concerns, or None
+      send - callable which signs and sends the request, returning an
+          httplib2.Response and the response body; it is called once per try
+      parse - callable which takes the response and body and returns the
+          request's result, raising an error for failed requests
+      idempotent - whether the request may safely be sent more than once
+
+    Returns:
+      whatever parse returns for the final try
+    """
+
+    attempt = 0
+    while True:
+      with timings.Phase("throttle"):
+        if self.account_bucket:
+          self.account_bucket.acquire()
+        bucket = self._blog_bucket(blog)
+        if bucket:
+          bucket.acquire()
+        self.limiter.acquire()
+      start = time.time()
+      try:
+        resp, content = send()
+      except (socket.error, httplib.HTTPException), e:
+        self.limiter.release(time.time() - start, True)
+        if attempt >= self.max_retries or not (idempotent or
+            isinstance(e, connection_pool.NotSentError)):
+          raise
+        resp, content = {}, None
+      except:
+        # Hands the slot back whatever went wrong, such as media which could
+        # not be opened, so that later requests are not left waiting on it.
+        self.limiter.release(time.time() - start, False)
+        raise
+      else:
+        status = int(resp.get("status", 0))
+        retryable = status == 429 or (status >= 500 and idempotent)
+        self.limiter.release(time.time() - start, retryable)
+        self._observe(blog, resp, status)
+        if not retryable or attempt >= self.max_retries:
+          return parse(resp, content)
+      with timings.Phase("backoff"):
+        time.sleep(self._backoff(attempt, resp))
+      attempt += 1
+      with self._lock:
+        self.retries += 1
+
+  def stats(self):
+    """
+    Returns a dictionary describing the scheduler's current state.
+    """
+    return {
+      "concurrency_limit": self.limiter.limit,
+      "in_flight": self.limiter.in_flight,
+      "account_rate": self.account_bucket and self.account_bucket.rate,
+      "retries": self.retries,
+      "throttled": self.throttled,
+    }
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+#
+# spool - a durable on-disk queue of posts waiting to be sent to Tumblr
+import binascii
+import errno
+import fcntl
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+
+import multipart
+import tumblr_client
+
+# Contains the names of the files kept within a spool directory.
+QUEUE_FILE = "queue.jsonl"
+JOURNAL_FILE = "journal"
+LOCK_FILE = "lock"
+FLUSH_LOCK_FILE = "flush.lock"
+
+
+def _Fsync(path):
+  """
+  Flushes a file or directory's metadata to disk.
+  """
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+
+def _Decode(value):
+  if isinstance(value, unicode):
+    return value.encode("utf-8")
+  return value
+
+
+class Spool(object):
+  """
+  An append-only queue of posts, kept as JSON lines, alongside a checkpoint
+  journal naming every queued post which the API has accepted.
+
+  Both files are fsynced on each write, so a post is either wholly queued or
+  not at all, and a post recorded in the journal is never sent again, even if
+  tum was killed partway through a flush.  Accepted posts are only removed
+  from the queue when it is compacted at the end of a flush.
+  """
+
+  def __init__(self, spool_loc):
+    """
+    Initializes the spool, creating its directory if needed.
+
+    Args:
+      spool_loc - location of the spool directory
+    """
+
+    self.spool_loc = spool_loc
+    if not os.path.exists(spool_loc):
+      os.makedirs(spool_loc, 0700)
+    self.queue_loc = os.path.join(spool_loc, QUEUE_FILE)
+    self.journal_loc = os.path.join(spool_loc, JOURNAL_FILE)
+    self._journal = None
+    self._journal_lock = threading.Lock()
+
+  @contextmanager
+  def _locked(self, name=LOCK_FILE, blocking=True):
+    with open(os.path.join(self.spool_loc, name), "a") as lock_file:
+      flags = fcntl.LOCK_EX
+      if not blocking:
+        flags |= fcntl.LOCK_NB
+      try:
+        fcntl.flock(lock_file, flags)
+      except IOError, e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+          raise tumblr_client.TumError(
+              "Another flush of %s is already running" % self.spool_loc)
+        raise
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def _append(self, path, data):
+    # Expects the lock to be held.  Starts a fresh line if a crash left a
+    # partial one behind, so that only the torn record is lost.
+    created = not os.path.exists(path)
+    with open(path, "ab+") as spool_file:
+      spool_file.seek(0, os.SEEK_END)
+      if spool_file.tell():
+        spool_file.seek(-1, os.SEEK_END)
+        if spool_file.read(1) != "\n":
+          data = "\n" + data
+        spool_file.seek(0, os.SEEK_END)
+      spool_file.write(data)
+      spool_file.flush()
+      os.fsync(spool_file.fileno())
+    if created:
+      _Fsync(self.spool_loc)
+
+  def append(self, blog, params, files=None):
+    """
+    Durably adds a post to the end of the queue.
+
+    Args:
+      blog - name of the blog to post to
+      params - dictionary containing the post's parameters
+      files - list of (name, location) tuples of media to stream, if any
+
+    Returns:
+      string containing the ID of the queued post
+    """
+
+    post_id = binascii.hexlify(os.urandom(12))
+    if files:
+      files = [(name, location if multipart.IsUrl(location)
+          else os.path.abspath(location)) for name, location in files]
+    try:
+      record = json.dumps({"id": post_id, "blog": blog, "params": params,
+          "files": files}, separators=(",", ":"))
+    except UnicodeDecodeError:
+      raise tumblr_client.TumError("Only UTF-8 text posts can be spooled")
+    with self._locked():
+      self._append(self.queue_loc, record + "\n")
+    return post_id
+
+  def _read_records(self, limit=None):
+    """
+    Yields every well-formed record in the queue, stopping at the given
+    offset.
+    """
+    if not os.path.exists(self.queue_loc):
+      return
+    with open(self.queue_loc, "rb") as queue_file:
+      while limit is None or queue_file.tell() < limit:
+        line = queue_file.readline()
+        if not line:
+          return
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # Skips records torn by a crash while they were being written.
+          continue
+        yield record
+
+  def _accepted(self):
+    if not os.path.exists(self.journal_loc):
+      return set()
+    with open(self.journal_loc, "rb") as journal_file:
+      return set(line.strip() for line in journal_file if line.endswith("\n"))
+
+  def pending(self):
+    """
+    Lazily reads the posts queued when it is called which the API has not yet
+    accepted.
+
+    Yields:
+      (id, blog, params, files) tuples
+    """
+    with self._locked():
+      accepted = self._accepted()
+      limit = 0
+      if os.path.exists(self.queue_loc):
+        limit = os.path.getsize(self.queue_loc)
+    for record in self._read_records(limit):
+      if record["id"] in accepted:
+        continue
+      params = dict((_Decode(key), _Decode(value))
+          for key, value in record["params"].iteritems())
+      files = record.get("files")
+      if files:
+        files = [(_Decode(name), _Decode(location))
+            for name, location in files]
+      yield (_Decode(record["id"]), _Decode(record["blog"]), params, files)
+
+  def mark_accepted(self, post_id):
+    """
+    Records in the journal that the API has accepted a queued post.  Safe to
+    call from several threads at once.
+    """
+    with self._journal_lock:
+      if self._journal is None:
+        created = not os.path.exists(self.journal_loc)
+        self._journal = open(self.journal_loc, "ab")
+        if created:
+          _Fsync(self.spool_loc)
+      self._journal.write(post_id + "\n")
+      self._journal.flush()
+      os.fsync(self._journal.fileno())
+
+  def compact(self):
+    """
+    Rewrites the queue without the posts the API has accepted, then empties
+    the journal.  A crash at any point leaves a queue and journal which
+    together still describe every unsent post exactly once.
+
+    Returns:
+      the number of posts left in the queue
+    """
+
+    with self._journal_lock:
+      if self._journal is not None:
+        self._journal.close()
+        self._journal = None
+    with self._locked():
+      accepted = self._accepted()
+      remaining = 0
+      temp_loc = self.queue_loc + ".tmp"
+      with open(temp_loc, "wb") as temp_file:
+        for record in self._read_records():
+          if record["id"] not in accepted:
+            temp_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            remaining += 1
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+      os.rename(temp_loc, self.queue_loc)
+      _Fsync(self.spool_loc)
+      # Only forgets accepted posts once the new queue is safely in place.
+      with open(self.journal_loc, "wb") as journal_file:
+        os.fsync(journal_file.fileno())
+    return remaining
+
+  @contextmanager
+  def flushing(self):
+    """
+    Guards a flush of the spool, so that only one runs at a time.
+    """
+    with self._locked(FLUSH_LOCK_FILE, blocking=False):
+      try:
+        yield self
+      finally:
+        self.compact()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+#
+# test_async_client - tests for the event loop based client
+import BaseHTTPServer
+import os
+import SocketServer
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import async_client
+
+asyncio = async_client.asyncio
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Answers requests to /ok, hangs up on requests to /drop once they have been
+  read in full, answers requests to /bad with a malformed status line and
+  answers requests to /eof with a body ended by closing the connection.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def _handle(self):
+    length = int(self.headers.get("Content-Length") or 0)
+    self.rfile.read(length)
+    self.server.seen.append((self.command, self.path))
+    if self.path == "/drop":
+      self.close_connection = 1
+      return
+    if self.path == "/bad":
+      self.wfile.write("garbage\r\n\r\n")
+      return
+    if self.path == "/eof":
+      self.close_connection = 1
+      self.wfile.write("HTTP/1.1 200 OK\r\n\r\nok")
+      return
+    self.send_response(200)
+    self.send_header("Content-Length", "2")
+    self.end_headers()
+    self.wfile.write("ok")
+
+  do_GET = _handle
+  do_POST = _handle
+
+  def log_message(self, *args):
+    pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+@unittest.skipIf(asyncio is None, "trollius is not installed")
+class AsyncTumblrClientTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = _Server(("127.0.0.1", 0), _Handler)
+    self.server.seen = []
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.port = self.server.server_address[1]
+    self.loop = asyncio.new_event_loop()
+    self.client = async_client.AsyncTumblrClient("key", "token", "secret",
+        "127.0.0.1:%d" % self.port, loop=self.loop)
+    self.closed = []
+
+  def tearDown(self):
+    for idle in self.client._idle.values():
+      for reader, writer in idle:
+        writer.close()
+    self.loop.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _exchange(self, method, path):
+    return self.loop.run_until_complete(self.client._exchange(method,
+        "127.0.0.1", self.port, path, method == "POST" and "a=1" or ""))
+
+  def _count_closes(self):
+    """
+    Counts the connections closed from here on, by the idle connection
+    they were taken from.
+    """
+    for idle in self.client._idle.values():
+      for reader, writer in idle:
+        close = writer.close
+        def counted_close(close=close):
+          self.closed.append(1)
+          close()
+        writer.close = counted_close
+
+  def test_post_is_not_repeated_once_sent(self):
+    self._exchange("POST", "/ok")
+    self.assertRaises(EOFError, self._exchange, "POST", "/drop")
+    self.assertEqual(self.server.seen.count(("POST", "/drop")), 1)
+
+  def test_get_is_repeated_on_reused_connection(self):
+    self._exchange("GET", "/ok")
+    self.assertRaises(EOFError, self._exchange, "GET", "/drop")
+    self.assertEqual(self.server.seen.count(("GET", "/drop")), 2)
+
+  def test_connection_is_closed_on_unexpected_error(self):
+    self._exchange("GET", "/ok")
+    self._count_closes()
+    self.assertRaises(IndexError, self._exchange, "GET", "/bad")
+    self.assertEqual(self.closed, [1])
+    self.assertFalse(any(self.client._idle.values()))
+
+  def test_body_read_to_eof_is_not_kept_alive(self):
+    self._exchange("GET", "/ok")
+    self.assertTrue(any(self.client._idle.values()))
+    status, headers, content = self._exchange("GET", "/eof")
+    self.assertEqual((status, content), ("200", "ok"))
+    self.assertFalse(any(self.client._idle.values()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# test_batch - tests for posting batches through worker threads
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import batch
+import tumblr_client
+
+
+class _Client(object):
+  """
+  Stands in for TumblrClient, recording what it is asked to sign and post.
+  """
+
+  def __init__(self, calls):
+    self.calls = calls
+
+  def sign_posts(self, posts):
+    self.calls.append(("sign", [blog for blog, params in posts]))
+    return ["signed for %s" % blog for blog, params in posts]
+
+  def create_post(self, blog, params, files=None, signed=None):
+    self.calls.append(("post", blog, signed))
+
+
+class BatchPosterTest(unittest.TestCase):
+
+  def test_posts_are_signed_together(self):
+    calls = []
+    poster = batch.BatchPoster(lambda: _Client(calls), 2)
+    items = [(1, "a", {}), (2, "b", tumblr_client.TumError("bad")),
+        (3, "c", {}, [("data", "photo.png")])]
+    self.assertEqual(poster.run(items), 1)
+    signs = [call for call in calls if call[0] == "sign"]
+    self.assertEqual(signs, [("sign", ["a"]), ("sign", ["c"])])
+    self.assertEqual(sorted(call for call in calls if call[0] == "post"),
+        [("post", "a", "signed for a"), ("post", "c", "signed for c")])
+
+  def test_acceptance_is_reported_by_the_worker(self):
+    accepted = []
+    poster = batch.BatchPoster(lambda: _Client([]), 2)
+    items = [(1, "a", {}), (2, "b", tumblr_client.TumError("bad")),
+        (3, "c", {})]
+    poster.run(items, accepted=lambda index: accepted.append(
+        (index, threading.current_thread().name)))
+    self.assertEqual(sorted(index for index, thread in accepted), [1, 3])
+    main_thread = threading.current_thread().name
+    self.assertNotIn(main_thread, [thread for index, thread in accepted])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# test_connection_pool - tests for the keep-alive connection pool
+import BaseHTTPServer
+import httplib
+import os
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import connection_pool
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Answers requests to /ok, and hangs up on requests to /drop once they have
+  been read in full, as a server which failed after acting on them would.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def _handle(self):
+    length = int(self.headers.get("Content-Length") or 0)
+    self.rfile.read(length)
+    self.server.seen.append((self.command, self.path))
+    if self.path == "/drop":
+      self.close_connection = 1
+      return
+    self.send_response(200)
+    self.send_header("Content-Length", "2")
+    self.end_headers()
+    self.wfile.write("ok")
+
+  do_GET = _handle
+  do_POST = _handle
+
+  def log_message(self, *args):
+    pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = _Server(("127.0.0.1", 0), _Handler)
+    self.server.seen = []
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.port = self.server.server_address[1]
+    self.pool = connection_pool.ConnectionPool()
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _request(self, method, path):
+    return self.pool.request("http", "127.0.0.1", self.port, path,
+        method=method, body=method == "POST" and "a=1" or None)
+
+  def test_post_is_not_repeated_once_sent(self):
+    self._request("POST", "/ok")
+    self.assertRaises((socket.error, httplib.HTTPException), self._request,
+        "POST", "/drop")
+    self.assertEqual(self.server.seen.count(("POST", "/drop")), 1)
+
+  def test_get_is_repeated_on_reused_connection(self):
+    self._request("GET", "/ok")
+    self.assertRaises((socket.error, httplib.HTTPException), self._request,
+        "GET", "/drop")
+    self.assertEqual(self.server.seen.count(("GET", "/drop")), 2)
+
+  def test_connection_dropped_while_idle_is_replaced(self):
+    self._request("GET", "/ok")
+    # Gets the server to hang up every idle connection, as its idle timeout
+    # would, by ending our side of them.
+    for conns in self.pool._idle.values():
+      for last_used, conn in conns:
+        conn.sock.shutdown(socket.SHUT_WR)
+    time.sleep(0.1)
+    response, content = self._request("POST", "/ok")
+    self.assertEqual(content, "ok")
+    self.assertEqual(self.server.seen.count(("POST", "/ok")), 1)
+
+  def test_failed_connect_is_not_sent(self):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    self.assertRaises(connection_pool.NotSentError, self.pool.request,
+        "http", "127.0.0.1", port, "/ok", method="POST", body="a=1")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# test_mirror - tests for keeping a pulled blog up to date
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import mirror
+import pull
+
+
+class _Client(object):
+  """
+  Stands in for TumblrClient, serving a fixed list of text posts.
+  """
+
+  index = None
+
+  def __init__(self, posts):
+    self.posts_list = posts
+
+  def posts(self, blog, offset=0, limit=20):
+    return {"posts": self.posts_list[offset:offset + limit]}
+
+
+def _Posts(count):
+  return [{"id": post_id, "type": "text", "body": "post %d" % post_id,
+      "timestamp": post_id} for post_id in range(count, 0, -1)]
+
+
+class MirrorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dest_loc = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dest_loc)
+
+  def _pull(self, posts):
+    puller = pull.Puller(_Client(posts), self.dest_loc, 1)
+    puller.process(posts)
+    puller.close()
+
+  def _sync(self, posts):
+    blog_mirror = mirror.Mirror(_Client(posts), self.dest_loc, 1)
+    blog_mirror.sync("blog")
+    blog_mirror.close()
+    return blog_mirror
+
+  def test_first_sync_after_pull_keeps_archived_posts(self):
+    posts = _Posts(45)
+    self._pull(posts[1:])
+    posts[10] = dict(posts[10], body="edited")
+    blog_mirror = self._sync(posts)
+    self.assertEqual([post["id"] for post in blog_mirror.new], [45])
+    self.assertEqual([post["id"] for post in blog_mirror.edited], [35])
+    blog_mirror = self._sync(posts)
+    self.assertEqual((blog_mirror.new, blog_mirror.edited), ([], []))
+    self.assertEqual(blog_mirror.requests, 1)
+
+  def test_first_sync_without_archive_pulls_everything(self):
+    blog_mirror = self._sync(_Posts(5))
+    self.assertEqual(len(blog_mirror.new), 5)
+    self.assertEqual(blog_mirror.edited, [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+#
+# test_oauth2 - tests for the vendored OAuth library's signing
+import binascii
+import hashlib
+import hmac
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import urllib
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import oauth2
+
+# Contains the number of random requests each differential test signs.
+RANDOM_REQUESTS = 2000
+
+# Contains the pieces random parameter keys and values are built from,
+# covering characters which are and are not percent-encoded, as both str and
+# unicode.
+PIECES = ["a", "Z", "0", "-", ".", "_", "~", " ", "+", "%", "&", "=", "*",
+    "/", "?", "#", "\xc3\xa9", u"\xe9", u"\u2603", u"\U0001f600", "oauth_"]
+
+# Contains the pieces used in URLs: ASCII alone, since neither implementation
+# decodes anything else there once the URL has been made unicode, and no "%",
+# since query parameters are unquoted twice.
+URL_PIECES = [piece for piece in PIECES
+    if isinstance(piece, str) and piece < "\x80" and piece != "%"]
+
+
+def _ReferenceNormalizedParameters(request):
+  """
+  Normalizes a request's parameters as oauth2 did before it was done in a
+  single pass, through urlencode and string replacement.
+  """
+  items = []
+  for key, value in request.iteritems():
+    if key == "oauth_signature":
+      continue
+    if isinstance(value, basestring):
+      items.append((oauth2.to_utf8_if_string(key), oauth2.to_utf8(value)))
+    else:
+      try:
+        value = list(value)
+      except TypeError:
+        items.append((oauth2.to_utf8_if_string(key),
+            oauth2.to_utf8_if_string(value)))
+      else:
+        items.extend((oauth2.to_utf8_if_string(key),
+            oauth2.to_utf8_if_string(item)) for item in value)
+  query = urlparse.urlparse(request.url)[4]
+  url_items = oauth2.Request._split_url_string(query).items()
+  items.extend((oauth2.to_utf8(k), oauth2.to_utf8(v))
+      for k, v in url_items if k != "oauth_signature")
+  items.sort()
+  return urllib.urlencode(items).replace("+", "%20").replace("%7E", "~")
+
+
+def _ReferenceSignature(request, consumer, token):
+  """
+  Signs a request with HMAC-SHA1 from a freshly built signature base string.
+  """
+  raw = "&".join((oauth2.escape(request.method),
+      oauth2.escape(request.normalized_url),
+      oauth2.escape(_ReferenceNormalizedParameters(request))))
+  key = "%s&" % oauth2.escape(consumer.secret)
+  if token:
+    key += oauth2.escape(token.secret)
+  return raw, binascii.b2a_base64(hmac.new(key, raw,
+      hashlib.sha1).digest())[:-1]
+
+
+def _RandomText(rng, pieces=PIECES):
+  text = "".join(oauth2.to_utf8(rng.choice(pieces))
+      for i in range(rng.randint(0, 6)))
+  if rng.random() < 0.5:
+    return text.decode("utf-8")
+  return text
+
+
+def _RandomValue(rng):
+  kind = rng.random()
+  if kind < 0.1:
+    return rng.randint(-1000, 1000)
+  if kind < 0.2:
+    return [_RandomText(rng) for i in range(rng.randint(1, 3))]
+  return _RandomText(rng)
+
+
+def _RandomRequest(rng):
+  parameters = dict((_RandomText(rng) or "k", _RandomValue(rng))
+      for i in range(rng.randint(0, 8)))
+  parameters["oauth_signature"] = "ignored"
+  url = "http://api.tumblr.com/v2/blog/%s/post" % rng.choice(["a", "b"])
+  if rng.random() < 0.3:
+    url += "?" + urllib.urlencode([
+        (str(_RandomText(rng, URL_PIECES)) or "q",
+         str(_RandomText(rng, URL_PIECES)))
+        for i in range(rng.randint(1, 3))])
+  return oauth2.Request(rng.choice(["GET", "POST"]), url, parameters)
+
+
+class NormalizationTest(unittest.TestCase):
+  """
+  Checks the single-pass normalization against the implementation it
+  replaced, byte for byte.
+  """
+
+  def setUp(self):
+    self.rng = random.Random(7)
+
+  def test_encode_matches_quote(self):
+    for i in range(256):
+      self.assertEqual(oauth2._encode(chr(i), oauth2._ESCAPE_TABLE),
+          urllib.quote(chr(i), safe="~"))
+      self.assertEqual(oauth2._encode(chr(i), oauth2._ESCAPE_TWICE_TABLE),
+          urllib.quote(urllib.quote(chr(i), safe="~"), safe="~"))
+    self.assertEqual(oauth2._encode(-12, oauth2._ESCAPE_TABLE), "-12")
+
+  def test_normalized_parameters_match_reference(self):
+    for i in range(RANDOM_REQUESTS):
+      request = _RandomRequest(self.rng)
+      expected = _ReferenceNormalizedParameters(request)
+      self.assertEqual(request.get_normalized_parameters(), expected)
+      self.assertEqual(request.get_normalized_parameters(escaped=True),
+          oauth2.escape(expected))
+
+  def test_signature_items_skip_signature(self):
+    request = oauth2.Request("GET",
+        "http://api.tumblr.com/v2/user/info?oauth_signature=x&b=2",
+        {"oauth_signature": "y", u"a": [u"\xe9", "1"], "c": 3})
+    self.assertEqual(request._signature_items(),
+        [("a", "1"), ("a", "\xc3\xa9"), ("b", "2"), ("c", 3)])
+
+  def test_signatures_match_reference(self):
+    method = oauth2.SignatureMethod_HMAC_SHA1()
+    consumer = oauth2.Consumer("key", "consumer secret")
+    token = oauth2.Token("token", "token~secret")
+    for i in range(RANDOM_REQUESTS):
+      request = _RandomRequest(self.rng)
+      request_token = self.rng.choice([token, None])
+      raw, signature = _ReferenceSignature(request, consumer, request_token)
+      self.assertEqual(method.signing_base(request, consumer,
+          request_token)[1], raw)
+      self.assertEqual(method.sign(request, consumer, request_token),
+          signature)
+
+
+class _SuffixedSignatureMethod(oauth2.SignatureMethod_HMAC_SHA1):
+
+  def signing_base(self, request, consumer, token):
+    key, raw = oauth2.SignatureMethod_HMAC_SHA1.signing_base(self, request,
+        consumer, token)
+    return key + "pepper", raw + "&suffix"
+
+
+class SignatureMethodTest(unittest.TestCase):
+
+  def test_sign_uses_overridden_signing_base(self):
+    consumer = oauth2.Consumer("key", "secret")
+    request = oauth2.Request("GET", "http://api.tumblr.com/v2/user/info",
+        {"a": "1"})
+    method = _SuffixedSignatureMethod()
+    key, raw = method.signing_base(request, consumer, None)
+    expected = binascii.b2a_base64(hmac.new(key, raw,
+        hashlib.sha1).digest())[:-1]
+    self.assertEqual(method.sign(request, consumer, None), expected)
+    self.assertNotEqual(expected, oauth2.SignatureMethod_HMAC_SHA1().sign(
+        request, consumer, None))
+    self.assertTrue(method.check(request, consumer, None, expected))
+
+
+  def test_subclass_without_init_call_signs(self):
+    class Method(oauth2.SignatureMethod_HMAC_SHA1):
+      def __init__(self):
+        self.created = True
+    consumer = oauth2.Consumer("key", "secret")
+    request = oauth2.Request("GET", "http://api.tumblr.com/v2/user/info",
+        {"a": "1"})
+    self.assertEqual(Method().sign(request, consumer, None),
+        oauth2.SignatureMethod_HMAC_SHA1().sign(request, consumer, None))
+
+  def test_sign_many_matches_sign_request(self):
+    consumer = oauth2.Consumer("key", "secret")
+    token = oauth2.Token("token", "token secret")
+    for method in (oauth2.SignatureMethod_HMAC_SHA1(),
+        _SuffixedSignatureMethod(), oauth2.SignatureMethod_PLAINTEXT()):
+      requests = []
+      expected = []
+      for blog in ("a", "b", "a"):
+        params = {"oauth_timestamp": "1300000000", "oauth_nonce": blog,
+            "body": "post to %s" % blog}
+        url = "http://api.tumblr.com/v2/blog/%s/post" % blog
+        requests.append(oauth2.Request("POST", url, params,
+            is_form_encoded=True))
+        single = oauth2.Request("POST", url, params, is_form_encoded=True)
+        single.sign_request(method, consumer, token)
+        expected.append(single)
+      self.assertEqual(oauth2.sign_many(requests, method, consumer, token),
+          expected)
+
+
+class NonceStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.consumer = oauth2.Consumer("key", "secret")
+    self.server = oauth2.Server({"HMAC-SHA1":
+        oauth2.SignatureMethod_HMAC_SHA1()})
+    self.server.timestamp_threshold = 1000
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _stores(self):
+    return [oauth2.MemoryNonceStore(),
+        oauth2.SQLiteNonceStore(os.path.join(self.dir, "nonces.db"))]
+
+  def _verify(self, timestamp, nonce):
+    request = oauth2.Request.from_consumer_and_token(self.consumer,
+        http_url="http://api.tumblr.com/v2/user/info",
+        parameters={"oauth_timestamp": str(timestamp), "oauth_nonce": nonce})
+    request.sign_request(oauth2.SignatureMethod_HMAC_SHA1(), self.consumer,
+        None)
+    self.server.verify_request(request, self.consumer, None)
+
+  def test_window_follows_timestamp_threshold(self):
+    for store in self._stores():
+      self.server.nonce_store = store
+      # Sends a nonce old enough to have been forgotten under a fixed
+      # five minute window, though the server still accepts its timestamp.
+      old = int(time.time()) - 600
+      self._verify(old, "replayed")
+      self.assertEqual(store.window, 1000)
+      self._verify(int(time.time()), "fresh")
+      self.assertRaises(oauth2.Error, self._verify, old, "replayed")
+
+  def test_window_given_is_kept(self):
+    store = oauth2.MemoryNonceStore(window=2000)
+    self.server.nonce_store = store
+    self._verify(int(time.time()), "nonce")
+    self.assertEqual(store.window, 2000)
+
+
+if __name__ == "__main__":
+  unittest.main()
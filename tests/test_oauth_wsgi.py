@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# test_oauth_wsgi - tests for the OAuth verifying WSGI middleware
+import cStringIO
+import os
+import sys
+import time
+import unittest
+import wsgiref.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import oauth2 as oauth
+import oauth_wsgi
+
+
+class _Resolver(oauth_wsgi.Resolver):
+  """
+  Knows a single consumer, counting how often it is asked for any.
+  """
+
+  def __init__(self, consumer):
+    self.consumer = consumer
+    self.lookups = 0
+
+  def get_consumer(self, key):
+    self.lookups += 1
+    if key == self.consumer.key:
+      return self.consumer
+    return None
+
+  def get_token(self, key):
+    return None
+
+
+class OAuthVerifierMiddlewareTest(unittest.TestCase):
+
+  def setUp(self):
+    self.consumer = oauth.Consumer("key", "secret")
+    server = oauth.Server(nonce_store=oauth.MemoryNonceStore())
+    server.add_signature_method(oauth.SignatureMethod_HMAC_SHA1())
+    self.calls = []
+    self.middleware = oauth_wsgi.OAuthVerifierMiddleware(self._app,
+        _Resolver(self.consumer), server)
+
+  def _app(self, environ, start_response):
+    self.calls.append(environ["oauth.parameters"])
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return ["ok"]
+
+  def _environ(self, consumer=None):
+    req = oauth.Request.from_consumer_and_token(consumer or self.consumer,
+        http_url="http://127.0.0.1/v2/posts", parameters={"limit": "5"})
+    req.sign_request(oauth.SignatureMethod_HMAC_SHA1(),
+        consumer or self.consumer, None)
+    environ = {"PATH_INFO": "/v2/posts", "QUERY_STRING": "limit=5",
+        "HTTP_AUTHORIZATION": req.to_header()["Authorization"],
+        "wsgi.errors": cStringIO.StringIO()}
+    wsgiref.util.setup_testing_defaults(environ)
+    return environ
+
+  def _call(self, environ):
+    responses = []
+    body = "".join(self.middleware(environ,
+        lambda status, headers, exc_info=None: responses.append(status)))
+    return responses[0], body
+
+  def test_valid_request_reaches_app(self):
+    status, body = self._call(self._environ())
+    self.assertEqual((status, body), ("200 OK", "ok"))
+    self.assertEqual(self.calls, [{"limit": "5"}])
+    self.assertEqual(self.middleware.stats()["verified"], 1)
+
+  def test_bad_signature_is_refused_without_details(self):
+    environ = self._environ(oauth.Consumer("key", "wrong"))
+    status, body = self._call(environ)
+    self.assertEqual(status, "401 Unauthorized")
+    self.assertEqual(body, oauth_wsgi.UNAUTHORIZED_BODY)
+    self.assertEqual(self.calls, [])
+    self.assertIn("Invalid signature", environ["wsgi.errors"].getvalue())
+
+  def test_replayed_nonce_is_refused(self):
+    environ = self._environ()
+    self.assertEqual(self._call(dict(environ))[0], "200 OK")
+    status, body = self._call(environ)
+    self.assertEqual(status, "401 Unauthorized")
+    self.assertEqual(body, oauth_wsgi.UNAUTHORIZED_BODY)
+    self.assertEqual(len(self.calls), 1)
+    self.assertEqual(self.middleware.stats()["rejected"], 1)
+
+
+class CachingResolverTest(unittest.TestCase):
+
+  def test_unknown_keys_are_cached_for_negative_ttl(self):
+    backing = _Resolver(oauth.Consumer("key", "secret"))
+    resolver = oauth_wsgi.CachingResolver(backing, negative_ttl=0.05)
+    self.assertIsNone(resolver.get_consumer("bogus"))
+    self.assertIsNone(resolver.get_consumer("bogus"))
+    self.assertEqual(backing.lookups, 1)
+    time.sleep(0.1)
+    self.assertIsNone(resolver.get_consumer("bogus"))
+    self.assertEqual(backing.lookups, 2)
+
+  def test_known_keys_outlive_negative_ttl(self):
+    backing = _Resolver(oauth.Consumer("key", "secret"))
+    resolver = oauth_wsgi.CachingResolver(backing, negative_ttl=0.05)
+    resolver.get_consumer("key")
+    time.sleep(0.1)
+    self.assertEqual(resolver.get_consumer("key").secret, "secret")
+    self.assertEqual(backing.lookups, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+#
+# test_post_decoder - tests for lazily decoded posts
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import post_decoder
+
+
+class DecodeResponseTest(unittest.TestCase):
+
+  def setUp(self):
+    self.posts = [{"id": post_id, "type": "text", "title": "Post %d" % post_id,
+        "body": "<p>%s</p>" % ("x" * 1000), "notes": [{"type": "like"}]}
+        for post_id in range(1, 11)]
+    self.page = json.dumps({"meta": {"status": 200},
+        "response": {"posts": self.posts, "total_posts": 10}})
+
+  def test_posts_decode_as_sent(self):
+    response = post_decoder.DecodeResponse(self.page, "posts")
+    self.assertEqual(response["total_posts"], 10)
+    for post, expected in zip(response["posts"], self.posts):
+      self.assertEqual(post.to_dict(), expected)
+      self.assertEqual(json.loads(post.to_json()), expected)
+
+  def test_posts_do_not_hold_the_page(self):
+    post = post_decoder.DecodeResponse(self.page, "posts")["posts"][3]
+    self.assertLess(len(post._source), len(self.page) / 5)
+    self.assertEqual(post.title, "Post 4")
+    self.assertEqual(post["notes"], [{"type": "like"}])
+
+
+if __name__ == "__main__":
+  unittest.main()
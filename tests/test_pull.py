@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# test_pull - tests for downloading media into the content-addressed store
+import BaseHTTPServer
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import pull
+
+
+class _MediaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves the server's current media, honouring Range only while If-Range
+  matches its ETag, as a real server would.
+  """
+
+  def do_GET(self):
+    body, etag = self.server.body, self.server.etag
+    self.server.ranges.append(self.headers.getheader("Range"))
+    start = 0
+    byte_range = self.headers.getheader("Range")
+    if byte_range and self.headers.getheader("If-Range") == etag:
+      start = int(byte_range[len("bytes="):].rstrip("-"))
+      self.send_response(206)
+      self.send_header("Content-Range", "bytes %d-%d/%d" % (start,
+          len(body) - 1, len(body)))
+    else:
+      self.send_response(200)
+    self.send_header("ETag", etag)
+    self.send_header("Content-Length", str(len(body) - start))
+    self.end_headers()
+    self.wfile.write(body[start:])
+
+  def log_message(self, format, *args):
+    pass
+
+
+class MediaStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), _MediaHandler)
+    self.server.ranges = []
+    self._serve("new" * 1000, '"v2"')
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = "http://127.0.0.1:%d/photo.jpg" % self.server.server_port
+    self.store = pull.MediaStore(os.path.join(self.dir, "media"))
+    self.partial = os.path.join(self.store.partial_loc,
+        hashlib.sha1(self.url).hexdigest())
+
+  def tearDown(self):
+    self.store.close()
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.dir)
+
+  def _serve(self, body, etag):
+    self.server.body = body
+    self.server.etag = etag
+
+  def _leave_partial(self, data, validator=None):
+    with open(self.partial, "wb") as partial_file:
+      partial_file.write(data)
+    if validator:
+      with open(self.partial + pull.VALIDATOR_SUFFIX, "w") as validator_file:
+        validator_file.write(validator)
+
+  def _stored(self, digest):
+    with open(os.path.join(self.store.store_loc,
+        self.store.path(digest)), "rb") as stored_file:
+      return stored_file.read()
+
+  def test_unchanged_file_is_resumed(self):
+    self._leave_partial("new" * 400, '"v2"')
+    digest = self.store.fetch(self.url)
+    self.assertEqual(self._stored(digest), "new" * 1000)
+    self.assertEqual(digest, hashlib.sha256("new" * 1000).hexdigest())
+    self.assertEqual(self.store.resumed, 1)
+    self.assertFalse(os.path.exists(self.partial + pull.VALIDATOR_SUFFIX))
+
+  def test_changed_file_is_fetched_afresh(self):
+    self._leave_partial("old" * 400, '"v1"')
+    digest = self.store.fetch(self.url)
+    self.assertEqual(self._stored(digest), "new" * 1000)
+    self.assertEqual(self.store.resumed, 0)
+
+  def test_partial_without_validator_is_not_resumed(self):
+    self._leave_partial("old" * 400)
+    self.assertEqual(self._stored(self.store.fetch(self.url)), "new" * 1000)
+    self.assertEqual(self.server.ranges, [None])
+
+
+if __name__ == "__main__":
+  unittest.main()
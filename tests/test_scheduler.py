@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+# test_scheduler - tests for the request scheduler
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import connection_pool
+import scheduler
+
+
+def _Parse(resp, content):
+  return content
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.scheduler = scheduler.RequestScheduler(concurrency=2,
+        backoff_base=0.001, backoff_cap=0.001)
+
+  def _run_in_thread(self, send):
+    """
+    Runs a request on another thread, returning whether it finished within a
+    few seconds, rather than hanging the test when it does not.
+    """
+    def run():
+      try:
+        self.scheduler.run(None, send, _Parse)
+      except EnvironmentError:
+        pass
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    return not thread.is_alive()
+
+  def test_failed_send_releases_slot(self):
+    def missing_media():
+      raise IOError(2, "No such file or directory")
+    for i in range(3):
+      self.assertTrue(self._run_in_thread(missing_media))
+    self.assertEqual(self.scheduler.limiter.in_flight, 0)
+    ok = lambda: ({"status": "200"}, "ok")
+    self.assertTrue(self._run_in_thread(ok))
+    self.assertEqual(self.scheduler.limiter.in_flight, 0)
+
+  def _count_sends(self, *outcomes):
+    """
+    Returns a send callable which goes through outcomes in turn, raising
+    those which are errors, along with a list counting its calls.
+    """
+    calls = []
+    def send():
+      outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+      calls.append(outcome)
+      if isinstance(outcome, Exception):
+        raise outcome
+      return outcome
+    return send, calls
+
+  def test_post_is_not_retried_once_sent(self):
+    send, calls = self._count_sends(({"status": "500"}, "error"))
+    self.assertEqual(self.scheduler.run(None, send, _Parse, False), "error")
+    self.assertEqual(len(calls), 1)
+    send, calls = self._count_sends(socket.error(104, "Connection reset"))
+    self.assertRaises(socket.error, self.scheduler.run, None, send, _Parse,
+        False)
+    self.assertEqual(len(calls), 1)
+
+  def test_post_is_retried_when_not_acted_on(self):
+    ok = ({"status": "201"}, "ok")
+    send, calls = self._count_sends(({"status": "429"}, "throttled"), ok)
+    self.assertEqual(self.scheduler.run(None, send, _Parse, False), "ok")
+    self.assertEqual(len(calls), 2)
+    send, calls = self._count_sends(
+        connection_pool.NotSentError(111, "Connection refused"), ok)
+    self.assertEqual(self.scheduler.run(None, send, _Parse, False), "ok")
+    self.assertEqual(len(calls), 2)
+
+  def test_get_is_retried(self):
+    send, calls = self._count_sends(({"status": "503"}, "unavailable"),
+        socket.error(104, "Connection reset"), ({"status": "200"}, "ok"))
+    self.assertEqual(self.scheduler.run(None, send, _Parse), "ok")
+    self.assertEqual(len(calls), 3)
+
+
+  def test_throttled_blog_recovers(self):
+    throttled = ({"status": "429"}, "throttled")
+    ok = ({"status": "201"}, "ok")
+    self.scheduler.max_retries = 0
+    self.scheduler.run("blog", self._count_sends(throttled)[0], _Parse)
+    bucket = self.scheduler._blog_buckets["blog"]
+    def run(response):
+      # Skips waiting on the bucket, which is paced far below a test's time,
+      # and lets each refusal count as if it came a token's time apart.
+      bucket.tokens = bucket.capacity
+      bucket._throttled = 0.0
+      self.scheduler.run("blog", self._count_sends(response)[0], _Parse)
+    for i in range(5):
+      run(throttled)
+    self.assertTrue(bucket.rate < bucket.full_rate / 32)
+    for i in range(scheduler.RECOVERY_STEPS):
+      run(ok)
+    self.assertEqual(bucket.rate, bucket.full_rate)
+    self.assertNotIn("blog", self.scheduler._blog_buckets)
+
+  def test_refusals_sent_together_throttle_once(self):
+    bucket = scheduler.TokenBucket(10)
+    for i in range(4):
+      bucket.throttle()
+    self.assertEqual(bucket.rate, 5)
+
+  def test_paced_blog_recovers(self):
+    paced = scheduler.RequestScheduler(blog_rate=1000, backoff_base=0.001,
+        backoff_cap=0.001, max_retries=0)
+    paced.run("blog", lambda: ({"status": "429"}, "throttled"), _Parse)
+    bucket = paced._blog_buckets["blog"]
+    self.assertEqual(bucket.rate, 500)
+    paced.run("blog", lambda: ({"status": "200"}, "ok"), _Parse)
+    self.assertEqual(bucket.rate, 600)
+    self.assertIs(paced._blog_buckets["blog"], bucket)
+
+
+if __name__ == "__main__":
+  unittest.main()
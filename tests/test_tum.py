@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# test_tum - tests for the tum command line
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import bench
+import connection_pool
+import scheduler
+import tum
+
+# Contains the location of the tum command.
+TUM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tum.py")
+
+
+class SetsUpClientTest(unittest.TestCase):
+
+  def test_client_options(self):
+    for argv in (["-s", "localhost"], ["-slocalhost"], ["-qs", "localhost"],
+        ["--server", "localhost"], ["--server=localhost"], ["--serv=x"],
+        ["-x", "creds"], ["--credentials=creds"], ["--cache-size", "8"]):
+      self.assertTrue(tum.SetsUpClient(["text", "notes.txt"] + argv), argv)
+
+  def test_other_options(self):
+    for argv in ([], ["-q"], ["--timings", "text"], ["-t", "a,b"],
+        ["--", "-s"]):
+      self.assertFalse(tum.SetsUpClient(["text", "notes.txt"] + argv), argv)
+
+
+class AllowConcurrencyTest(unittest.TestCase):
+
+  def test_limit_stays_within_maximum(self):
+    module = tum.BaseModule("usage", "description")
+    module.connection_pool = connection_pool.ConnectionPool()
+    module.scheduler = scheduler.RequestScheduler()
+    module._allow_concurrency(8)
+    self.assertEqual(module.scheduler.limiter.limit, 8)
+    module._allow_concurrency(1000)
+    self.assertEqual(module.scheduler.limiter.limit,
+        module.scheduler.limiter.maximum)
+
+
+class DaemonTest(unittest.TestCase):
+  """
+  Runs commands through a tum daemon started against the mock API.
+  """
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.mock = bench.MockApiProcess()
+    creds_loc = os.path.join(self.dir, "creds")
+    with open(creds_loc, "w") as creds_file:
+      creds_file.write("[Credentials]\napi_key = %s\noauth_token = %s\n"
+          "oauth_token_secret = %s\n" % (self.mock.consumer_key,
+              self.mock.consumer_key, self.mock.consumer_secret))
+    self.env = dict(os.environ, HOME=self.dir,
+        TUM_SOCKET=os.path.join(self.dir, "tum.sock"))
+    self.daemon = subprocess.Popen([sys.executable, TUM, "daemon", "-x",
+        creds_loc, "-s", self.mock.address], env=self.env,
+        stdout=subprocess.PIPE)
+    self.assertTrue(self.daemon.stdout.readline().startswith("Listening"))
+
+  def tearDown(self):
+    self.daemon.terminate()
+    self.daemon.communicate()
+    if self.mock.process.returncode is None:
+      self.mock.stop()
+    shutil.rmtree(self.dir)
+
+  def _tum(self, *argv):
+    command = subprocess.Popen([sys.executable, TUM] + list(argv),
+        env=self.env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return command.communicate()[0], command.returncode
+
+  def test_extra_clients_use_daemon_server(self):
+    body_loc = os.path.join(self.dir, "body.txt")
+    with open(body_loc, "w") as body_file:
+      body_file.write("Posted through the daemon.")
+    output, status = self._tum("post", "text", body_loc, "-b",
+        "blog0,blog1")
+    self.assertEqual(status, 0, output)
+    self.assertIn("posted to blog0", output)
+    self.assertIn("posted to blog1", output)
+    self.assertEqual(self.mock.stop()["requests"], {"create_post": 2})
+
+  def test_missing_manifest_is_reported(self):
+    output, status = self._tum("post", "--batch",
+        os.path.join(self.dir, "missing.jsonl"), "-b", "blog0")
+    self.assertEqual(status, 1)
+    self.assertIn("ERROR: Unable to read the batch manifest", output)
+    self.assertNotIn("Traceback", output)
+
+
+if __name__ == "__main__":
+  unittest.main()
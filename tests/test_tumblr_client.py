@@ -0,0 +1,55 @@
+#!/usr/bin/python
+#
+# test_tumblr_client - tests for the Tumblr API client
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import tumblr_client
+
+
+class IterPagesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.client = tumblr_client.TumblrClient("key", "token", "secret",
+        "localhost", cache_loc=self.dir)
+    self.fetches = []
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _fetch(self, offset=0, **params):
+    """
+    Returns a full page of posts after a short delay, failing for offsets
+    past the first few pages.
+    """
+    self.fetches.append(offset)
+    time.sleep(0.05)
+    if offset >= 3 * tumblr_client.MAX_PAGE_SIZE:
+      raise IOError("fetched after being stopped")
+    return {"posts": [{"id": offset + i}
+        for i in range(tumblr_client.MAX_PAGE_SIZE)]}
+
+  def test_closing_stops_fetcher(self):
+    before = threading.active_count()
+    posts = self.client._iter_pages(self._fetch, "posts", {}, 2)
+    self.assertEqual(posts.next(), {"id": 0})
+    posts.close()
+    # Leaves no fetcher behind to be cut short at shutdown.
+    self.assertEqual(threading.active_count(), before)
+
+  def test_errors_reach_reader(self):
+    before = threading.active_count()
+    posts = self.client._iter_pages(self._fetch, "posts", {}, 1)
+    self.assertRaises(IOError, list, posts)
+    self.assertEqual(threading.active_count(), before)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# timings - records how long each phase of a tum command and its requests take
+import json
+import threading
+import time
+
+# Contains the recorder which phases are added to, or None while timings are
+# not being recorded.
+_recorder = None
+
+
+class _NullPhase(object):
+  """
+  Stands in for a phase while timings are not being recorded.
+  """
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+  """
+  Times a phase, adding it to a recorder on exit.
+  """
+
+  __slots__ = ("recorder", "name", "start")
+
+  def __init__(self, recorder, name):
+    self.recorder = recorder
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.recorder.add(self.name, time.time() - self.start)
+    return False
+
+
+class _Request(object):
+  """
+  Groups the phases of one API request, made on the current thread.
+  """
+
+  def __init__(self, recorder, action):
+    self.recorder = recorder
+    self.action = action
+    self.phases = []
+    self.outer = None
+
+  def add(self, name, seconds):
+    for phase in self.phases:
+      if phase[0] == name:
+        phase[1] += seconds
+        return
+    self.phases.append([name, seconds])
+
+  def __enter__(self):
+    self.outer = getattr(self.recorder.local, "request", None)
+    self.recorder.local.request = self
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.total = time.time() - self.start
+    self.recorder.local.request = self.outer
+    with self.recorder.lock:
+      self.recorder.requests.append(self)
+    return False
+
+
+class Recorder(object):
+  """
+  Collects the time taken by each phase of a command, grouping those spent
+  on behalf of an API request under that request.  Phases may be recorded
+  from any thread.
+  """
+
+  def __init__(self):
+    self.start = time.time()
+    self.end = None
+    self.phases = []
+    self.requests = []
+    self.lock = threading.Lock()
+    self.local = threading.local()
+
+  def add(self, name, seconds):
+    request = getattr(self.local, "request", None)
+    if request is not None:
+      request.add(name, seconds)
+      return
+    with self.lock:
+      self.phases.append([name, seconds])
+
+  def report(self):
+    """
+    Returns a dictionary of every phase and request recorded, in seconds.
+    """
+    total = (self.end or time.time()) - self.start
+    with self.lock:
+      return {
+        "total": total,
+        "phases": [{"phase": name, "seconds": seconds}
+            for name, seconds in self.phases],
+        "requests": [{
+          "action": request.action,
+          "total": request.total,
+          "phases": [{"phase": name, "seconds": seconds}
+              for name, seconds in request.phases],
+          "other": request.total - sum(seconds
+              for name, seconds in request.phases),
+        } for request in self.requests],
+      }
+
+  def format(self, as_json=False):
+    """
+    Returns the report as a table in milliseconds, or as JSON.
+    """
+    report = self.report()
+    if as_json:
+      return json.dumps(report, indent=2)
+    lines = ["%-28s %10s" % ("phase", "ms")]
+    row = lambda indent, name, seconds: "%-28s %10.1f" % (
+        indent + name, seconds * 1000)
+    for phase in report["phases"]:
+      lines.append(row("", phase["phase"], phase["seconds"]))
+    for request in report["requests"]:
+      lines.append(row("", request["action"], request["total"]))
+      for phase in request["phases"]:
+        lines.append(row("  ", phase["phase"], phase["seconds"]))
+      lines.append(row("  ", "other", request["other"]))
+    lines.append(row("", "total", report["total"]))
+    return "\n".join(lines)
+
+
+def Start():
+  """
+  Starts recording timings, returning the new Recorder.
+  """
+  global _recorder
+  _recorder = Recorder()
+  return _recorder
+
+
+def Stop():
+  """
+  Stops recording timings, returning the Recorder which was in use, if any.
+  """
+  global _recorder
+  recorder, _recorder = _recorder, None
+  if recorder is not None:
+    recorder.end = time.time()
+  return recorder
+
+
+def Phase(name):
+  """
+  Returns a context manager timing a phase, which does nothing unless timings
+  are being recorded.
+  """
+  recorder = _recorder
+  if recorder is None:
+    return _NULL_PHASE
+  return _Phase(recorder, name)
+
+
+def Request(action):
+  """
+  Returns a context manager grouping the phases recorded on this thread under
+  an API request, which does nothing unless timings are being recorded.
+  """
+  recorder = _recorder
+  if recorder is None:
+    return _NULL_PHASE
+  return _Request(recorder, action)
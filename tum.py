@@ -11,26 +11,77 @@
 # Special thanks go to dgoodwin@redhat.com, as much of the command-line handling
 # was based off of patterns found in Tito (https://github.com/dgoodwin/tito).
 # RHN fo'lyfe, yall.
-import pdb
-import ConfigParser
+import errno
 import os
+import signal
 import sys
-import tempfile
-import urllib
 
 from optparse import OptionGroup
 from optparse import OptionParser
 
+
+class LazyModule(object):
+  """
+  Stands in for a module, importing it the first time one of its attributes
+  is used.  Most runs of tum need only a few of its modules, and printing
+  help needs none of them.
+  """
+
+  def __init__(self, name):
+    self._name = name
+    self._module = None
+
+  def __getattr__(self, attr):
+    if self._module is None:
+      self._module = __import__(self._name)
+    return getattr(self._module, attr)
+
+
+# Contains the modules which only some commands use, imported on first use.
+ConfigParser = LazyModule("ConfigParser")
+json = LazyModule("json")
+shutil = LazyModule("shutil")
+tempfile = LazyModule("tempfile")
+
 # tum module-specific imports
-import tumblr_client
+batch = LazyModule("batch")
+bench = LazyModule("bench")
+connection_pool = LazyModule("connection_pool")
+daemon = LazyModule("daemon")
+http_cache = LazyModule("http_cache")
+metrics = LazyModule("metrics")
+mirror = LazyModule("mirror")
+multipart = LazyModule("multipart")
+pack = LazyModule("pack")
+post_index = LazyModule("post_index")
+pull = LazyModule("pull")
+scheduler = LazyModule("scheduler")
+spool = LazyModule("spool")
+timings = LazyModule("timings")
+tumblr_client = LazyModule("tumblr_client")
 
 # Contains various defaults for interacting with the Tumblr API.
 DEFAULT_TUM_CREDFILE = ".tum_creds"
 DEFAULT_TUMRC = ".tumrc"
+DEFAULT_TUM_SPOOL = ".tum_spool"
+DEFAULT_TUM_INDEX = ".tum_index.db"
+DEFAULT_TUM_SOCKET = ".tum_daemon.sock"
+
+# Contains the environment variable which overrides the location of the tum
+# daemon's socket; setting it empty stops commands being sent to the daemon.
+TUM_SOCKET_VAR = "TUM_SOCKET"
+
+# Contains the options which set up the Tumblr client itself, so that commands
+# given any of them run in their own process rather than on the daemon's
+# client, which was set up with its own.
+CLIENT_OPTIONS = ("-s", "--server", "-x", "--credentials", "--cache-size")
 
 # Contains the default Tumblr API server to point tum at.
 DEFAULT_TUMBLR_API_SERVER = "api.tumblr.com"
 
+# Contains the number of characters of each post's summary shown in listings.
+SUMMARY_WIDTH = 72
+
 # Contains the default editor used by this environment.
 EDITOR = os.environ.get("EDITOR", "vim")
 
@@ -134,6 +185,59 @@ POST_TYPES = {
   "video": VideoOptions,
 }
 
+# Contains, for each media post type, the API parameter which accepts a URL in
+# place of uploaded media.
+MEDIA_URL_PARAMS = {
+  "audio": "external_url",
+  "photo": "source",
+  "video": "embed",
+}
+
+
+def DaemonSocketLocation():
+  """
+  Returns the location of the tum daemon's socket, or None if commands
+  should not be sent to the daemon.
+  """
+  if TUM_SOCKET_VAR in os.environ:
+    return os.environ[TUM_SOCKET_VAR] or None
+  return "%s/%s" % (os.getenv("HOME"), DEFAULT_TUM_SOCKET)
+
+
+def SetsUpClient(argv):
+  """
+  Returns whether command-line arguments give any of the options which set
+  up the Tumblr client.  It errs towards saying they do, so short options run
+  together and abbreviated long options are counted whatever they stand for.
+  """
+  for arg in argv:
+    if arg == "--":
+      break
+    if arg.startswith("--"):
+      name = arg.split("=", 1)[0]
+      if len(name) > 2 and [option for option in CLIENT_OPTIONS
+          if option.startswith(name)]:
+        return True
+    elif arg.startswith("-"):
+      if [option for option in CLIENT_OPTIONS
+          if len(option) == 2 and option[1] in arg[1:]]:
+        return True
+  return False
+
+
+def FormatPost(post):
+  """
+  Returns a two-line summary of a post, as shown in listings.
+  """
+  summary = post.get("summary") or post.get("title") or ""
+  summary = " ".join(summary.split())
+  if len(summary) > SUMMARY_WIDTH:
+    summary = summary[:SUMMARY_WIDTH - 3] + "..."
+  line = u"%s %s [%s] %s\n  %s" % (post.get("date") or "",
+      post.get("blog_name") or "", post.get("type") or "", summary,
+      post.get("post_url") or "")
+  return line.encode("utf-8")
+
 
 class TumError(Exception):
   """
@@ -151,9 +255,32 @@ class CLIHandler(object):
     if len(argv) < 1 or not argv[0] in CLI_MODULES.keys():
       self._usage()
       sys.exit(1)
+    status = self._forward(argv)
+    if status is not None:
+      sys.exit(status)
     module_class = CLI_MODULES[argv[0]][0]
     module = module_class()
-    return module.main(argv)
+    return module.run(argv)
+
+  def _forward(self, argv):
+    """
+    Runs a command on the tum daemon, if one is running, returning its exit
+    status, or None if the command should run here instead.
+    """
+    socket_loc = DaemonSocketLocation()
+    if argv[0] in LOCAL_MODULES or SetsUpClient(argv[1:]) or \
+        not socket_loc or not os.path.exists(socket_loc):
+      return None
+    try:
+      client = daemon.DaemonClient(socket_loc)
+    except EnvironmentError:
+      # Leaves a socket whose daemon has died for the next daemon to clear.
+      return None
+    try:
+      return client.run(argv)
+    except EnvironmentError, e:
+      print("ERROR: lost the tum daemon: %s" % e)
+      return 1
 
   def _usage(self):
     print(TUM_LOGO + "\n")
@@ -173,6 +300,16 @@ class BaseModule(object):
     self.options = None
     self.tum_creds = None
     self.tumblr_client = None
+    self.client_settings = None
+    self.api_server = None
+    self.connection_pool = None
+    self.scheduler = None
+    self.post_index = None
+    self.http_cache = None
+    self.metrics = None
+    self.lazy_defaults = {}
+    self.timings = None
+    self.exporter = None
     self.parser = OptionParser(usage, description=description)
     self._add_common_options()
 
@@ -185,19 +322,140 @@ class BaseModule(object):
         metavar="CREDFILE")
     self.parser.add_option("-q", "--quiet", dest="quiet",
         action="store_true", default=False, help="enable quiet mode")
+    self.parser.add_option("--timings", dest="timings", type="choice",
+        choices=["text", "json"], metavar="FORMAT",
+        help="prints how long each step of the command and of each request "
+        "took to STDERR, as text or json")
+    self.parser.add_option("--cache-size", dest="cache_size", type="int",
+        metavar="MB",
+        help="most megabytes of API responses kept in the HTTP cache")
+    self._lazy_default("cache_size",
+        lambda: http_cache.DEFAULT_MAX_BYTES // (1024 * 1024))
+    self.parser.add_option("--metrics-prom", dest="metrics_prom",
+        metavar="FILE", help="periodically writes request latencies and "
+        "counters to FILE in the Prometheus text format")
+    self.parser.add_option("--metrics-json", dest="metrics_json",
+        metavar="FILE", help="periodically writes request latencies and "
+        "counters to FILE as a JSON snapshot")
+    self.parser.add_option("--metrics-interval", dest="metrics_interval",
+        type="int", metavar="SECONDS",
+        help="number of seconds between writes of the metrics files")
+
+  def _lazy_default(self, dest, default):
+    """
+    Gives an option a default which is only worked out once arguments are
+    parsed, so that building the parser imports nothing.
+
+    Args:
+      dest - destination of the option
+      default - callable returning the option's default
+    """
+
+    self.lazy_defaults[dest] = default
+
+  def _parse_args(self, argv):
+    (self.options, self.args) = self.parser.parse_args(argv)
+    for dest, default in self.lazy_defaults.iteritems():
+      if getattr(self.options, dest) is None:
+        setattr(self.options, dest, default())
+    if self.options.timings:
+      self.timings = timings.Start()
+
+  def run(self, argv):
+    """
+    Runs the module, then prints its timings and writes its metrics if they
+    were asked for.
+    """
+    try:
+      return self.main(argv)
+    finally:
+      if self.exporter is not None:
+        self.exporter.stop()
+        self.exporter = None
+      if self.timings is not None:
+        timings.Stop()
+        sys.stderr.write(self.timings.format(
+            self.options.timings == "json") + "\n")
 
   def _read_credentials(self, credfile_loc):
     self.tum_creds = ConfigParser.RawConfigParser()
     self.tum_creds.read(credfile_loc)
 
+  def share_client(self, other):
+    """
+    Hands this module the client held by another, along with everything kept
+    warm alongside it, as tum daemon does for each command it runs.
+    """
+    self.tum_creds = other.tum_creds
+    self.client_settings = other.client_settings
+    self.api_server = other.api_server
+    self.connection_pool = other.connection_pool
+    self.scheduler = other.scheduler
+    self.post_index = other.post_index
+    self.http_cache = other.http_cache
+    self.metrics = other.metrics
+    self.tumblr_client = other.tumblr_client
+
+  def _start_exporter(self):
+    """
+    Starts writing the metrics of every request made to the files asked for,
+    if any.
+    """
+    if self.options.metrics_prom or self.options.metrics_json:
+      self.exporter = metrics.Exporter(self.metrics,
+          self.options.metrics_prom, self.options.metrics_json,
+          self.options.metrics_interval or metrics.DEFAULT_EXPORT_INTERVAL)
+
   def main(self, argv):
     # Parses command-line arguments.
-    (self.options, self.args) = self.parser.parse_args(argv)
+    self._parse_args(argv)
+    # Keeps any client already handed over by the daemon, so long as the
+    # command does not ask for one set up otherwise.
+    if self.tumblr_client is not None:
+      if SetsUpClient(argv) and \
+          self._client_settings() != self.client_settings:
+        print("ERROR: The tum daemon's client uses another server, "
+            "credentials file or cache size; set TUM_SOCKET empty to run "
+            "this command without the daemon.")
+        sys.exit(1)
+      self._start_exporter()
+      return
+    self.client_settings = self._client_settings()
+    self._load_credentials()
+    self.api_server = self.options.server
 
-    # Figures out where the OAuth credentials file should land
-    credfile_loc = "%s/%s" % (os.getenv("HOME"), DEFAULT_TUM_CREDFILE)
+    # Initializes the Tumblr client, along with a connection pool which any
+    # further clients share.
+    with timings.Phase("client"):
+      self.connection_pool = connection_pool.ConnectionPool()
+      self.scheduler = scheduler.RequestScheduler()
+      self.post_index = self._open_index()
+      self.http_cache = self._open_cache()
+      self.metrics = metrics.Metrics()
+      self.tumblr_client = self._create_client()
+    self._start_exporter()
+
+  def _credentials_loc(self):
+    """
+    Returns where the OAuth credentials file should land.
+    """
     if self.options.credentials:
-      credfile_loc = self.options.credentials
+      return self.options.credentials
+    return "%s/%s" % (os.getenv("HOME"), DEFAULT_TUM_CREDFILE)
+
+  def _client_settings(self):
+    """
+    Returns the server, credentials file and cache size which the command
+    line asks the Tumblr client to be set up with.
+    """
+    return (self.options.server, os.path.abspath(self._credentials_loc()),
+        self.options.cache_size)
+
+  def _load_credentials(self):
+    """
+    Reads the OAuth credentials, authenticating to get them if need be.
+    """
+    credfile_loc = self._credentials_loc()
     # Authenticates to Tumblr OAuth API if no credential file exists.
     if not os.path.exists(credfile_loc):
       print("ERROR: no Tumblr credentials file found at %s." % credfile_loc)
@@ -208,18 +466,65 @@ class BaseModule(object):
         print(e.message)
         sys.exit(-1)
     try:
-      self._read_credentials(credfile_loc)
+      with timings.Phase("credentials"):
+        self._read_credentials(credfile_loc)
     except Exception, e:
       print("An error occurred while reading your credentials file:")
       print(e.message)
       sys.exit(-1)
 
-    # Initializes the Tumblr client.
-    self.tumblr_client = tumblr_client.TumblrClient(
+  def _create_client(self):
+    """
+    Builds a new Tumblr client from the loaded credentials, for the server
+    the first client was set up with, which under the daemon is its own.
+    """
+    return tumblr_client.TumblrClient(
         self.tum_creds.get("Credentials", "api_key"),
         self.tum_creds.get("Credentials", "oauth_token"),
         self.tum_creds.get("Credentials", "oauth_token_secret"),
-        self.options.server)
+        self.api_server, pool=self.connection_pool,
+        scheduler=self.scheduler, index=self.post_index,
+        cache=self.http_cache, metrics=self.metrics)
+
+  def _open_index(self):
+    """
+    Opens the local index of fetched posts.
+    """
+    return post_index.PostIndex("%s/%s" % (os.getenv("HOME"),
+        DEFAULT_TUM_INDEX))
+
+  def _open_cache(self):
+    """
+    Opens the HTTP cache of API responses.
+    """
+    return http_cache.SQLiteCache("%s/%s" % (os.getenv("HOME"),
+        tumblr_client.DEFAULT_CACHE_LOC), self.options.cache_size * 1024 * 1024)
+
+  def _create_poster(self, workers):
+    """
+    Builds a BatchPoster whose workers each get a client of their own.
+    """
+    self._allow_concurrency(workers)
+    return batch.BatchPoster(self._create_client, workers)
+
+  def _allow_concurrency(self, workers):
+    """
+    Lets every one of a number of workers hold a connection of its own and
+    have a request in flight, up to the most the scheduler ever allows.
+    """
+    self.connection_pool.max_per_host = max(self.connection_pool.max_per_host,
+        workers)
+    limiter = self.scheduler.limiter
+    limiter.limit = max(limiter.limit, min(workers, limiter.maximum))
+
+  def _open_spool(self):
+    """
+    Opens the spool of posts waiting to be sent.
+    """
+    spool_loc = "%s/%s" % (os.getenv("HOME"), DEFAULT_TUM_SPOOL)
+    if self.options.spool_dir:
+      spool_loc = self.options.spool_dir
+    return spool.Spool(spool_loc)
 
 
 class AuthModule(BaseModule):
@@ -235,7 +540,7 @@ class AuthModule(BaseModule):
 
   def main(self, argv):
     # Parses command-line arguments.
-    (self.options, self.args) = self.parser.parse_args(argv)
+    self._parse_args(argv)
     # Figures out where the OAuth credentials file should land.
     credfile_loc = "%s/%s" % (os.getenv("HOME"), DEFAULT_TUM_CREDFILE)
     if self.options.credentials:
@@ -272,7 +577,8 @@ class PostModule(BaseModule):
         "may be posted.  For instance:\n\n"
         " # tum post photo tony_banks.jpg http://genesis.com/philcollins.jpg")
     self.parser.add_option("-b", "--blog", dest="blog",
-        metavar="BLOG", help="specifies a blog")
+        metavar="BLOG", help="specifies a blog, or a comma-separated list of "
+        "blogs to each get the post")
     self.parser.add_option("-I", "--stdin", dest="stdin",
         action="store_true", default=False, help="read input from STDIN")
     self.parser.add_option("-S", "--state", dest="state",
@@ -280,11 +586,144 @@ class PostModule(BaseModule):
         help="the state of the post: published, draft, queue")
     self.parser.add_option("-T", "--tags", dest="tags",
         metavar="TAGS", help="comma-separated tags for this post")
+    self.parser.add_option("--batch", dest="batch", metavar="FILE",
+        help="posts every item in a JSON lines manifest, or STDIN if FILE is -")
+    self.parser.add_option("-w", "--workers", dest="workers", type="int",
+        metavar="WORKERS",
+        help="number of concurrent workers used in batch mode and when "
+        "posting to several blogs")
+    self._lazy_default("workers", lambda: batch.DEFAULT_WORKERS)
+    self.parser.add_option("--spool", dest="spool", action="store_true",
+        default=False, help="queues the post on disk for tum flush to send, "
+        "rather than sending it now; local media must still exist then")
+    self.parser.add_option("--spool-dir", dest="spool_dir", metavar="DIR",
+        help="specifies a custom location for the spool")
 
   def _get_file(self, file_loc):
-    return open(file_loc, 'r').read()
+    # Reads the body whole, as it is signed and form-encoded as one string.
+    with open(file_loc, "rb") as post_file:
+      return post_file.read()
+
+  def _get_media(self, post_params, locations):
+    """
+    Works out how the media for a post should be sent to the API.
+
+    Args:
+      post_params - dictionary containing the post's parameters
+      locations - list of local files and URLs to post
+
+    Returns:
+      a list of (name, location) tuples to stream as a multipart body, or None
+      if the media is passed to the API by URL
+    """
+
+    post_type = post_params["type"]
+    if not locations:
+      print("ERROR: No files or URLs given for this %s post." % post_type)
+      sys.exit(1)
+    if len(locations) > 1 and post_type != "photo":
+      print("ERROR: Only photo posts may include more than one file.")
+      sys.exit(1)
+    # Lets Tumblr fetch a lone URL itself, rather than relaying it through us.
+    if len(locations) == 1 and multipart.IsUrl(locations[0]):
+      post_params[MEDIA_URL_PARAMS[post_type]] = locations[0]
+      return None
+    if len(locations) == 1:
+      return [("data", locations[0])]
+    return [("data[%d]" % i, loc) for i, loc in enumerate(locations)]
+
+  def _is_batch(self, argv):
+    for arg in argv:
+      if arg == "--batch" or arg.startswith("--batch="):
+        return True
+    return False
+
+  def _print_batch_result(self, result):
+    if result.ok:
+      if not self.options.quiet:
+        print("[%d] posted to %s (%.2fs)" % (result.index, result.blog,
+            result.elapsed))
+    else:
+      print("[%d] FAILED: %s" % (result.index, result.error))
+
+  def _blogs(self):
+    """
+    Returns the list of blogs given with --blog, without repeats.
+    """
+    blogs = []
+    for blog in (self.options.blog or "").split(","):
+      blog = blog.strip()
+      if blog and blog not in blogs:
+        blogs.append(blog)
+    return blogs
+
+  def _print_blog_result(self, result):
+    if result.ok:
+      if not self.options.quiet:
+        print("posted to %s (%.2fs)" % (result.blog, result.elapsed))
+    else:
+      print("FAILED to post to %s: %s" % (result.blog, result.error))
+
+  def _fan_out(self, blogs, post_params, files):
+    """
+    Sends the same post to several blogs at once.  Its body and media are
+    encoded once, up front, and every request sends that same encoding, so
+    that no file is read nor URL fetched more than once.
+    """
+    body = None
+    if files:
+      try:
+        body = multipart.PreparedBody(post_params.items(), files)
+      except EnvironmentError, e:
+        print("ERROR: Unable to read the media for this post: %s" % e)
+        sys.exit(1)
+    try:
+      poster = self._create_poster(min(len(blogs), self.options.workers))
+      items = [(index, blog, dict(post_params), body)
+          for index, blog in enumerate(blogs, 1)]
+      failed = poster.run(items, self._print_blog_result)
+    finally:
+      if body is not None:
+        body.close()
+    print("Posted to %d of %d blogs in %.2fs" % (poster.succeeded, len(blogs),
+        poster.elapsed))
+    if failed:
+      sys.exit(1)
+
+  def _batch_main(self, argv):
+    BaseModule.main(self, argv)
+    blogs = self._blogs()
+    if len(blogs) > 1:
+      print("ERROR: Batch mode takes a single default blog.")
+      sys.exit(1)
+    if self.options.batch == "-":
+      manifest = sys.stdin
+    else:
+      try:
+        manifest = open(self.options.batch, "r")
+      except EnvironmentError, e:
+        print("ERROR: Unable to read the batch manifest: %s" % e)
+        sys.exit(1)
+    # Applies the command-line post options as defaults for every item.
+    defaults = {}
+    if self.options.state:
+      defaults["state"] = self.options.state
+    if self.options.tags:
+      defaults["tags"] = self.options.tags
+    poster = self._create_poster(self.options.workers)
+    # Leaves items which name no blog of their own to fail on their own when
+    # no default is given.
+    items = batch.ReadManifest(manifest, blogs and blogs[0] or None, defaults)
+    failed = poster.run(items, self._print_batch_result)
+    total = poster.succeeded + poster.failed
+    print("Posted %d of %d items in %.2fs (%.1f posts/s)" % (poster.succeeded,
+        total, poster.elapsed, poster.throughput()))
+    if failed:
+      sys.exit(1)
 
   def main(self, argv):
+    if self._is_batch(argv):
+      return self._batch_main(argv)
     if len(argv) < 2 or argv[1] not in POST_TYPES:
       self.parser.print_usage()
       print("ERROR: Post type not recognized, available post types are:")
@@ -296,7 +735,6 @@ class PostModule(BaseModule):
     # Populates a request to the API and sends it.
     post_params = {}
     post_params["type"] = self.args[1]
-    #pdb.set_trace()
     if self.options.state:
       post_params["state"] = self.options.state
     if self.options.tags:
@@ -308,17 +746,500 @@ class PostModule(BaseModule):
         post_params["body"] = sys.stdin.read()
       else:
         post_params["body"] = self._get_file(self.args[2])
-    self.tumblr_client.create_post(self.options.blog, post_params)
+    files = None
+    if post_params["type"] in MEDIA_URL_PARAMS:
+      if self.options.caption:
+        post_params["caption"] = self.options.caption
+      if post_params["type"] == "photo" and self.options.link:
+        post_params["link"] = self.options.link
+      files = self._get_media(post_params, self.args[2:])
+    blogs = self._blogs()
+    if not blogs:
+      print("ERROR: A blog must be specified with --blog.")
+      sys.exit(1)
+    if self.options.spool:
+      post_spool = self._open_spool()
+      for blog in blogs:
+        try:
+          post_id = post_spool.append(blog, post_params, files)
+        except tumblr_client.TumError, e:
+          print("ERROR: %s" % e)
+          sys.exit(1)
+        if not self.options.quiet:
+          print("Spooled post %s" % post_id)
+      return
+    if len(blogs) > 1:
+      return self._fan_out(blogs, post_params, files)
+    self.tumblr_client.create_post(blogs[0], post_params, files)
+
+
+class DashModule(BaseModule):
+  """
+  Contains CLI handlers for reading your dashboard.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog dash [options]",
+        "The dash module lists the posts on your dashboard, newest first, "
+        "fetching further pages in the background as you read.  Pipe it "
+        "through a pager to scroll:\n\n"
+        " # tum dash | less")
+    self.parser.add_option("-n", "--count", dest="count", type="int",
+        metavar="COUNT", help="stops after COUNT posts")
+    self.parser.add_option("-t", "--type", dest="type", metavar="TYPE",
+        help="only lists posts of the given type")
+    self.parser.add_option("-p", "--prefetch", dest="prefetch", type="int",
+        metavar="PAGES",
+        help="number of pages fetched ahead of the one being shown")
+    self._lazy_default("prefetch",
+        lambda: tumblr_client.DEFAULT_PREFETCH_PAGES)
+
+  def main(self, argv):
+    BaseModule.main(self, argv)
+    params = {}
+    if self.options.type:
+      params["type"] = self.options.type
+    posts = self.tumblr_client.iter_dashboard(self.options.prefetch, **params)
+    try:
+      for count, post in enumerate(posts, 1):
+        print(FormatPost(post))
+        if count == self.options.count:
+          break
+    except IOError, e:
+      # Stops quietly once the pager reading our output has quit.
+      if e.errno != errno.EPIPE:
+        raise
+    except tumblr_client.TumError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    finally:
+      posts.close()
+
+
+class PullModule(BaseModule):
+  """
+  Contains CLI handlers for backing up a blog's posts and media.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self,
+        "usage: %prog pull [options] <blog> [directory]",
+        "The pull module downloads every post on a blog, along with its "
+        "photos, audio and video, into a directory named after the blog or "
+        "one of your choosing.  Media is stored once however often it was "
+        "reblogged, and an interrupted pull picks up where it left off when "
+        "run again.")
+    self.parser.add_option("-w", "--workers", dest="workers", type="int",
+        metavar="WORKERS", help="number of concurrent media downloads")
+    self._lazy_default("workers", lambda: pull.DEFAULT_WORKERS)
+    self.parser.add_option("-t", "--type", dest="type", metavar="TYPE",
+        help="only pulls posts of the given type")
+    self.parser.add_option("--tag", dest="tag", metavar="TAG",
+        help="only pulls posts with the given tag")
+
+  def _print_result(self, post, media, failures):
+    if failures:
+      for error in failures:
+        print("%s FAILED: %s" % (post["id"], error))
+    elif not self.options.quiet:
+      print("%s pulled (%d media)" % (post["id"], len(media)))
+
+  def main(self, argv):
+    BaseModule.main(self, argv)
+    if len(self.args) < 2:
+      self.parser.print_usage()
+      print("ERROR: No blog specified.")
+      sys.exit(1)
+    blog = self.args[1]
+    dest_loc = blog
+    if len(self.args) > 2:
+      dest_loc = self.args[2]
+    params = {}
+    if self.options.type:
+      params["post_type"] = self.options.type
+    if self.options.tag:
+      params["tag"] = self.options.tag
+    puller = pull.Puller(self.tumblr_client, dest_loc, self.options.workers)
+    try:
+      failed = puller.run(blog, self._print_result, **params)
+    except tumblr_client.TumError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    finally:
+      puller.close()
+    store = puller.store
+    print("Pulled %d posts (%d already present) in %.2fs; downloaded %d "
+        "media files (%d bytes, %d resumed), reused %d" % (puller.pulled,
+        puller.skipped, puller.elapsed, store.downloaded, store.bytes,
+        store.resumed, store.reused))
+    if failed:
+      sys.exit(1)
+
+
+class SearchModule(BaseModule):
+  """
+  Contains CLI handlers for searching the posts tum has fetched.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog search [options] [query]",
+        "The search module finds posts in the local index which tum keeps of "
+        "every post it fetches, without contacting Tumblr.  Queries match "
+        "words in titles, bodies, captions and tags, and may use SQLite "
+        "full-text syntax:\n\n"
+        " # tum search -b genesis 'phil* OR banks'")
+    self.parser.add_option("-b", "--blog", dest="blog", metavar="BLOG",
+        help="only finds posts from the given blog")
+    self.parser.add_option("-t", "--type", dest="type", metavar="TYPE",
+        help="only finds posts of the given type")
+    self.parser.add_option("-T", "--tag", dest="tag", metavar="TAG",
+        help="only finds posts with the given tag")
+    self.parser.add_option("-S", "--state", dest="state", metavar="STATE",
+        help="only finds posts in the given state")
+    self.parser.add_option("-n", "--count", dest="count", type="int",
+        metavar="COUNT", help="maximum number of posts listed")
+    self._lazy_default("count", lambda: post_index.DEFAULT_SEARCH_LIMIT)
+
+  def main(self, argv):
+    self._parse_args(argv)
+    index = self.post_index or self._open_index()
+    try:
+      posts = index.search(" ".join(self.args[1:]), self.options.blog,
+          self.options.type, self.options.tag, self.options.state,
+          self.options.count)
+    except tumblr_client.TumError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    for post in posts:
+      print(FormatPost(post))
+    if not posts:
+      sys.exit(1)
+
+
+class MirrorModule(PullModule):
+  """
+  Contains CLI handlers for keeping a pulled blog up to date.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self,
+        "usage: %prog mirror [options] <blog> [directory]",
+        "The mirror module keeps a copy of a blog, made as tum pull makes "
+        "one, up to date.  Each run fetches only the posts published since "
+        "the last, re-checks the newest posts for edits and deletions, and "
+        "stops paging as soon as it reaches posts it already has.")
+    self.parser.add_option("-w", "--workers", dest="workers", type="int",
+        metavar="WORKERS", help="number of concurrent media downloads")
+    self._lazy_default("workers", lambda: pull.DEFAULT_WORKERS)
+
+  def main(self, argv):
+    BaseModule.main(self, argv)
+    if len(self.args) < 2:
+      self.parser.print_usage()
+      print("ERROR: No blog specified.")
+      sys.exit(1)
+    blog = self.args[1]
+    dest_loc = blog
+    if len(self.args) > 2:
+      dest_loc = self.args[2]
+    blog_mirror = mirror.Mirror(self.tumblr_client, dest_loc,
+        self.options.workers)
+    try:
+      failed = blog_mirror.sync(blog, self._print_result)
+    except tumblr_client.TumError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    finally:
+      blog_mirror.close()
+    print("Mirrored %s: %d new, %d edited, %d deleted, in %d requests" % (
+        blog, len(blog_mirror.new), len(blog_mirror.edited),
+        len(blog_mirror.deleted), blog_mirror.requests))
+    if failed:
+      sys.exit(1)
+
+
+class RepackModule(BaseModule):
+  """
+  Contains CLI handlers for compacting the archives written by tum pull.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog repack [options] <directory>",
+        "The repack module rewrites the post archive in a directory made by "
+        "tum pull, dropping every copy of a post which a later pull has "
+        "superseded.")
+
+  def main(self, argv):
+    self._parse_args(argv)
+    if len(self.args) < 2:
+      self.parser.print_usage()
+      print("ERROR: No directory specified.")
+      sys.exit(1)
+    if not os.path.exists(os.path.join(self.args[1], pack.PACK_FILE)):
+      print("ERROR: No post archive found in %s." % self.args[1])
+      sys.exit(1)
+    archive = pack.PackArchive(self.args[1])
+    before, after = archive.repack()
+    count = len(archive)
+    archive.close()
+    if not self.options.quiet:
+      print("Repacked %d posts from %d to %d bytes" % (count, before, after))
+
+
+class FlushModule(BaseModule):
+  """
+  Contains CLI handlers for sending the posts spooled by tum post --spool.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog flush [options]",
+        "The flush module sends every post queued with tum post --spool, "
+        "using several workers at once.  Each post the API accepts is "
+        "checkpointed as it goes, so an interrupted flush can simply be run "
+        "again without posting anything twice.  Posts which fail stay queued "
+        "for the next flush.")
+    self.parser.add_option("-w", "--workers", dest="workers", type="int",
+        metavar="WORKERS", help="number of concurrent workers")
+    self._lazy_default("workers", lambda: batch.DEFAULT_WORKERS)
+    self.parser.add_option("--spool-dir", dest="spool_dir", metavar="DIR",
+        help="specifies a custom location for the spool")
+    self.spool = None
+
+  def _print_result(self, result):
+    if result.ok:
+      if not self.options.quiet:
+        print("%s posted to %s (%.2fs)" % (result.index, result.blog,
+            result.elapsed))
+    else:
+      print("%s FAILED: %s" % (result.index, result.error))
+
+  def main(self, argv):
+    BaseModule.main(self, argv)
+    self.spool = self._open_spool()
+    poster = self._create_poster(self.options.workers)
+    try:
+      with self.spool.flushing():
+        poster.run(self.spool.pending(), self._print_result,
+            self.spool.mark_accepted)
+    except tumblr_client.TumError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    total = poster.succeeded + poster.failed
+    print("Flushed %d of %d posts in %.2fs (%.1f posts/s)" % (
+        poster.succeeded, total, poster.elapsed, poster.throughput()))
+    if poster.failed:
+      sys.exit(1)
+
+
+class DaemonModule(BaseModule):
+  """
+  Contains CLI handlers for serving tum commands from a long-running process.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog daemon [options]",
+        "The daemon module keeps an authenticated Tumblr client, along with "
+        "its open connections and caches, running in the foreground.  While "
+        "it runs, every other tum command is sent to it over a Unix socket "
+        "and run there, which saves starting up and connecting afresh each "
+        "time.  Commands run one at a time.  Set TUM_SOCKET to use another "
+        "socket, or set it empty to run a command without the daemon:\n\n"
+        " # tum daemon &\n"
+        " # tum post text notes.txt")
+    self.parser.add_option("--socket", dest="socket", metavar="SOCKET",
+        help="specifies a custom location for the daemon's socket")
+
+  def _run_command(self, argv):
+    if not argv or argv[0] not in CLI_MODULES or argv[0] in LOCAL_MODULES:
+      print("ERROR: The tum daemon cannot run that command.")
+      sys.exit(1)
+    module = CLI_MODULES[argv[0]][0]()
+    module.share_client(self)
+    module.run(argv)
+
+  def _stop(self, signum, frame):
+    raise KeyboardInterrupt()
+
+  def main(self, argv):
+    BaseModule.main(self, argv)
+    socket_loc = self.options.socket or DaemonSocketLocation()
+    if not socket_loc:
+      print("ERROR: No socket specified.")
+      sys.exit(1)
+    try:
+      server = daemon.DaemonServer(socket_loc, self._run_command)
+    except EnvironmentError, e:
+      print("ERROR: %s" % e)
+      sys.exit(1)
+    signal.signal(signal.SIGTERM, self._stop)
+    if not self.options.quiet:
+      print("Listening on %s" % socket_loc)
+      sys.stdout.flush()
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      self.post_index.close()
+      self.http_cache.close()
+    if not self.options.quiet:
+      print("Served %d commands" % server.served)
+
+
+class BenchModule(BaseModule):
+  """
+  Contains CLI handlers for load-testing the Tumblr client.
+  """
+
+  def __init__(self):
+    BaseModule.__init__(self, "usage: %prog bench [options]",
+        "The bench module sends requests to one endpoint of the Tumblr API "
+        "from several clients at once, as fast as they can or at a fixed "
+        "rate, then reports throughput and latency percentiles.  Requests go "
+        "to a mock of the API started for the run, never to Tumblr, unless "
+        "--server names another server to send them to:\n\n"
+        " # tum bench -e dashboard -c 8 --latency 40 --throttle-rate 0.05")
+    self.mock = None
+    self.cache_dir = None
+    self.parser.add_option("-e", "--endpoint", dest="endpoint",
+        default="post", metavar="ENDPOINT", help="endpoint to send requests "
+        "to: post, posts, dashboard, likes, info or user")
+    self.parser.add_option("-b", "--blog", dest="blog", default="tum-bench",
+        metavar="BLOG", help="blog to send requests about")
+    self.parser.add_option("-n", "--requests", dest="requests", type="int",
+        metavar="COUNT", help="number of requests to send")
+    self._lazy_default("requests", lambda: bench.DEFAULT_REQUESTS)
+    self.parser.add_option("-d", "--duration", dest="duration", type="float",
+        metavar="SECONDS", help="sends requests for this long instead")
+    self.parser.add_option("-c", "--concurrency", dest="concurrency",
+        type="int", metavar="CLIENTS", help="number of clients sending "
+        "requests at once")
+    self._lazy_default("concurrency", lambda: bench.DEFAULT_CONCURRENCY)
+    self.parser.add_option("-r", "--rate", dest="rate", type="float",
+        metavar="RATE", help="requests started per second, rather than as "
+        "many as the clients can send")
+    self.parser.add_option("-m", "--media", dest="media", action="append",
+        metavar="FILE", help="uploads FILE with each post; may be repeated")
+    self.parser.add_option("-j", "--json", dest="json", action="store_true",
+        default=False, help="prints the results as JSON")
+    group = OptionGroup(self.parser, "Mock API Options")
+    group.add_option("--latency", dest="latency", type="float", default=0.0,
+        metavar="MS", help="milliseconds every response is delayed by")
+    group.add_option("--jitter", dest="jitter", type="float", default=0.0,
+        metavar="MS", help="most milliseconds added at random to each delay")
+    group.add_option("--error-rate", dest="error_rate", type="float",
+        default=0.0, metavar="FRACTION",
+        help="fraction of requests answered with 500")
+    group.add_option("--throttle-rate", dest="throttle_rate", type="float",
+        default=0.0, metavar="FRACTION",
+        help="fraction of requests answered with 429")
+    group.add_option("--retry-after", dest="retry_after", type="float",
+        metavar="SECONDS", help="seconds throttled clients are told to wait")
+    group.add_option("--fixtures", dest="fixtures", metavar="DIR",
+        help="replays recorded responses from DIR, such as "
+        "DIR/user/dashboard.json")
+    group.add_option("--seed", dest="seed", type="int", default=0,
+        help="seed for the injected faults")
+    self.parser.add_option_group(group)
+
+  def _mock_args(self):
+    args = ["--latency", str(self.options.latency),
+        "--jitter", str(self.options.jitter),
+        "--error-rate", str(self.options.error_rate),
+        "--throttle-rate", str(self.options.throttle_rate),
+        "--seed", str(self.options.seed)]
+    if self.options.retry_after is not None:
+      args.extend(["--retry-after", str(self.options.retry_after)])
+    if self.options.fixtures:
+      args.extend(["--fixtures", os.path.abspath(self.options.fixtures)])
+    return args
+
+  def _load_credentials(self):
+    if self.options.server != DEFAULT_TUMBLR_API_SERVER:
+      return BaseModule._load_credentials(self)
+    # Signs requests with a consumer made up for the mock.
+    self.mock = bench.MockApiProcess(self._mock_args())
+    self.options.server = self.mock.address
+    self.tum_creds = ConfigParser.RawConfigParser()
+    self.tum_creds.add_section("Credentials")
+    self.tum_creds.set("Credentials", "api_key", self.mock.consumer_key)
+    self.tum_creds.set("Credentials", "oauth_token", self.mock.consumer_key)
+    self.tum_creds.set("Credentials", "oauth_token_secret",
+        self.mock.consumer_secret)
+
+  def _open_index(self):
+    # Keeps benchmarked posts out of the index.
+    return None
+
+  def _open_cache(self):
+    # Caches responses as usual, but somewhere thrown away after the run.
+    self.cache_dir = tempfile.mkdtemp(prefix="tum-bench-")
+    return http_cache.SQLiteCache(os.path.join(self.cache_dir, "cache.db"),
+        self.options.cache_size * 1024 * 1024)
+
+  def main(self, argv):
+    try:
+      BaseModule.main(self, argv)
+      call = bench.ENDPOINTS.get(self.options.endpoint)
+      if call is None:
+        print("ERROR: Endpoint not recognized, available endpoints are:")
+        print("%s" % ", ".join(sorted(bench.ENDPOINTS)))
+        sys.exit(1)
+      files = None
+      if self.options.media:
+        files = [("data[%d]" % i, os.path.abspath(loc))
+            for i, loc in enumerate(self.options.media)]
+      if not self.options.quiet and not self.options.json:
+        print("Sending %s requests to %s..." % (self.options.endpoint,
+            self.options.server))
+        sys.stdout.flush()
+      self._allow_concurrency(self.options.concurrency)
+      test = bench.LoadTest(self._create_client,
+          lambda client, index: call(client, self.options.blog, index, files),
+          self.options.concurrency, self.options.rate)
+      count = self.options.requests
+      if self.options.duration is not None:
+        count = None
+      test.run(count, self.options.duration)
+    finally:
+      if self.mock is not None:
+        self.mock.stop()
+      if self.http_cache is not None:
+        self.http_cache.close()
+      if self.cache_dir is not None:
+        shutil.rmtree(self.cache_dir)
+
+    report = test.report()
+    report["endpoint"] = self.options.endpoint
+    report["retries"] = sum(endpoint["retries"]
+        for endpoint in self.metrics.snapshot()["endpoints"].itervalues())
+    if self.mock is not None:
+      report["server"] = self.mock.stats
+    if self.options.json:
+      print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+      print(bench.FormatReport(report))
 
 
 # Contains the Tumblr interaction modules supported by tum.
 CLI_MODULES = {
   "auth": (AuthModule, "authenticate to Tumblr"),
-#  "dash": (DashModule, "open your dashboard"),
+  "bench": (BenchModule, "load-test the Tumblr client"),
+  "daemon": (DaemonModule, "serve tum commands from a warm client"),
+  "dash": (DashModule, "open your dashboard"),
+  "flush": (FlushModule, "send posts spooled by tum post --spool"),
+  "mirror": (MirrorModule, "bring a pulled blog up to date"),
   "post": (PostModule, "make a post"),
-#  "pull": (PullModule, "download content from a post"),
+  "repack": (RepackModule, "compact an archive made by tum pull"),
+  "search": (SearchModule, "search the posts tum has fetched"),
+  "pull": (PullModule, "download content from a post"),
 }
 
+# Contains the modules which always run in their own process, rather than
+# being sent to the tum daemon.
+LOCAL_MODULES = ("auth", "bench", "daemon")
+
 
 if __name__ in "__main__":
   ch = CLIHandler()
@@ -1,14 +1,24 @@
 #!/usr/bin/python
 #
 # tumblr_client
-import pdb
 import ConfigParser
+import connection_pool
+import httplib
+import http_cache
 import httplib2
+import json
+import multipart
 import oauth2 as oauth
 import os
+import post_decoder
+import Queue
+import threading
+import time
+import timings
 import urllib
 import urlparse
 
+from metrics import Metrics
 from tum import TumError
 
 # Contains default URLs for authorizing to Tumblr's OAuth API.
@@ -17,10 +27,27 @@ AUTHORIZE_URL = "http://www.tumblr.com/oauth/authorize"
 ACCESS_TOKEN_URL = "http://www.tumblr.com/oauth/access_token"
 
 # Contains the default location for the cache of all Tumblr content.
-DEFAULT_CACHE_LOC = ".tum_cache"
+DEFAULT_CACHE_LOC = ".tum_cache.db"
 
 TUMBLR_API_URL = "http://%s/v2/%s"
 
+# Contains the HTTP statuses with which the Tumblr API reports success.
+SUCCESS_STATUSES = ("200", "201")
+
+# Contains the largest number of posts the API returns in one page.
+MAX_PAGE_SIZE = 20
+
+# Contains the default number of pages fetched ahead of the one being read.
+DEFAULT_PREFETCH_PAGES = 2
+
+# Contains the most seconds a caller which stops reading pages waits for the
+# page being fetched in the background.
+FETCHER_JOIN_TIMEOUT = 5.0
+
+# Contains the most seconds after being signed that a post signed ahead of
+# time is sent as it is, rather than signed afresh.
+PRESIGNED_MAX_AGE = 60
+
 
 def GenerateTumblrCredentials(credfile_loc):
   """
@@ -85,13 +112,107 @@ def GenerateTumblrCredentials(credfile_loc):
   return consumer_key, access_token
 
 
+class ApiError(TumError):
+  """
+  Raised when the Tumblr API answers a request with an error status.
+  """
+
+  def __init__(self, message, status=None, headers=None):
+    TumError.__init__(self, message)
+    self.status = status
+    self.headers = headers or {}
+
+
+def ParseApiResponse(status, content, action, headers=None, posts_key=None):
+  """
+  Checks the status of a Tumblr API response and decodes its payload.
+
+  Args:
+    status - string containing the HTTP status of the response
+    content - string containing the response body
+    action - string describing the request, used in error messages
+    headers - dictionary containing the response headers, kept on any error
+    posts_key - name of the member of the response listing posts, if any,
+        which are read into lazily decoded Post objects
+
+  Returns:
+    the decoded "response" member of the API's JSON envelope
+  """
+
+  if status not in SUCCESS_STATUSES:
+    raise ApiError("%s failed (HTTP %s): %s" % (action, status, content),
+        status, headers)
+  try:
+    if posts_key:
+      return post_decoder.DecodeResponse(content, posts_key)
+    return json.loads(content).get("response")
+  except (ValueError, AttributeError):
+    raise TumError("%s returned an invalid response: %s" % (action, content))
+
+
+class PooledOAuthClient(oauth.Client):
+  """
+  An OAuth client which sends its requests over a shared ConnectionPool
+  rather than httplib2's single connection per host.
+  """
+
+  def __init__(self, consumer, token=None, cache=None, timeout=None,
+      pool=None):
+    oauth.Client.__init__(self, consumer, token=token, cache=cache,
+        timeout=timeout)
+    self.pool = pool or connection_pool.ConnectionPool(timeout=timeout)
+
+  def request(self, uri, method="GET", body="", headers=None, **kwargs):
+    if method != "GET":
+      return oauth.Client.request(self, uri, method, body, headers, **kwargs)
+    # Signs GETs in the Authorization header rather than the query string, so
+    # that each response is cached under its plain URL instead of one with a
+    # fresh nonce in it.
+    with timings.Phase("sign"):
+      req = oauth.Request.from_consumer_and_token(self.consumer,
+          token=self.token, http_method=method, http_url=uri)
+      req.sign_request(self.method, self.consumer, self.token)
+      headers = dict(headers or {})
+      headers.update(req.to_header())
+    return httplib2.Http.request(self, uri, method=method, headers=headers,
+        **kwargs)
+
+  def _sign(self, uri, method, body, headers, parameters):
+    with timings.Phase("sign"):
+      return oauth.Client._sign(self, uri, method, body, headers, parameters)
+
+  def request_signed(self, req):
+    """
+    Sends a form-encoded oauth2.Request which has already been signed.
+    """
+    return httplib2.Http.request(self, req.url, method=req.method,
+        body=req.to_postdata(),
+        headers={"Content-Type": "application/x-www-form-urlencoded"})
+
+  def _conn_request(self, conn, request_uri, method, body, headers):
+    # httplib2 hands us the placeholder connection it keeps per host; only its
+    # address is used, and the actual socket comes from the pool.
+    if isinstance(conn, httplib.HTTPSConnection):
+      scheme = "https"
+    else:
+      scheme = "http"
+    response, content = self.pool.request(scheme, conn.host, conn.port,
+        request_uri, method=method, body=body, headers=headers)
+    response = httplib2.Response(response)
+    if method != "HEAD":
+      content = httplib2._decompressContent(response, content)
+    return response, content
+
+
 class TumblrClient(object):
   """
   Handles all interaction with the Tumblr API.
   """
 
   def __init__(self, api_key, oauth_token, oauth_token_secret,
-      api_server, cache_loc=None):
+      api_server, cache_loc=None, pool=None, prewarm=0, scheduler=None,
+      index=None, cache=None, cache_size=http_cache.DEFAULT_MAX_BYTES,
+      metrics=None):
     """
     Initializes 
     
@@ -100,6 +221,17 @@ class TumblrClient(object):
       oauth_token - string containing public OAuth token
       oauth_token_secret - string containing OAUth token secret
       api_server - string containing hostname of Tumblr API server to
+      cache_loc - location of the HTTP cache file; an existing directory is
+          used as an unbounded httplib2 file cache, as tum once did
+      pool - ConnectionPool to share with other clients, if any
+      prewarm - number of connections to the API server to open up front
+      scheduler - RequestScheduler pacing and retrying requests, if any
+      index - PostIndex to add every fetched post to, if any
+      cache - httplib2 cache object to use in place of one at cache_loc,
+          such as an SQLiteCache shared with other clients
+      cache_size - number of bytes the cache at cache_loc may hold
+      metrics - Metrics to record every request in, such as one shared with
+          other clients; by default the client keeps its own
     """
 
     self.api_key = api_key
@@ -108,25 +240,321 @@ class TumblrClient(object):
     self.oauth_token_secret = oauth_token_secret
     self.consumer = oauth.Consumer(key=self.oauth_token,
         secret=self.oauth_token_secret)
-    if not cache_loc:
-      cache_loc = "%s/%s" % (os.getenv("HOME"), DEFAULT_CACHE_LOC)
-    if not os.path.exists(cache_loc):
-      os.mkdir(cache_loc)
-    self.http_client = oauth.Client(self.consumer, cache=cache_loc)
+    if cache is None:
+      if not cache_loc:
+        cache_loc = "%s/%s" % (os.getenv("HOME"), DEFAULT_CACHE_LOC)
+      if os.path.isdir(cache_loc):
+        cache = cache_loc
+      else:
+        cache = http_cache.SQLiteCache(cache_loc, cache_size)
+    self.cache = cache
+    self.scheduler = scheduler
+    self.index = index
+    self.metrics = metrics or Metrics()
+    self.pool = pool or connection_pool.ConnectionPool()
+    self.http_client = PooledOAuthClient(self.consumer, cache=cache,
+        pool=self.pool)
+    if prewarm:
+      self.pool.prewarm("http", self.api_server, count=prewarm)
+
+  def pool_stats(self):
+    """
+    Returns a dictionary of connection pool counters: reuse hits, new
+    connects, idle evictions, DNS cache hits, and open and idle connections.
+    """
+    return self.pool.stats()
 
-  def create_post(self, blog, params={}):
+  def cache_stats(self):
+    """
+    Returns a dictionary of HTTP cache counters: hits, misses, evictions,
+    entries and bytes held, or None for a directory cache.
+    """
+    if hasattr(self.cache, "stats"):
+      return self.cache.stats()
+    return None
+
+  def create_post(self, blog, params={}, files=None, signed=None):
     """
     Creates a post at the supplied blog address.
     
     Args:
       blog - string containing the name of the blog to create a post against
       params - dictionary containing parameters 
+      files - list of (name, location) tuples naming local files or URLs to
+          upload as the post's media, or a multipart.PreparedBody already
+          encoding params and the media, such as one shared by posts to
+          several blogs
+      signed - request for the post signed ahead of time by sign_posts, if
+          any, which is sent on the first try while it is fresh
+    """
+
+    req_url = self._post_url(blog)
+    presigned = signed and [signed] or []
+    def sign():
+      # Signs every retry afresh, since the server may have recorded the
+      # nonce of the first try.
+      if presigned:
+        req = presigned.pop()
+        if time.time() - int(req["oauth_timestamp"]) < PRESIGNED_MAX_AGE:
+          return req
+      with timings.Phase("sign"):
+        req = self._post_request(req_url, params)
+        req.sign_request(self.http_client.method, self.consumer, None)
+        return req
+    if files:
+      send = lambda: self._send_multipart(req_url, params, files, sign())
+    else:
+      send = lambda: self.http_client.request_signed(sign())
+    return self._execute(blog, "Post creation", send, idempotent=False)
+
+  def sign_posts(self, posts):
+    """
+    Signs the requests creating several posts in one go, so that they share
+    the signing key and each blog's base string prefix, for create_post to
+    send on its first try.
+
+    Args:
+      posts - list of (blog, params) tuples
+
+    Returns:
+      list of signed oauth2.Requests, in the order of posts
+    """
+
+    with timings.Phase("sign"):
+      requests = [self._post_request(self._post_url(blog), params)
+          for blog, params in posts]
+      return oauth.sign_many(requests, self.http_client.method, self.consumer)
+
+  def _post_url(self, blog):
+    return TUMBLR_API_URL % (self.api_server, "blog/%s/post" % blog)
+
+  def _post_request(self, req_url, params):
+    # Covers the plain form fields alone, which is all a multipart post's
+    # signature covers too.
+    return oauth.Request.from_consumer_and_token(self.consumer,
+        http_method="POST", http_url=req_url, parameters=params,
+        is_form_encoded=True)
+
+  def _execute(self, blog, action, send, posts_key=None, idempotent=True):
+    """
+    Sends a request, through the scheduler if there is one, and returns the
+    decoded response.
+
+    Args:
+      blog - name of the blog the request concerns, or None
+      action - string describing the request, used in error messages
+      send - callable which signs and sends the request, returning an
+          httplib2.Response and the response body
+      posts_key - name of the member of the response listing posts, if any
+      idempotent - whether the request may safely be sent more than once
+    """
+
+    # Counts each try and the bytes received, for the client's metrics.
+    sent = [0, 0]
+    def counted_send():
+      sent[0] += 1
+      resp, content = send()
+      sent[1] += len(content or "")
+      return resp, content
+    def parse(resp, content):
+      with timings.Phase("parse"):
+        return ParseApiResponse(resp['status'], content, action, resp,
+            posts_key)
+    start = time.time()
+    error = None
+    try:
+      with timings.Request(action):
+        if self.scheduler is None:
+          return parse(*counted_send())
+        return self.scheduler.run(blog, counted_send, parse, idempotent)
+    except ApiError, e:
+      error = str(e.status or "api")
+      raise
+    except TumError:
+      error = "invalid"
+      raise
+    except (EnvironmentError, httplib.HTTPException):
+      error = "network"
+      raise
+    except Exception:
+      error = "other"
+      raise
+    finally:
+      self.metrics.observe(action.lower().replace(" ", "_"),
+          time.time() - start, sent[0], sent[1], error)
+
+  def _send_multipart(self, req_url, params, files, req):
+    """
+    Sends a post whose media is streamed as a multipart/form-data body,
+    given its request signed over the plain form fields.
+    """
+    # The streamed body is not hashed, so that bytes start going out without
+    # a first pass over every file.
+    headers = req.to_header()
+    if isinstance(files, multipart.PreparedBody):
+      body = files.open()
+      headers.update(files.headers())
+    else:
+      body = multipart.MultipartBody(params.items(), files)
+      headers.update(body.headers())
+    parts = urlparse.urlsplit(req_url)
+    try:
+      resp, content = self.pool.request(parts.scheme, parts.hostname,
+          parts.port, parts.path, method="POST", body=body, headers=headers)
+    finally:
+      body.close()
+    return httplib2.Response(resp), content
+
+  def _get(self, path, params, action, blog=None, posts_key=None):
+    """
+    Sends a signed GET request to a read endpoint of the API.
+    """
+    params = dict(params, api_key=self.api_key)
+    req_url = "%s?%s" % (TUMBLR_API_URL % (self.api_server, path),
+        urllib.urlencode(params))
+    return self._execute(blog, action,
+        lambda: self.http_client.request(req_url, method="GET"), posts_key)
+
+  def blog_info(self, blog):
+    """
+    Returns general information about a blog.
+    """
+    return self._get("blog/%s/info" % blog, {}, "Blog info", blog)
+
+  def posts(self, blog, post_type=None, **params):
+    """
+    Returns a page of a blog's posts.
+
+    Args:
+      blog - string containing the name of the blog to read from
+      post_type - string restricting the results to a single post type
+      params - additional API parameters, such as offset, limit and tag
+    """
+
+    path = "blog/%s/posts" % blog
+    if post_type:
+      path = "%s/%s" % (path, post_type)
+    return self._indexed(self._get(path, params, "Post retrieval", blog,
+        "posts"), "posts")
+
+  def iter_posts(self, blog, post_type=None, prefetch=DEFAULT_PREFETCH_PAGES,
+      **params):
     """
+    Lazily yields a blog's posts, newest first, fetching pages in the
+    background as iter_dashboard does.
 
-    req_url = TUMBLR_API_URL % (self.api_server, "blog/%s/post" % blog)
-    resp, content = self.http_client.request(
-        req_url, method="POST", body=urllib.urlencode(params))
-    pdb.set_trace()
-    if resp['status'] != '200':
-      raise TumError(
-          "Post creation failed (HTTP %s): %s" % (resp['status'], content))
+    Args:
+      blog - string containing the name of the blog to read
+      post_type - type of post to restrict results to, if any
+      prefetch - number of pages fetched ahead of the one being read
+      params - further retrieval parameters, such as tag
+    """
+    fetch = lambda **page_params: self.posts(blog, post_type, **page_params)
+    return self._iter_pages(fetch, "posts", params, prefetch)
+
+  def dashboard(self, **params):
+    """
+    Returns a page of the authenticated user's dashboard.
+    """
+    return self._indexed(self._get("user/dashboard", params,
+        "Dashboard retrieval", posts_key="posts"), "posts")
+
+  def iter_dashboard(self, prefetch=DEFAULT_PREFETCH_PAGES, **params):
+    """
+    Lazily yields the posts on the authenticated user's dashboard, newest
+    first.  Pages are fetched on a background thread, which stays up to
+    prefetch pages ahead of the caller, so the client must not be used for
+    anything else until the generator is exhausted or closed.
+
+    Args:
+      prefetch - number of pages fetched ahead of the one being read
+      params - dashboard parameters, such as type or since_id
+    """
+    return self._iter_pages(self.dashboard, "posts", params, prefetch)
+
+  def _fetch_pages(self, fetch, key, params, pages, stop):
+    params = dict(params)
+    params.setdefault("limit", MAX_PAGE_SIZE)
+    offset = int(params.pop("offset", 0))
+    try:
+      while not stop.is_set():
+        response = fetch(offset=offset, **params)
+        items = response.get(key) or []
+        page = (items, None)
+        # Blocks while the caller is prefetch pages behind, waking now and
+        # then to see whether it has gone away.
+        while not stop.is_set():
+          try:
+            pages.put(page, timeout=0.1)
+            break
+          except Queue.Full:
+            pass
+        if len(items) < int(params["limit"]):
+          break
+        offset += len(items)
+    except Exception, e:
+      if stop.is_set():
+        # Drops errors once the caller has gone away, such as those raised
+        # by a request cut short as the interpreter shuts down.
+        return
+      page = ([], e)
+    else:
+      page = None
+    while not stop.is_set():
+      try:
+        pages.put(page, timeout=0.1)
+        return
+      except Queue.Full:
+        pass
+
+  def _iter_pages(self, fetch, key, params, prefetch):
+    """
+    Yields the items listed under key in successive pages from fetch, which
+    is called with an offset and the given parameters on a background thread.
+    """
+    pages = Queue.Queue(max(1, prefetch))
+    stop = threading.Event()
+    fetcher = threading.Thread(target=self._fetch_pages,
+        args=(fetch, key, params, pages, stop))
+    fetcher.daemon = True
+    fetcher.start()
+    try:
+      while True:
+        # Waits with a timeout, since an untimed wait cannot be interrupted.
+        try:
+          page = pages.get(timeout=1)
+        except Queue.Empty:
+          continue
+        if page is None:
+          return
+        items, error = page
+        if error is not None:
+          raise error
+        for item in items:
+          yield item
+    finally:
+      stop.set()
+      # Waits for a request in flight to finish, so that the fetcher is not
+      # cut short by the interpreter shutting down, but not indefinitely.
+      fetcher.join(FETCHER_JOIN_TIMEOUT)
+
+  def likes(self, **params):
+    """
+    Returns a page of the authenticated user's liked posts.
+    """
+    return self._indexed(self._get("user/likes", params, "Likes retrieval",
+        posts_key="liked_posts"), "liked_posts")
+
+  def _indexed(self, response, key):
+    """
+    Adds the posts listed under key in a response to the index, if any.
+    """
+    if self.index is not None and response:
+      self.index.add_posts(response.get(key))
+    return response
+
+  def user_info(self):
+    """
+    Returns information about the authenticated user.
+    """
+    return self._get("user/info", {}, "User info")